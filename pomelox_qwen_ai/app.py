@@ -1,18 +1,40 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 from config import Config
-import dashscope
 import uuid
 import json
 import os
-from rag_service import retrieve, get_system_prompt
+import time
+from functools import lru_cache
+from rag_service import retrieve, get_system_prompt, warmup, get_index_cache_stats
+from faq_answers import has_faq_answers, match_faq
+from prompt_cache import choose_layout, record_usage, get_prompt_cache_stats, reset_prompt_cache_stats
+from http_transport import load_dashscope, get_transport_stats
+from event_log import annotate, stage, log_event, get_event_log_stats, init_app as init_event_log
+from profiling import (
+    arming, sampler, admin_required, get_profiling_stats, init_app as init_profiling,
+    PROFILE_MODES, MODE_CPROFILE,
+)
+from http_caching import CachedBody, StaticFile, cached_response, json_response, init_app as init_http_caching
+from upstream import scheduler, UpstreamSaturated, UpstreamTimeout, PRIORITY_INTERACTIVE
+from prefetch import (
+    prefetch, cancel as cancel_prefetch, find as find_prefetch, get_prefetch_stats,
+    ACCEPTED as PREFETCH_ACCEPTED, RATE_LIMITED as PREFETCH_RATE_LIMITED,
+)
+from query_router import (
+    route_query, record_retrieval_latency, get_router_stats,
+    ROUTE_DIRECT, ROUTE_WEB_SEARCH,
+)
 
 # Initialize Flask application
 app = Flask(__name__)
 CORS(app)  # Enable CORS for cross-origin requests
+init_http_caching(app)  # gzip/brotli compression for large responses
+init_event_log(app)  # One structured JSON-lines event per request
+init_profiling(app)  # Admin-gated request profiling and stack sampler
 
-# Set Qwen API key
-dashscope.api_key = Config.DASHSCOPE_API_KEY
+# Frontend page, kept in memory with precompressed variants
+index_page = StaticFile(os.path.join(os.path.dirname(__file__), 'index.html'), 'text/html')
 
 # Chat history storage path
 CHAT_HISTORY_PATH = os.path.join(os.path.dirname(__file__), 'chat_history.json')
@@ -30,7 +52,7 @@ def load_chat_history():
             with open(CHAT_HISTORY_PATH, 'r', encoding='utf-8') as f:
                 return json.load(f)
         except Exception as e:
-            print(f"Failed to load chat history: {e}")
+            log_event('chat_history_load_failed', level='error', error=str(e))
             return []
     return []
 
@@ -42,7 +64,7 @@ def save_chat_history(history):
             json.dump(history, f, ensure_ascii=False, indent=2)
         return True
     except Exception as e:
-        print(f"Failed to save chat history: {e}")
+        log_event('chat_history_save_failed', level='error', error=str(e))
         return False
 
 
@@ -50,7 +72,8 @@ def save_chat_history(history):
 def get_chat_history():
     """Get all chat history"""
     history = load_chat_history()
-    return jsonify({'chats': history})
+    # Clients polling an unchanged history get 304 instead of the full list
+    return json_response({'chats': history}, Config.CHAT_HISTORY_CACHE_CONTROL)
 
 
 @app.route('/chat-history', methods=['POST'])
@@ -126,7 +149,7 @@ def clear_all_chats():
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
 
-def call_ai_with_web_search(messages, enable_search=False, search_strategy='standard'):
+def call_ai_with_web_search(messages, enable_search=False, search_strategy='standard', prompt_layout=None):
     """
     Call Qwen API with web search support
 
@@ -134,6 +157,7 @@ def call_ai_with_web_search(messages, enable_search=False, search_strategy='stan
         messages: Message list
         enable_search: Whether to enable web search
         search_strategy: Search strategy ('standard' or 'pro')
+        prompt_layout: Layout of the system prompt, recorded with the token usage
 
     Returns:
         tuple: (answer, sources) - Answer content and source information
@@ -152,9 +176,19 @@ def call_ai_with_web_search(messages, enable_search=False, search_strategy='stan
             'enable_citation': True
         }
 
-    response = dashscope.Generation.call(**call_params)
+    # DashScope SDK is imported (and its API key set) on first use
+    dashscope = load_dashscope()
+    start = time.perf_counter()
+    response = scheduler.call(
+        dashscope.Generation.call,
+        priority=PRIORITY_INTERACTIVE,
+        timeout=Config.UPSTREAM_CALL_TIMEOUT,
+        **call_params
+    )
 
     if response.status_code == 200:
+        if prompt_layout is not None:
+            record_usage(prompt_layout, response.usage, time.perf_counter() - start)
         answer = response.output.choices[0].message.content
         # Get search source information (if available)
         sources = None
@@ -173,12 +207,61 @@ def call_ai_with_web_search(messages, enable_search=False, search_strategy='stan
                 if hasattr(response.output, 'web_search'):
                     sources = response.output.web_search
         except Exception as e:
-            print(f"[Web Search] Error getting sources: {e}")
+            log_event('web_search_sources_failed', level='warning', error=str(e))
         return answer, sources
     else:
         raise Exception(f'API call failed: {response.message}')
 
 
+def resolve_school(data):
+    """
+    Map the request's school_id or deptId to a configured school
+
+    Args:
+        data: Request JSON
+
+    Returns:
+        tuple: (school_id, None), or (None, error response) if neither identifies a school
+    """
+    # Accept either a department ID or an explicit school_id from the client.
+    # Support both camelCase and snake_case for both keys.
+    dept_id = data.get('deptId') or data.get('dept_id')
+    school_id_param = data.get('school_id') or data.get('schoolId')
+
+    # If client provided school_id directly, use it (validate exists)
+    if school_id_param:
+        if school_id_param not in Config.SCHOOLS:
+            return None, (jsonify({'error': f'Unknown school_id: {school_id_param}'}), 400)
+        annotate(school_id=school_id_param, school_match='school_id')
+        return school_id_param, None
+
+    # Otherwise, require deptId and map to a school
+    if not dept_id:
+        return None, (jsonify({
+            'error': 'deptId cannot be empty when school_id is not provided',
+            'available_dept_ids': list(Config.DEPT_TO_SCHOOL.keys())
+        }), 400)
+
+    # Ensure dept_id is an integer
+    try:
+        dept_id = int(dept_id)
+    except (ValueError, TypeError):
+        return None, (jsonify({
+            'error': f'Invalid department ID format: {dept_id}',
+            'available_dept_ids': list(Config.DEPT_TO_SCHOOL.keys())
+        }), 400)
+
+    # Get school_id through deptId mapping
+    school_id = Config.DEPT_TO_SCHOOL.get(dept_id)
+    if not school_id:
+        return None, (jsonify({
+            'error': f'School not found for department ID: {dept_id}',
+            'available_dept_ids': list(Config.DEPT_TO_SCHOOL.keys())
+        }), 400)
+    annotate(school_id=school_id, school_match='dept_id', dept_id=dept_id)
+    return school_id, None
+
+
 @app.route('/ask', methods=['POST'])
 def ask_ai():
     """AI Q&A endpoint (integrated with RAG)"""
@@ -201,48 +284,13 @@ def ask_ai():
         session_id = data.get('session_id', str(uuid.uuid4()))
         question = data.get('question', '')
 
-        # Accept either a department ID or an explicit school_id from the client.
-        # Support both camelCase and snake_case for both keys.
-        dept_id = data.get('deptId') or data.get('dept_id')
-        school_id_param = data.get('school_id') or data.get('schoolId')
-
         # Validate question parameter
         if not question or not isinstance(question, str):
             return jsonify({'error': 'Question cannot be empty and must be a string'}), 400
 
-        school_id = None
-
-        # If client provided school_id directly, use it (validate exists)
-        if school_id_param:
-            if school_id_param not in Config.SCHOOLS:
-                return jsonify({'error': f'Unknown school_id: {school_id_param}'}), 400
-            school_id = school_id_param
-            print(f"[Auth] Matched school via school_id parameter: {school_id}")
-        else:
-            # Otherwise, require deptId and map to a school
-            if not dept_id:
-                return jsonify({
-                    'error': 'deptId cannot be empty when school_id is not provided',
-                    'available_dept_ids': list(Config.DEPT_TO_SCHOOL.keys())
-                }), 400
-
-            # Ensure dept_id is an integer
-            try:
-                dept_id = int(dept_id)
-            except (ValueError, TypeError):
-                return jsonify({
-                    'error': f'Invalid department ID format: {dept_id}',
-                    'available_dept_ids': list(Config.DEPT_TO_SCHOOL.keys())
-                }), 400
-
-            # Get school_id through deptId mapping
-            school_id = Config.DEPT_TO_SCHOOL.get(dept_id)
-            if not school_id:
-                return jsonify({
-                    'error': f'School not found for department ID: {dept_id}',
-                    'available_dept_ids': list(Config.DEPT_TO_SCHOOL.keys())
-                }), 400
-            print(f"[Auth] Matched school via deptId={dept_id}: {school_id}")
+        school_id, error = resolve_school(data)
+        if error is not None:
+            return error
 
         # If session doesn't exist, create new session
         if session_id not in sessions:
@@ -259,19 +307,78 @@ def ask_ai():
                 'messages': []
             }
 
-        # RAG retrieve relevant content, get content, score and quality flag
-        retrieved_content, max_score, has_high_quality = retrieve(school_id, question)
+        # The question is submitted: a prefetch of its draft still waiting is no longer useful
+        if Config.PREFETCH_ENABLED:
+            cancel_prefetch(session_id)
+
+        # Route the question before paying for embedding, retrieval and rerank
+        route = route_query(question, school_id)
+
+        # Reuse the embedding / dense candidates prefetched while the question was typed.
+        # Candidates of a draft the question extends are only a candidate set: every one
+        # of them is reranked with the actual question
+        query_embedding, candidates, rerank_all = None, None, False
+        if Config.PREFETCH_ENABLED and route not in (ROUTE_DIRECT, ROUTE_WEB_SEARCH):
+            prefetched = find_prefetch(school_id, question)
+            if prefetched is not None:
+                query_embedding, candidates = prefetched['embedding'], prefetched['candidates']
+                rerank_all = not prefetched['exact']
+
+        # First-turn questions close to a FAQ question get its pre-generated answer;
+        # otherwise the question embedding is reused by retrieval
+        faq_match = None
+        if route not in (ROUTE_DIRECT, ROUTE_WEB_SEARCH) and not sessions[session_id]['messages'] \
+                and has_faq_answers(school_id):
+            with stage('faq_match'):
+                faq_match, query_embedding = match_faq(school_id, question, query_embedding=query_embedding)
+
+        if faq_match is not None:
+            sessions[session_id]['messages'].append({'role': 'user', 'content': question})
+            sessions[session_id]['messages'].append({'role': 'assistant', 'content': faq_match['answer']})
+            annotate(source_type='knowledge_base', faq_hit=True, rag_score=faq_match['rag_score'])
+            return jsonify({
+                'session_id': session_id,
+                'school_id': school_id,
+                'question': question,
+                'answer': faq_match['answer'],
+                'source_type': 'knowledge_base',
+                'route': route,
+                'rag_score': round(faq_match['rag_score'], 3),
+                'faq_match': {
+                    'question': faq_match['question'],
+                    'similarity': round(faq_match['similarity'], 3),
+                },
+            })
 
-        # Determine if web search should be enabled
-        use_web_search = False
-        if not has_high_quality and Config.ENABLE_WEB_SEARCH_FALLBACK:
+        if route == ROUTE_DIRECT:
+            # Small talk / general question: answer directly without retrieval
+            retrieved_content, max_score = "", 0.0
+            use_web_search = False
+        elif route == ROUTE_WEB_SEARCH:
+            # Obviously time-sensitive question: the knowledge base cannot be current
+            retrieved_content, max_score = "", 0.0
             use_web_search = True
-            print(f"[RAG] Retrieval score: {max_score:.3f}, below high-quality threshold, enabling web search")
         else:
-            print(f"[RAG] Retrieval score: {max_score:.3f}, using knowledge base content")
-
-        # Generate system prompt
-        system_prompt = get_system_prompt(school_id, retrieved_content, use_web_search)
+            # RAG retrieve relevant content, get content, score and quality flag
+            retrieve_start = time.perf_counter()
+            with stage('retrieve'):
+                # Only the embedding and rerank calls inside retrieve() take upstream slots
+                retrieved_content, max_score, has_high_quality = retrieve(
+                    school_id, question,
+                    query_embedding=query_embedding,
+                    candidates=candidates,
+                    rerank_all=rerank_all
+                )
+            record_retrieval_latency(time.perf_counter() - retrieve_start)
+
+            # Enable web search when the knowledge base has no high-quality match
+            use_web_search = not has_high_quality and Config.ENABLE_WEB_SEARCH_FALLBACK
+            annotate(rag_score=round(max_score, 4), has_high_quality=has_high_quality,
+                     web_search_fallback=use_web_search)
+
+        # Generate system prompt (the layout is fixed per session while A/B testing)
+        prompt_layout = choose_layout(session_id)
+        system_prompt = get_system_prompt(school_id, retrieved_content, use_web_search, layout=prompt_layout)
 
         # Build message list
         messages = [{'role': 'system', 'content': system_prompt}]
@@ -279,11 +386,13 @@ def ask_ai():
         messages.append({'role': 'user', 'content': question})
 
         # Call Qwen API (enable web search if needed)
-        answer, sources = call_ai_with_web_search(
-            messages,
-            enable_search=use_web_search,
-            search_strategy=Config.WEB_SEARCH_STRATEGY
-        )
+        with stage('generate'):
+            answer, sources = call_ai_with_web_search(
+                messages,
+                enable_search=use_web_search,
+                search_strategy=Config.WEB_SEARCH_STRATEGY,
+                prompt_layout=prompt_layout
+            )
 
         # Save conversation history (don't save system prompt, only user dialogue)
         sessions[session_id]['messages'].append({'role': 'user', 'content': question})
@@ -295,24 +404,66 @@ def ask_ai():
             'school_id': school_id,
             'question': question,
             'answer': answer,
-            'source_type': 'web_search' if use_web_search else 'knowledge_base',
+            'source_type': 'web_search' if use_web_search else ('direct' if route == ROUTE_DIRECT else 'knowledge_base'),
+            'route': route,
             'rag_score': round(max_score, 3)
         }
 
+        annotate(source_type=response_data['source_type'], history_turns=len(sessions[session_id]['messages']) // 2)
+
         # If web search sources exist, add to response
         if sources:
             response_data['web_sources'] = sources
 
         return jsonify(response_data)
 
+    except UpstreamSaturated as e:
+        # Fail fast instead of holding a request thread while upstream is slow
+        annotate(error=str(e))
+        response = jsonify({'error': f'Service busy, please retry later: {str(e)}'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    except UpstreamTimeout as e:
+        annotate(error=str(e))
+        return jsonify({'error': f'Upstream timeout: {str(e)}'}), 504
     except Exception as e:
         # Catch all exceptions and return appropriate error message
         error_msg = str(e)
+        annotate(error=error_msg)
         if "Failed to decode JSON object" in error_msg:
             return jsonify({'error': 'Request body must be valid JSON format'}), 400
         return jsonify({'error': f'Server error: {error_msg}'}), 500
 
 
+@app.route('/prefetch', methods=['POST'])
+def prefetch_draft():
+    """Start embedding and searching a draft question while the user is typing"""
+    if not Config.PREFETCH_ENABLED:
+        return jsonify({'status': 'disabled'}), 404
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Request body must be valid JSON format'}), 400
+    draft = data.get('draft') or data.get('question') or ''
+    if not isinstance(draft, str):
+        return jsonify({'error': 'draft must be a string'}), 400
+    school_id, error = resolve_school(data)
+    if error is not None:
+        return error
+
+    # Rate limits apply per session; clients without one are limited by address
+    client_key = data.get('session_id') or request.remote_addr or 'anonymous'
+    status = prefetch(client_key, school_id, draft)
+    annotate(prefetch=status)
+    if status == PREFETCH_RATE_LIMITED:
+        response = jsonify({'status': status})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(max(1, round(Config.PREFETCH_MIN_INTERVAL)))
+        return response
+    # The embedding runs in the background; this request does not wait for it
+    return jsonify({'status': status}), 202 if status == PREFETCH_ACCEPTED else 200
+
+
 @app.route('/history/<session_id>', methods=['GET'])
 def get_history(session_id):
     """Query conversation history endpoint"""
@@ -342,20 +493,109 @@ def clear_session(session_id):
         return jsonify({'error': f'Server error: {str(e)}'}), 500
 
 
+@lru_cache(maxsize=1)
+def _schools_body():
+    """Schools list never changes at runtime, serialize it once"""
+    body = app.json.dumps({'schools': Config.SCHOOLS}).encode('utf-8') + b'\n'
+    return CachedBody(body, 'application/json', static=True)
+
+
 @app.route('/schools', methods=['GET'])
 def list_schools():
     """Get available schools list endpoint"""
-    return jsonify({
-        'schools': Config.SCHOOLS
-    })
+    return cached_response(_schools_body(), Config.SCHOOLS_CACHE_CONTROL)
+
+
+@app.route('/router-stats', methods=['GET'])
+def router_stats():
+    """Query router decisions and estimated retrieval latency saved"""
+    return jsonify(get_router_stats())
+
+
+@app.route('/index-cache-stats', methods=['GET'])
+def index_cache_stats():
+    """Loaded school indexes, their estimated memory and LRU eviction counts"""
+    return jsonify(get_index_cache_stats())
+
+
+@app.route('/prefetch-stats', methods=['GET'])
+def prefetch_stats():
+    """Prefetch outcomes and how often /ask reused prefetched work"""
+    return jsonify(get_prefetch_stats())
+
+
+@app.route('/prompt-cache-stats', methods=['GET'])
+def prompt_cache_stats():
+    """Provider context-cache usage and generation latency per prompt layout"""
+    return jsonify(get_prompt_cache_stats())
+
+
+@app.route('/admin/prompt-cache-stats/reset', methods=['POST'])
+@admin_required
+def reset_prompt_cache():
+    """Start a new A/B measurement"""
+    reset_prompt_cache_stats()
+    return jsonify(get_prompt_cache_stats())
+
+
+@app.route('/admin/profile', methods=['GET'])
+@admin_required
+def profile_status():
+    """Armed profiling trigger, sampler state and recent dumps"""
+    return jsonify(get_profiling_stats())
+
+
+@app.route('/admin/profile', methods=['POST'])
+@admin_required
+def arm_profile():
+    """Profile the next N matching requests"""
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode', MODE_CPROFILE)
+    if mode not in PROFILE_MODES:
+        return jsonify({'error': f'mode must be one of {list(PROFILE_MODES)}'}), 400
+    try:
+        count = int(data.get('requests', 1))
+    except (ValueError, TypeError):
+        return jsonify({'error': 'requests must be an integer'}), 400
+    if not 0 <= count <= 100:
+        return jsonify({'error': 'requests must be between 0 and 100'}), 400
+
+    arming.arm(count, mode, data.get('path_prefix', '/ask'))
+    return jsonify(get_profiling_stats())
+
+
+@app.route('/admin/profile/dumps/<name>', methods=['GET'])
+@admin_required
+def download_profile(name):
+    """Download a pstats or collapsed-stack dump"""
+    return send_from_directory(Config.PROFILE_OUTPUT_DIR, name, as_attachment=True)
+
+
+@app.route('/admin/sampler', methods=['GET'])
+@admin_required
+def sampler_stacks():
+    """Always-on sampler profile in collapsed-stack format"""
+    return Response(sampler.collapsed(), mimetype='text/plain')
+
+
+@app.route('/admin/sampler', methods=['POST'])
+@admin_required
+def configure_sampler():
+    """Enable, disable or reset the always-on sampler"""
+    data = request.get_json(silent=True) or {}
+    if data.get('reset'):
+        sampler.reset()
+    if 'enabled' in data:
+        sampler.set_enabled(bool(data['enabled']))
+    return jsonify(sampler.stats())
 
 
 @app.route('/', methods=['GET'])
 def serve_index():
     """Serve the frontend index page if present."""
     try:
-        return send_from_directory(os.path.dirname(__file__), 'index.html')
-    except Exception:
+        return cached_response(index_page.get(), Config.INDEX_CACHE_CONTROL)
+    except OSError:
         return jsonify({'error': 'Index page not found'}), 404
 
 
@@ -366,16 +606,23 @@ def catch_all(unused_path):
     This will only be reached when no other route matches (so API endpoints are safe).
     """
     try:
-        return send_from_directory(os.path.dirname(__file__), 'index.html')
-    except Exception:
+        return cached_response(index_page.get(), Config.INDEX_CACHE_CONTROL)
+    except OSError:
         return jsonify({'error': 'Index page not found'}), 404
 
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    """Health check endpoint"""
-    return jsonify({'status': 'healthy'})
+    """Health check endpoint (never touches upstream, stays responsive during brownouts)"""
+    return jsonify({
+        'status': 'healthy',
+        'upstream': scheduler.stats(),
+        'transport': get_transport_stats(),
+        'event_log': get_event_log_stats(),
+    })
 
 
 if __name__ == '__main__':
+    if Config.RAG_WARMUP_ON_START:
+        print(f"[Startup] Warmed up knowledge bases: {warmup()}")
     app.run(host=Config.HOST, port=Config.PORT, debug=Config.DEBUG)
@@ -0,0 +1,166 @@
+"""
+预派生（pre-fork）服务模式基准
+分别以 1、2、4、8 个 worker 启动 gunicorn（见 gunicorn.conf.py），对不调用上游模型的
+接口施加并发负载，记录吞吐量以及每个 worker 的 RSS / PSS / 私有内存，
+结果写入 benchmarks/serving_profile.json
+
+PSS 按共享进程数分摊共享页，能直接反映 gc.freeze 后写时复制页面的共享效果
+"""
+import http.client
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'serving_profile.json')
+
+WORKER_COUNTS = (1, 2, 4, 8)
+DURATION_SECONDS = 10
+CLIENT_PROCESSES = 4
+# 只压测不依赖 DashScope 的接口，结果不受上游延迟影响
+ENDPOINTS = ('/schools', '/health', '/router-stats')
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def child_pids(pid: int) -> list:
+    """读取 /proc 获取 gunicorn master 的子进程（即 worker）"""
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'r') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            if int(fields[1]) == pid:
+                children.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return children
+
+
+def memory_kb(pid: int) -> dict:
+    """RSS、PSS 与私有内存（KB），来自 /proc/<pid>/smaps_rollup"""
+    result = {'rss': 0, 'pss': 0, 'private': 0}
+    with open(f'/proc/{pid}/smaps_rollup', 'r') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key == 'Rss':
+                result['rss'] = int(value.split()[0])
+            elif key == 'Pss':
+                result['pss'] = int(value.split()[0])
+            elif key in ('Private_Clean', 'Private_Dirty'):
+                result['private'] += int(value.split()[0])
+    return result
+
+
+def wait_until_ready(port: int, master_pid: int, workers: int, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/health')
+            if conn.getresponse().status == 200 and len(child_pids(master_pid)) >= workers:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError('gunicorn 未能在限定时间内就绪')
+
+
+def client_loop(args) -> int:
+    """单个压测进程：keep-alive 连接循环请求，返回完成的请求数"""
+    port, duration = args
+    completed = 0
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    deadline = time.monotonic() + duration
+    i = 0
+    while time.monotonic() < deadline:
+        try:
+            conn.request('GET', ENDPOINTS[i % len(ENDPOINTS)])
+            response = conn.getresponse()
+            response.read()
+            if response.status == 200:
+                completed += 1
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        i += 1
+    conn.close()
+    return completed
+
+
+def run_one(workers: int, gc_freeze: bool) -> dict:
+    port = free_port()
+    env = dict(os.environ, SERVE_GC_FREEZE='true' if gc_freeze else 'false')
+    master = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+         '-b', f'127.0.0.1:{port}', '-w', str(workers), 'wsgi:application'],
+        cwd=PROJECT_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(port, master.pid, workers)
+
+        with multiprocessing.Pool(CLIENT_PROCESSES) as pool:
+            start = time.monotonic()
+            counts = pool.map(client_loop, [(port, DURATION_SECONDS)] * CLIENT_PROCESSES)
+            elapsed = time.monotonic() - start
+
+        worker_memory = [memory_kb(pid) for pid in child_pids(master.pid)]
+        master_memory = memory_kb(master.pid)
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait(timeout=60)
+
+    def avg(key):
+        return round(sum(m[key] for m in worker_memory) / len(worker_memory) / 1024, 1)
+
+    return {
+        'workers': workers,
+        'requests_per_second': round(sum(counts) / elapsed, 1),
+        'worker_rss_mb': avg('rss'),
+        'worker_pss_mb': avg('pss'),
+        'worker_private_mb': avg('private'),
+        'master_rss_mb': round(master_memory['rss'] / 1024, 1),
+        'total_pss_mb': round((sum(m['pss'] for m in worker_memory) + master_memory['pss']) / 1024, 1),
+    }
+
+
+def main():
+    gc_freeze = '--no-gc-freeze' not in sys.argv
+    label = 'gc_freeze' if gc_freeze else 'no_gc_freeze'
+
+    print(f"模式: {label}, 每组压测 {DURATION_SECONDS}s, {CLIENT_PROCESSES} 个客户端进程, CPU 核数: {os.cpu_count()}")
+    print(f"{'workers':>8}{'req/s':>10}{'RSS/worker':>12}{'PSS/worker':>12}{'私有/worker':>12}{'总 PSS':>10}")
+    results = []
+    for workers in WORKER_COUNTS:
+        result = run_one(workers, gc_freeze)
+        results.append(result)
+        print(f"{result['workers']:>8}{result['requests_per_second']:>10}{result['worker_rss_mb']:>12}"
+              f"{result['worker_pss_mb']:>12}{result['worker_private_mb']:>12}{result['total_pss_mb']:>10}")
+
+    profile = {}
+    if os.path.exists(PROFILE_PATH):
+        with open(PROFILE_PATH, 'r', encoding='utf-8') as f:
+            profile = json.load(f)
+    profile['cpu_count'] = os.cpu_count()
+    profile[label] = results
+    with open(PROFILE_PATH, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入: {PROFILE_PATH}")
+
+
+if __name__ == "__main__":
+    # 用法 (仅 Linux):
+    #   python benchmarks/bench_serving.py                 - gc.freeze 模式
+    #   python benchmarks/bench_serving.py --no-gc-freeze  - 对照组
+    main()
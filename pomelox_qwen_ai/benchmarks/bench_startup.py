@@ -0,0 +1,115 @@
+"""
+启动耗时基准
+使用 `python -X importtime` 统计应用启动时各模块的导入耗时，
+并与 benchmarks/startup_profile.json 中记录的基线对比，便于发现启动回归
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_profile.json')
+
+# 基准场景: 名称 -> 在子进程中执行的代码
+SCENARIOS = {
+    # 快速启动路径: 只导入 Flask 应用，不加载 RAG 依赖
+    'app_import': 'import app',
+    # 首次检索前需要付出的代价: 导入 llama-index 与 DashScope 依赖
+    'app_import_with_rag_deps': 'import app; import rag_service; rag_service._load_dependencies()',
+}
+
+REPEATS = 5
+TOP_N = 10
+REGRESSION_TOLERANCE = 0.2   # 超过基线 20% 视为回归
+
+
+def run_importtime(code: str) -> tuple:
+    """
+    在干净的子进程中执行代码并解析 -X importtime 输出
+
+    Returns:
+        tuple: (墙钟耗时 ms, 导入总耗时 ms, {顶层包: 自身耗时 ms})
+    """
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        cwd=PROJECT_DIR, capture_output=True, text=True, check=True,
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    total_us = 0
+    by_package = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _cumulative_us, module = line[len('import time:'):].split('|')
+        package = module.strip().split('.')[0]
+        by_package[package] = by_package.get(package, 0) + int(self_us)
+        total_us += int(self_us)
+
+    return wall_ms, total_us / 1000, {k: v / 1000 for k, v in by_package.items()}
+
+
+def profile_scenario(code: str) -> dict:
+    """多次运行取中位数"""
+    runs = [run_importtime(code) for _ in range(REPEATS)]
+    packages = {}
+    for _, _, by_package in runs:
+        for package, ms in by_package.items():
+            packages.setdefault(package, []).append(ms)
+    top = sorted(((p, statistics.median(v)) for p, v in packages.items()), key=lambda x: -x[1])[:TOP_N]
+
+    return {
+        'wall_ms': round(statistics.median(r[0] for r in runs), 1),
+        'import_ms': round(statistics.median(r[1] for r in runs), 1),
+        'top_packages_ms': {p: round(ms, 1) for p, ms in top},
+    }
+
+
+def main():
+    check = '--check' in sys.argv
+    update = '--update' in sys.argv
+
+    baseline = {}
+    if os.path.exists(PROFILE_PATH):
+        with open(PROFILE_PATH, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get('scenarios', {})
+
+    results = {}
+    regressions = []
+    for name, code in SCENARIOS.items():
+        profile = profile_scenario(code)
+        results[name] = profile
+
+        print(f"\n[{name}] wall={profile['wall_ms']}ms imports={profile['import_ms']}ms")
+        for package, ms in profile['top_packages_ms'].items():
+            print(f"  {package:<30} {ms:>8.1f} ms")
+
+        if name in baseline:
+            base_ms = baseline[name]['import_ms']
+            change = (profile['import_ms'] - base_ms) / base_ms if base_ms else 0
+            print(f"  基线 {base_ms}ms, 变化 {change:+.0%}")
+            if change > REGRESSION_TOLERANCE:
+                regressions.append(name)
+
+    if update:
+        with open(PROFILE_PATH, 'w', encoding='utf-8') as f:
+            json.dump({'python': sys.version.split()[0], 'repeats': REPEATS, 'scenarios': results},
+                      f, ensure_ascii=False, indent=2)
+        print(f"\n已更新基线: {PROFILE_PATH}")
+
+    if regressions:
+        print(f"\n启动耗时回归: {', '.join(regressions)}")
+        if check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    # 用法:
+    #   python benchmarks/bench_startup.py           - 打印启动耗时并与基线对比
+    #   python benchmarks/bench_startup.py --check   - 出现回归时以非零状态退出
+    #   python benchmarks/bench_startup.py --update  - 用本次结果更新基线
+    main()
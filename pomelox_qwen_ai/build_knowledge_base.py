@@ -5,7 +5,16 @@
 import os
 import sys
 from config import Config
+from http_transport import load_dashscope
+from compact_docstore import compact_store, remove_compact_store
+from quantized_vectors import (
+    quantize_store, check_recall, has_quantized_store, remove_quantized_store, QUANTIZATION_MODES,
+)
+from chunking import chunk_document
+from embedding_cache import EmbeddingCache, CachedEmbedding
+from faq_answers import build_faq_answers, faq_source_path, read_faq_questions, remove_faq_answers
 from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, Settings
+from llama_index.core.schema import Document, NodeRelationship, TextNode
 from llama_index.embeddings.dashscope import (
     DashScopeEmbedding,
     DashScopeTextEmbeddingModels,
@@ -19,6 +28,42 @@ EMBED_MODEL = DashScopeEmbedding(
 )
 Settings.embed_model = EMBED_MODEL
 
+# 内容寻址的嵌入缓存：所有学校、每次构建共用，只有缓存中没有的分块才调用 DashScope
+EMBEDDING_CACHE = EmbeddingCache() if Config.EMBEDDING_CACHE_ENABLED else None
+# 构建索引时显式传入（FAQ 生成会加载 rag_service 并替换全局 Settings.embed_model）
+BUILD_EMBED_MODEL = CachedEmbedding(EMBED_MODEL, EMBEDDING_CACHE) if EMBEDDING_CACHE else EMBED_MODEL
+
+# 设置 API Key，并复用连接池，避免每次嵌入调用重新建立 TLS 连接
+load_dashscope()
+
+
+def load_structured_nodes(docx_path: str):
+    """
+    按文档结构分块并去重，生成待嵌入的节点
+
+    Args:
+        docx_path: docx 文件路径
+
+    Returns:
+        tuple: (节点列表, 分块报告)
+    """
+    chunks, report = chunk_document(docx_path)
+    file_name = os.path.basename(docx_path)
+    source = Document(text='', id_=file_name, metadata={'file_name': file_name})
+
+    nodes = []
+    for chunk in chunks:
+        node = TextNode(
+            text=chunk['text'],
+            metadata={'file_name': file_name, 'section': chunk['section']},
+            # 标题路径已写在分块正文开头，元数据不再重复参与嵌入
+            excluded_embed_metadata_keys=['file_name', 'section'],
+            excluded_llm_metadata_keys=['file_name', 'section'],
+        )
+        node.relationships[NodeRelationship.SOURCE] = source.as_related_node_info()
+        nodes.append(node)
+    return nodes, report
+
 
 def build_single_school(school_id: str):
     """
@@ -50,19 +95,55 @@ def build_single_school(school_id: str):
     print(f"  目标目录: {vector_path}")
 
     try:
-        # 读取文档
-        reader = SimpleDirectoryReader(input_files=[docx_path])
-        documents = reader.load_data()
-        print(f"  已加载 {len(documents)} 个文档片段")
+        cache_before = EMBEDDING_CACHE.stats() if EMBEDDING_CACHE else None
+        if Config.RAG_STRUCTURED_CHUNKING:
+            # 按标题、列表、表格分块，并在嵌入前去除重复分块
+            nodes, report = load_structured_nodes(docx_path)
+            print(f"  结构: {report['blocks']} 个段落块, {report['headings']} 个标题, {report['tables']} 个表格")
+            print(f"  分块: {report['chunks_before_dedup']} 个, 去除完全重复 {report['exact_duplicates']} 个, "
+                  f"近似重复 {report['near_duplicates']} 个, 保留 {report['chunks']} 个")
+            print(f"  分块长度(约 token): 最小 {report['min_tokens']}, 平均 {report['avg_tokens']}, "
+                  f"最大 {report['max_tokens']}")
+            index = VectorStoreIndex(nodes, embed_model=BUILD_EMBED_MODEL)
+        else:
+            # 读取文档
+            reader = SimpleDirectoryReader(input_files=[docx_path])
+            documents = reader.load_data()
+            print(f"  已加载 {len(documents)} 个文档片段")
+
+            # 创建向量索引
+            index = VectorStoreIndex.from_documents(documents, embed_model=BUILD_EMBED_MODEL)
 
-        # 创建向量索引
-        index = VectorStoreIndex.from_documents(documents)
+        if cache_before is not None:
+            after = EMBEDDING_CACHE.stats()
+            hits = after['hits'] - cache_before['hits']
+            total = hits + after['misses'] - cache_before['misses']
+            print(f"  嵌入缓存: 命中 {hits}/{total} 个分块" + (f" ({hits / total:.0%})" if total else ""))
 
-        # 保存索引
+        # 保存索引（旧索引生成的 FAQ 答案、紧凑文档存储与量化向量随之作废，
+        # 否则加载时会优先使用旧的 docstore.compact.json 和旧的节点 ID）
         if not os.path.exists(vector_path):
             os.makedirs(vector_path)
+        remove_faq_answers(vector_path)
+        remove_compact_store(vector_path)
+        remove_quantized_store(vector_path)
         index.storage_context.persist(vector_path)
 
+        # 转换为紧凑文档存储（元数据去重，分块文本按偏移量按需读取）
+        if Config.RAG_COMPACT_DOCSTORE:
+            report = compact_store(vector_path)
+            print(f"  文档存储: {report['legacy_bytes']} -> {report['compact_bytes']} 字节")
+
+        # 生成量化向量文件（int8 / float16 首轮检索 + 全精度重排）
+        if Config.RAG_VECTOR_QUANTIZATION != 'none':
+            report = quantize_store(vector_path)
+            print(f"  量化向量: float32 {report['float32_bytes']} 字节, "
+                  f"int8 {report['int8_bytes']} 字节, float16 {report['float16_bytes']} 字节")
+
+        # 为常见问题预生成答案（需要 school_data/faq/<学校ID>.txt）
+        if os.path.exists(faq_source_path(school_id)):
+            build_school_faq(school_id)
+
         print(f"  [OK] {school_id} 知识库构建完成")
         return True
 
@@ -71,6 +152,52 @@ def build_single_school(school_id: str):
         return False
 
 
+def build_school_faq(school_id: str):
+    """
+    按学校的 FAQ 列表检索并生成答案，与索引一起保存
+
+    Args:
+        school_id: 学校ID（知识库需已构建）
+    """
+    questions = read_faq_questions(faq_source_path(school_id))
+    print(f"  正在为 {len(questions)} 个常见问题生成答案...")
+    report = build_faq_answers(school_id, questions)
+    print(f"  FAQ 答案: 生成 {report['answered']} 个, 检索分数不足跳过 {report['low_score']} 个, "
+          f"失败 {report['failed']} 个")
+
+
+def finish_embedding_cache():
+    """记录本次构建的嵌入缓存命中率，并在超出大小上限时清理最久未用的向量"""
+    if EMBEDDING_CACHE is None:
+        return
+    stats = EMBEDDING_CACHE.stats()
+    totals = EMBEDDING_CACHE.record_run()
+    cumulative = totals['hits'] + totals['misses']
+    print(f"嵌入缓存: 本次命中 {stats['hits']}, 调用 API {stats['misses']}"
+          + (f", 命中率 {stats['hit_rate']:.1%}" if stats['hit_rate'] is not None else "")
+          + (f"; 累计命中率 {totals['hits'] / cumulative:.1%} ({totals['runs']} 次构建)" if cumulative else ""))
+    report = EMBEDDING_CACHE.gc()
+    if report['removed']:
+        print(f"嵌入缓存: 超出 {Config.EMBEDDING_CACHE_MAX_MB} MB，清理 {report['removed']} 个最久未用的向量 "
+              f"({report['removed_bytes']} 字节)")
+
+
+def report_embedding_cache(run_gc: bool = False):
+    """报告嵌入缓存的向量数、占用空间与累计命中率（run_gc 时先按大小上限清理）"""
+    cache = EMBEDDING_CACHE or EmbeddingCache()
+    if run_gc:
+        report = cache.gc()
+        print(f"清理 {report['removed']} 个向量 ({report['removed_bytes']} 字节)")
+    usage = cache.usage()
+    totals = cache.load_totals()
+    cumulative = totals['hits'] + totals['misses']
+    print(f"嵌入缓存: {cache.cache_dir}")
+    print(f"  向量数: {usage['vectors']}, 占用: {usage['bytes']} 字节 (上限 {Config.EMBEDDING_CACHE_MAX_MB} MB)")
+    if cumulative:
+        print(f"  累计: {totals['runs']} 次构建, 命中 {totals['hits']}, 调用 API {totals['misses']}, "
+              f"命中率 {totals['hits'] / cumulative:.1%}")
+
+
 def build_all_schools():
     """为所有配置的学校构建知识库"""
     print("=" * 50)
@@ -101,9 +228,59 @@ def build_all_schools():
 
     print("=" * 50)
     print(f"构建完成: 成功 {success_count}, 失败 {fail_count}, 跳过 {skip_count}")
+    finish_embedding_cache()
     print("=" * 50)
 
 
+def report_chunking():
+    """只分块不嵌入，报告每个学校的分块数与去重数量（不调用 API）"""
+    print(f"{'学校':<8}{'段落块':>6}{'分块':>6}{'完全重复':>8}{'近似重复':>8}{'保留':>6}{'平均长度':>8}{'最大长度':>8}")
+    for school_id, school_info in Config.SCHOOLS.items():
+        docx_path = os.path.join(Config.SCHOOL_DATA_PATH, f"{school_info.get('file', school_id)}.docx")
+        if not os.path.exists(docx_path):
+            continue
+        _, report = chunk_document(docx_path)
+        print(f"{school_id:<8}{report['blocks']:>6}{report['chunks_before_dedup']:>6}{report['exact_duplicates']:>8}"
+              f"{report['near_duplicates']:>8}{report['chunks']:>6}{report['avg_tokens']:>8}{report['max_tokens']:>8}")
+
+
+def compact_existing_stores():
+    """将已有知识库的 docstore.json 转换为紧凑格式（无需重新嵌入）"""
+    for school_id in Config.SCHOOLS:
+        vector_path = os.path.join(Config.VECTOR_STORE_PATH, school_id)
+        if not os.path.exists(os.path.join(vector_path, 'docstore.json')):
+            continue
+        report = compact_store(vector_path)
+        print(f"  {school_id}: {report['nodes']} 个分块, "
+              f"{report['legacy_bytes']} -> {report['compact_bytes']} 字节")
+
+
+def quantize_existing_stores():
+    """为已有知识库生成量化向量文件（无需重新嵌入）"""
+    for school_id in Config.SCHOOLS:
+        vector_path = os.path.join(Config.VECTOR_STORE_PATH, school_id)
+        if not os.path.exists(vector_path):
+            continue
+        report = quantize_store(vector_path)
+        print(f"  {school_id}: {report['vectors']} 个向量, float32 {report['float32_bytes']} 字节 -> "
+              f"int8 {report['int8_bytes']} 字节 / float16 {report['float16_bytes']} 字节")
+
+
+def report_quantization_recall(k: int = 20):
+    """对比量化检索与精确检索，报告每个学校的 recall@k"""
+    print(f"{'学校':<8}{'模式':<10}{'向量数':>6}{'首轮召回':>10}{'重排后召回':>12}{'内存(字节)':>14}")
+    for school_id in Config.SCHOOLS:
+        vector_path = os.path.join(Config.VECTOR_STORE_PATH, school_id)
+        if not os.path.exists(vector_path):
+            continue
+        if not has_quantized_store(vector_path):
+            quantize_store(vector_path)
+        for mode in QUANTIZATION_MODES:
+            result = check_recall(vector_path, mode, k=k)
+            print(f"{school_id:<8}{mode:<10}{result['vectors']:>6}{result['recall_first_pass']:>10.4f}"
+                  f"{result['recall_rescored']:>12.4f}{result['resident_bytes']:>14}")
+
+
 def list_available_files():
     """列出 school_data 目录中的所有文件"""
     print("\nschool_data/ 目录中的文件:")
@@ -138,18 +315,48 @@ if __name__ == "__main__":
             list_available_files()
         elif command == "all":
             build_all_schools()
+        elif command == "faq":
+            # 只重新生成 FAQ 答案（不重新嵌入）
+            for school_id in sys.argv[2:] or Config.SCHOOLS:
+                if os.path.exists(faq_source_path(school_id)) \
+                        and os.path.exists(os.path.join(Config.VECTOR_STORE_PATH, school_id)):
+                    print(f"{school_id}:")
+                    build_school_faq(school_id)
+        elif command == "chunks":
+            report_chunking()
+        elif command == "compact":
+            compact_existing_stores()
+        elif command == "quantize":
+            quantize_existing_stores()
+        elif command == "recall":
+            report_quantization_recall()
+        elif command == "cache":
+            report_embedding_cache(run_gc=sys.argv[2:3] == ["gc"])
         elif command in Config.SCHOOLS:
             build_single_school(command)
+            finish_embedding_cache()
         else:
             print(f"未知的命令或学校ID: {command}")
             print("\n用法:")
-            print("  python build_knowledge_base.py list    - 列出可用文件")
-            print("  python build_knowledge_base.py all     - 构建所有学校知识库")
-            print("  python build_knowledge_base.py UCI     - 构建单个学校知识库")
+            print("  python build_knowledge_base.py list     - 列出可用文件")
+            print("  python build_knowledge_base.py all      - 构建所有学校知识库")
+            print("  python build_knowledge_base.py chunks   - 只分块不嵌入，报告分块与去重数量")
+            print("  python build_knowledge_base.py faq [UCI] - 为已有知识库重新生成常见问题答案")
+            print("  python build_knowledge_base.py compact  - 将已有知识库转换为紧凑文档存储")
+            print("  python build_knowledge_base.py quantize - 为已有知识库生成量化向量")
+            print("  python build_knowledge_base.py recall   - 报告量化检索的 recall@20")
+            print("  python build_knowledge_base.py cache [gc] - 报告嵌入缓存占用与命中率（gc: 按大小上限清理）")
+            print("  python build_knowledge_base.py UCI      - 构建单个学校知识库")
     else:
         print("知识库构建工具")
         print("\n用法:")
-        print("  python build_knowledge_base.py list    - 列出可用文件")
-        print("  python build_knowledge_base.py all     - 构建所有学校知识库")
-        print("  python build_knowledge_base.py <学校ID> - 构建单个学校知识库")
+        print("  python build_knowledge_base.py list     - 列出可用文件")
+        print("  python build_knowledge_base.py all      - 构建所有学校知识库")
+        print("  python build_knowledge_base.py chunks   - 只分块不嵌入，报告分块与去重数量")
+        print("  python build_knowledge_base.py faq [UCI] - 为已有知识库重新生成常见问题答案")
+        print("  python build_knowledge_base.py compact  - 将已有知识库转换为紧凑文档存储")
+        print("  python build_knowledge_base.py quantize - 为已有知识库生成量化向量")
+        print("  python build_knowledge_base.py recall   - 报告量化检索的 recall@20")
+        print("  python build_knowledge_base.py cache [gc] - 报告嵌入缓存占用与命中率（gc: 按大小上限清理）")
+        print("  python build_knowledge_base.py <学校ID>  - 构建单个学校知识库")
         print(f"\n可用的学校ID: {', '.join(Config.SCHOOLS.keys())}")
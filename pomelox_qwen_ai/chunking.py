@@ -0,0 +1,400 @@
+"""
+Chunking Module
+Structure-aware chunking of school .docx files with near-duplicate removal
+
+Documents are read straight from the .docx XML as a sequence of headings,
+paragraphs, lists and tables. Chunks follow that structure: they are packed
+within a section up to RAG_CHUNK_MAX_TOKENS, start with the heading path of
+their section, and oversized blocks are split at sentence, list item or
+table row boundaries (tables repeat their header row). Chunks whose text is
+an exact or near (MinHash) duplicate of an earlier chunk are dropped before
+anything is embedded.
+"""
+import re
+import zipfile
+import zlib
+from xml.etree import ElementTree
+
+import numpy as np
+from config import Config
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+KIND_HEADING = 'heading'
+KIND_PARAGRAPH = 'paragraph'
+KIND_LIST = 'list'
+KIND_TABLE = 'table'
+
+# Level given to headings recognised by formatting rather than a heading style
+_IMPLICIT_HEADING_LEVEL = 9
+_HEADING_STYLE = re.compile(r'^(?:heading|标题)\s*(\d)$', re.IGNORECASE)
+_SENTENCE_END = re.compile(r'(?<=[。！？!?；;])|(?<=\.)(?=\s)')
+_TERMINAL_PUNCTUATION = tuple('。！？!?；;，,：:.')
+_CJK = re.compile(r'[　-〿㐀-䶿一-鿿＀-￯]')
+_WORD = re.compile(r'[A-Za-z0-9]+')
+_SPACES = re.compile(r'\s+')
+
+# MinHash parameters: hash values modulo a Mersenne prime below 2**31 so
+# that a * x + b never overflows uint64
+_MERSENNE_PRIME = (1 << 31) - 1
+_SHINGLE_CHARS = 5
+
+
+def count_tokens(text: str) -> int:
+    """
+    Approximate token count for the DashScope models: one token per CJK
+    character and about one per four characters of other words
+    """
+    cjk = len(_CJK.findall(text))
+    words = sum((len(word) + 3) // 4 for word in _WORD.findall(text))
+    return cjk + words
+
+
+class _Block:
+    """A heading, paragraph, list or table, with the units it may be split into"""
+
+    __slots__ = ('kind', 'units', 'header', 'level')
+
+    def __init__(self, kind: str, units: list, header: str = None, level: int = 0):
+        self.kind = kind
+        self.units = units          # sentences, list items or table rows
+        self.header = header        # table header row, repeated in every piece
+        self.level = level          # heading level
+
+    @property
+    def text(self) -> str:
+        separator = '' if self.kind in (KIND_HEADING, KIND_PARAGRAPH) else '\n'
+        body = separator.join(self.units)
+        return f"{self.header}\n{body}" if self.header else body
+
+
+def _paragraph_text(paragraph) -> str:
+    parts = []
+    for node in paragraph.iter():
+        if node.tag == f'{_W}t':
+            parts.append(node.text or '')
+        elif node.tag == f'{_W}tab':
+            parts.append('\t')
+        elif node.tag in (f'{_W}br', f'{_W}cr'):
+            parts.append('\n')
+    return ''.join(parts).strip()
+
+
+def _heading_level(paragraph, styles: dict, text: str) -> int:
+    """Heading level of a paragraph, 0 for body text"""
+    properties = paragraph.find(f'{_W}pPr')
+    if properties is not None:
+        style = properties.find(f'{_W}pStyle')
+        if style is not None:
+            name = styles.get(style.get(f'{_W}val'), style.get(f'{_W}val', ''))
+            if name.lower() == 'title':
+                return 1
+            match = _HEADING_STYLE.match(name.strip())
+            if match:
+                return int(match.group(1))
+        outline = properties.find(f'{_W}outlineLvl')
+        if outline is not None:
+            return int(outline.get(f'{_W}val', 0)) + 1
+
+    # Template documents mark headings with bold, short lines
+    if len(text) > Config.RAG_HEADING_MAX_CHARS or text.endswith(_TERMINAL_PUNCTUATION):
+        return 0
+    runs = [run for run in paragraph.iter(f'{_W}r') if (run.findtext(f'{_W}t') or '').strip()]
+    if runs and all(_run_is_bold(run) for run in runs):
+        return _IMPLICIT_HEADING_LEVEL
+    return 0
+
+
+def _run_is_bold(run) -> bool:
+    properties = run.find(f'{_W}rPr')
+    if properties is None:
+        return False
+    bold = properties.find(f'{_W}b')
+    return bold is not None and bold.get(f'{_W}val', 'true') not in ('0', 'false')
+
+
+def _is_list_item(paragraph, styles: dict) -> bool:
+    properties = paragraph.find(f'{_W}pPr')
+    if properties is None:
+        return False
+    if properties.find(f'{_W}numPr') is not None:
+        return True
+    style = properties.find(f'{_W}pStyle')
+    return style is not None and 'list' in styles.get(style.get(f'{_W}val'), '').lower()
+
+
+def _table_rows(table) -> list:
+    rows = []
+    for row in table.iter(f'{_W}tr'):
+        cells = [' '.join(filter(None, (_paragraph_text(p) for p in cell.iter(f'{_W}p'))))
+                 for cell in row.findall(f'{_W}tc')]
+        if any(cells):
+            rows.append(' | '.join(cells))
+    return rows
+
+
+def _split_sentences(text: str) -> list:
+    return [sentence for sentence in _SENTENCE_END.split(text) if sentence and sentence.strip()]
+
+
+def read_docx_blocks(path: str) -> list:
+    """
+    Read a .docx file as a list of structural blocks in document order
+
+    Args:
+        path: Path of the .docx file
+
+    Returns:
+        list: Blocks (headings, paragraphs, lists, tables)
+    """
+    with zipfile.ZipFile(path) as archive:
+        document = ElementTree.fromstring(archive.read('word/document.xml'))
+        styles = {}
+        if 'word/styles.xml' in archive.namelist():
+            for style in ElementTree.fromstring(archive.read('word/styles.xml')).iter(f'{_W}style'):
+                name = style.find(f'{_W}name')
+                if name is not None:
+                    styles[style.get(f'{_W}styleId')] = name.get(f'{_W}val', '')
+
+    blocks = []
+
+    def visit(container):
+        for element in container:
+            if element.tag == f'{_W}tbl':
+                rows = _table_rows(element)
+                if rows:
+                    blocks.append(_Block(KIND_TABLE, rows[1:], header=rows[0]) if len(rows) > 1
+                                  else _Block(KIND_PARAGRAPH, rows))
+            elif element.tag == f'{_W}p':
+                text = _paragraph_text(element)
+                if not text:
+                    continue
+                level = _heading_level(element, styles, text)
+                if level:
+                    blocks.append(_Block(KIND_HEADING, [_SPACES.sub(' ', text)], level=level))
+                elif _is_list_item(element, styles):
+                    # Consecutive list items form one block that splits between items
+                    if blocks and blocks[-1].kind == KIND_LIST:
+                        blocks[-1].units.append(text)
+                    else:
+                        blocks.append(_Block(KIND_LIST, [text]))
+                else:
+                    blocks.append(_Block(KIND_PARAGRAPH, _split_sentences(text)))
+            elif element.tag in (f'{_W}sdt', f'{_W}sdtContent', f'{_W}customXml'):
+                visit(element)
+
+    visit(document.find(f'{_W}body'))
+    return blocks
+
+
+def _split_block(block: _Block, max_tokens: int) -> list:
+    """Split an oversized block into pieces that fit max_tokens"""
+    header_tokens = count_tokens(block.header) if block.header else 0
+    pieces, current, current_tokens = [], [], header_tokens
+    for unit in block.units:
+        unit_tokens = count_tokens(unit)
+        if current and current_tokens + unit_tokens > max_tokens:
+            pieces.append(_Block(block.kind, current, block.header))
+            current, current_tokens = [], header_tokens
+        if unit_tokens > max_tokens:
+            # A single sentence or row beyond the limit: hard split by characters
+            step = max(1, len(unit) * max_tokens // unit_tokens)
+            pieces.extend(_Block(block.kind, [unit[i:i + step]], block.header) for i in range(0, len(unit), step))
+            continue
+        current.append(unit)
+        current_tokens += unit_tokens
+    if current:
+        pieces.append(_Block(block.kind, current, block.header))
+    return pieces
+
+
+def _section_path(headings: list, max_tokens: int) -> str:
+    """Heading path of the current section, outermost headings dropped while it exceeds max_tokens"""
+    texts = [text for _, text in headings]
+    while len(texts) > 1 and count_tokens(' > '.join(texts)) > max_tokens:
+        texts.pop(0)
+    return ' > '.join(texts)
+
+
+def chunk_blocks(blocks: list, max_tokens: int = None, min_tokens: int = None) -> list:
+    """
+    Pack structural blocks into chunks
+
+    A heading closes the current chunk unless it is still below min_tokens
+    (short sections are merged into the next one, keeping their heading line).
+    Every chunk starts with the heading path of the section it begins in,
+    shortened to at most half of max_tokens; the body always keeps at least
+    min_tokens (or half of max_tokens) so a long heading never splits it into
+    single characters.
+
+    Args:
+        blocks: Output of read_docx_blocks()
+        max_tokens: Chunk size limit (defaults to RAG_CHUNK_MAX_TOKENS)
+        min_tokens: Smallest chunk a heading may close (defaults to RAG_CHUNK_MIN_TOKENS)
+
+    Returns:
+        list: Chunks as dicts with 'text', 'section' and 'tokens'
+    """
+    max_tokens = max_tokens or Config.RAG_CHUNK_MAX_TOKENS
+    min_tokens = Config.RAG_CHUNK_MIN_TOKENS if min_tokens is None else min_tokens
+
+    chunks = []
+    headings = []           # (level, text) of the enclosing sections
+    parts, tokens, section = [], 0, ''
+
+    def flush():
+        nonlocal parts, tokens
+        if parts:
+            body = '\n\n'.join(parts)
+            text = f"{section}\n\n{body}" if section else body
+            chunks.append({'text': text, 'section': section, 'tokens': count_tokens(text)})
+        parts, tokens = [], 0
+
+    for block in blocks:
+        if block.kind == KIND_HEADING:
+            if tokens >= min_tokens:
+                flush()
+            while headings and headings[-1][0] >= block.level:
+                headings.pop()
+            headings.append((block.level, block.text))
+            if not parts:
+                section = _section_path(headings, max_tokens // 2)
+            else:
+                parts.append(block.text)
+                tokens += count_tokens(block.text)
+            continue
+
+        if not parts:
+            section = _section_path(headings, max_tokens // 2)
+        budget = max(max_tokens - (count_tokens(section) if section else 0), min_tokens or max_tokens // 2)
+        block_tokens = count_tokens(block.text)
+        pieces = [block] if block_tokens <= budget else _split_block(block, budget)
+        for piece in pieces:
+            piece_tokens = count_tokens(piece.text)
+            if parts and tokens + piece_tokens > budget:
+                flush()
+            parts.append(piece.text)
+            tokens += piece_tokens
+
+    flush()
+    return chunks
+
+
+def _normalize_text(text: str) -> str:
+    return _SPACES.sub(' ', text).strip().lower()
+
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    if len(text) <= _SHINGLE_CHARS:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + _SHINGLE_CHARS] for i in range(len(text) - _SHINGLE_CHARS + 1)}
+    return np.fromiter((zlib.crc32(s.encode('utf-8')) % _MERSENNE_PRIME for s in shingles), dtype=np.uint64)
+
+
+def minhash_signatures(texts: list, num_perm: int = None, seed: int = 1) -> np.ndarray:
+    """
+    MinHash signatures of character shingles
+
+    Args:
+        texts: Normalized texts
+        num_perm: Number of hash permutations (defaults to RAG_DEDUP_NUM_PERM)
+        seed: Seed of the permutation coefficients
+
+    Returns:
+        np.ndarray: (len(texts), num_perm) uint64 signature matrix
+    """
+    num_perm = num_perm or Config.RAG_DEDUP_NUM_PERM
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint64)
+    for row, text in enumerate(texts):
+        hashes = _shingle_hashes(text)
+        signatures[row] = ((np.outer(hashes, a) + b) % _MERSENNE_PRIME).min(axis=0)
+    return signatures
+
+
+def remove_near_duplicates(chunks: list, threshold: float = None) -> tuple:
+    """
+    Drop chunks that repeat an earlier chunk exactly or nearly
+
+    Candidate pairs come from locality-sensitive hashing of the MinHash
+    signatures (bands of rows); a candidate is dropped when its estimated
+    Jaccard similarity to a kept chunk reaches the threshold.
+
+    Args:
+        chunks: Output of chunk_blocks()
+        threshold: Estimated Jaccard similarity treated as duplicate (defaults to RAG_DEDUP_THRESHOLD)
+
+    Returns:
+        tuple: (kept chunks, report dict with 'exact' and 'near' removal counts)
+    """
+    threshold = Config.RAG_DEDUP_THRESHOLD if threshold is None else threshold
+    report = {'exact': 0, 'near': 0}
+
+    seen, unique = set(), []
+    for chunk in chunks:
+        # The heading path differs between copies of shared boilerplate
+        key = _normalize_text(chunk['text'][len(chunk['section']):])
+        if key in seen:
+            report['exact'] += 1
+            continue
+        seen.add(key)
+        unique.append((key, chunk))
+    if len(unique) < 2:
+        return [chunk for _, chunk in unique], report
+
+    signatures = minhash_signatures([key for key, _ in unique])
+    num_perm = signatures.shape[1]
+    rows_per_band = Config.RAG_DEDUP_BAND_ROWS
+    buckets = {}
+    kept = []
+    for index, (_, chunk) in enumerate(unique):
+        signature = signatures[index]
+        candidates = set()
+        bands = [signature[start:start + rows_per_band].tobytes()
+                 for start in range(0, num_perm - rows_per_band + 1, rows_per_band)]
+        for band, key in enumerate(bands):
+            candidates.update(buckets.get((band, key), ()))
+        if any(np.mean(signatures[other] == signature) >= threshold for other in candidates):
+            report['near'] += 1
+            continue
+        for band, key in enumerate(bands):
+            buckets.setdefault((band, key), []).append(index)
+        kept.append(chunk)
+    return kept, report
+
+
+def chunk_document(path: str) -> tuple:
+    """
+    Read, chunk and de-duplicate one .docx file
+
+    Args:
+        path: Path of the .docx file
+
+    Returns:
+        tuple: (chunks, report dict with block, chunk, duplicate and token counts)
+    """
+    blocks = read_docx_blocks(path)
+    chunks = chunk_blocks(blocks)
+    report = {
+        'blocks': len(blocks),
+        'headings': sum(1 for block in blocks if block.kind == KIND_HEADING),
+        'tables': sum(1 for block in blocks if block.kind == KIND_TABLE),
+        'chunks_before_dedup': len(chunks),
+    }
+    if Config.RAG_DEDUP_ENABLED:
+        chunks, removed = remove_near_duplicates(chunks)
+    else:
+        removed = {'exact': 0, 'near': 0}
+    token_counts = [chunk['tokens'] for chunk in chunks] or [0]
+    report.update({
+        'exact_duplicates': removed['exact'],
+        'near_duplicates': removed['near'],
+        'chunks': len(chunks),
+        'min_tokens': min(token_counts),
+        'avg_tokens': round(sum(token_counts) / len(token_counts)),
+        'max_tokens': max(token_counts),
+    })
+    return chunks, report
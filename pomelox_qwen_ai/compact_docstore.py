@@ -0,0 +1,260 @@
+"""
+Compact Docstore Module
+Slim on-disk docstore format: metadata interned once per distinct value and
+chunk texts kept in a single offset-indexed blob that is read on demand
+
+Files written next to the vector store:
+    docstore.compact.json  - node table, interned metadata, hashes, ref doc info
+    docstore.chunks.bin    - UTF-8 chunk texts, addressed by (offset, length)
+"""
+import json
+import mmap
+import os
+from typing import Dict, Optional
+
+from llama_index.core.storage.docstore.keyval_docstore import KVDocumentStore
+from llama_index.core.storage.kvstore.types import BaseKVStore, DEFAULT_COLLECTION
+
+COMPACT_INDEX_FILE = 'docstore.compact.json'
+COMPACT_BLOB_FILE = 'docstore.chunks.bin'
+LEGACY_DOCSTORE_FILE = 'docstore.json'
+FORMAT_VERSION = 1
+
+_NAMESPACE = 'docstore'
+_DATA_COLLECTION = f'{_NAMESPACE}/data'
+_REF_DOC_COLLECTION = f'{_NAMESPACE}/ref_doc_info'
+_METADATA_COLLECTION = f'{_NAMESPACE}/metadata'
+
+# Node fields that are identical for most chunks and are stored once as a "layout"
+_LAYOUT_FIELDS = (
+    'excluded_embed_metadata_keys', 'excluded_llm_metadata_keys', 'mimetype',
+    'text_template', 'metadata_template', 'metadata_seperator', 'class_name',
+)
+
+
+class ReadOnlyStoreError(RuntimeError):
+    """Raised on writes to a store that is only produced by a knowledge base build"""
+
+
+class _Interner:
+    """Assigns a stable index to each distinct JSON-serializable value"""
+
+    def __init__(self):
+        self.values = []
+        self._index = {}
+
+    def add(self, value) -> int:
+        key = json.dumps(value, sort_keys=True, ensure_ascii=False)
+        if key not in self._index:
+            self._index[key] = len(self.values)
+            self.values.append(value)
+        return self._index[key]
+
+
+def compact_store(store_dir: str, remove_legacy: bool = True) -> dict:
+    """
+    Convert a persisted llama-index docstore.json into the compact format
+
+    Args:
+        store_dir: Vector store directory of one school
+        remove_legacy: Delete docstore.json once the compact files are written
+
+    Returns:
+        dict: Size report (legacy bytes, compact bytes, node count)
+    """
+    legacy_path = os.path.join(store_dir, LEGACY_DOCSTORE_FILE)
+    with open(legacy_path, 'r', encoding='utf-8') as f:
+        legacy = json.load(f)
+
+    metadata_values = _Interner()
+    layouts = _Interner()
+    nodes = {}
+    blob = bytearray()
+
+    for node_id, entry in legacy.get(_DATA_COLLECTION, {}).items():
+        data = entry['__data__']
+        text = data.get('text', '').encode('utf-8')
+        offset = len(blob)
+        blob.extend(text)
+
+        layout = {field: data.get(field) for field in _LAYOUT_FIELDS}
+        layout['__type__'] = entry['__type__']
+
+        relationships = {
+            rel_type: [rel['node_id'], rel.get('node_type'), rel.get('hash'),
+                       metadata_values.add(rel.get('metadata', {})), rel.get('class_name', 'RelatedNodeInfo')]
+            for rel_type, rel in data.get('relationships', {}).items()
+        }
+
+        nodes[node_id] = {
+            'o': offset,
+            'n': len(text),
+            'm': metadata_values.add(data.get('metadata', {})),
+            'l': layouts.add(layout),
+            's': data.get('start_char_idx'),
+            'e': data.get('end_char_idx'),
+            'r': relationships,
+        }
+
+    ref_doc_info = {
+        ref_doc_id: {'node_ids': info.get('node_ids', []), 'm': metadata_values.add(info.get('metadata', {}))}
+        for ref_doc_id, info in legacy.get(_REF_DOC_COLLECTION, {}).items()
+    }
+
+    compact = {
+        'version': FORMAT_VERSION,
+        'metadata_values': metadata_values.values,
+        'layouts': layouts.values,
+        'nodes': nodes,
+        'hashes': legacy.get(_METADATA_COLLECTION, {}),
+        'ref_doc_info': ref_doc_info,
+    }
+
+    with open(os.path.join(store_dir, COMPACT_BLOB_FILE), 'wb') as f:
+        f.write(blob)
+    with open(os.path.join(store_dir, COMPACT_INDEX_FILE), 'w', encoding='utf-8') as f:
+        json.dump(compact, f, ensure_ascii=False, separators=(',', ':'))
+
+    report = {
+        'nodes': len(nodes),
+        'legacy_bytes': os.path.getsize(legacy_path),
+        'compact_bytes': os.path.getsize(os.path.join(store_dir, COMPACT_INDEX_FILE))
+        + os.path.getsize(os.path.join(store_dir, COMPACT_BLOB_FILE)),
+    }
+    if remove_legacy:
+        os.remove(legacy_path)
+    return report
+
+
+class CompactKVStore(BaseKVStore):
+    """
+    Read-only key-value view over the compact files
+
+    Node JSON is rebuilt per lookup and chunk text is sliced from a
+    memory-mapped blob, so only nodes that are actually fetched cost memory.
+    """
+
+    def __init__(self, store_dir: str):
+        with open(os.path.join(store_dir, COMPACT_INDEX_FILE), 'r', encoding='utf-8') as f:
+            compact = json.load(f)
+        if compact.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported compact docstore version: {compact.get('version')}")
+
+        self._metadata_values = compact['metadata_values']
+        self._layouts = compact['layouts']
+        self._nodes = compact['nodes']
+        self._hashes = compact['hashes']
+        self._ref_doc_info = compact['ref_doc_info']
+
+        blob_path = os.path.join(store_dir, COMPACT_BLOB_FILE)
+        self._blob = None
+        if os.path.getsize(blob_path) > 0:
+            with open(blob_path, 'rb') as f:
+                self._blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _text(self, offset: int, length: int) -> str:
+        if self._blob is None or length == 0:
+            return ''
+        return self._blob[offset:offset + length].decode('utf-8')
+
+    def _node_json(self, node_id: str) -> Optional[dict]:
+        node = self._nodes.get(node_id)
+        if node is None:
+            return None
+
+        layout = dict(self._layouts[node['l']])
+        node_type = layout.pop('__type__')
+        relationships = {
+            rel_type: {
+                'node_id': rel[0],
+                'node_type': rel[1],
+                'metadata': dict(self._metadata_values[rel[3]]),
+                'hash': rel[2],
+                'class_name': rel[4],
+            }
+            for rel_type, rel in node['r'].items()
+        }
+        data = {
+            'id_': node_id,
+            'embedding': None,
+            'metadata': dict(self._metadata_values[node['m']]),
+            'relationships': relationships,
+            'text': self._text(node['o'], node['n']),
+            'start_char_idx': node['s'],
+            'end_char_idx': node['e'],
+            **{field: (list(value) if isinstance(value, list) else value) for field, value in layout.items()},
+        }
+        return {'__data__': data, '__type__': node_type}
+
+    def _ref_doc_json(self, ref_doc_id: str) -> Optional[dict]:
+        info = self._ref_doc_info.get(ref_doc_id)
+        if info is None:
+            return None
+        return {'node_ids': list(info['node_ids']), 'metadata': dict(self._metadata_values[info['m']])}
+
+    def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        if collection == _DATA_COLLECTION:
+            return self._node_json(key)
+        if collection == _REF_DOC_COLLECTION:
+            return self._ref_doc_json(key)
+        if collection == _METADATA_COLLECTION:
+            value = self._hashes.get(key)
+            return dict(value) if value is not None else None
+        return None
+
+    async def aget(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        return self.get(key, collection)
+
+    def get_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        if collection == _DATA_COLLECTION:
+            keys = self._nodes.keys()
+        elif collection == _REF_DOC_COLLECTION:
+            keys = self._ref_doc_info.keys()
+        elif collection == _METADATA_COLLECTION:
+            keys = self._hashes.keys()
+        else:
+            return {}
+        return {key: self.get(key, collection) for key in keys}
+
+    async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+        return self.get_all(collection)
+
+    def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        raise ReadOnlyStoreError('Compact docstore is read-only; rebuild the knowledge base to change it')
+
+    async def aput(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put(key, val, collection)
+
+    def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        raise ReadOnlyStoreError('Compact docstore is read-only; rebuild the knowledge base to change it')
+
+    async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        return self.delete(key, collection)
+
+
+def has_compact_store(store_dir: str) -> bool:
+    """Check whether a vector store directory holds a compact docstore"""
+    return os.path.exists(os.path.join(store_dir, COMPACT_INDEX_FILE))
+
+
+def remove_compact_store(store_dir: str):
+    """Delete the compact docstore files (called before an index is rebuilt)"""
+    for name in (COMPACT_INDEX_FILE, COMPACT_BLOB_FILE):
+        path = os.path.join(store_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def load_compact_docstore(store_dir: str) -> Optional[KVDocumentStore]:
+    """
+    Open the compact docstore of a vector store directory
+
+    Args:
+        store_dir: Vector store directory of one school
+
+    Returns:
+        KVDocumentStore or None (if the directory has no compact docstore)
+    """
+    if not has_compact_store(store_dir):
+        return None
+    return KVDocumentStore(CompactKVStore(store_dir), namespace=_NAMESPACE)
@@ -52,11 +52,124 @@ class Config:
     RAG_SIMILARITY_THRESHOLD = 0.2      # Minimum similarity threshold
     RAG_HIGH_QUALITY_THRESHOLD = 0.5    # High quality result threshold (web search triggered below this value)
     RAG_CHUNK_COUNT = 5
+    # Build-time chunking that follows headings, lists and tables (see chunking.py);
+    # False falls back to SimpleDirectoryReader and the default sentence splitter
+    RAG_STRUCTURED_CHUNKING = True
+    RAG_CHUNK_MAX_TOKENS = 512          # Approximate tokens per chunk, heading path included
+    RAG_CHUNK_MIN_TOKENS = 64           # Shorter sections are merged into the next one
+    RAG_HEADING_MAX_CHARS = 40          # Longest all-bold line treated as a heading
+    RAG_DEDUP_ENABLED = True            # Drop exact and near-duplicate chunks before embedding
+    RAG_DEDUP_THRESHOLD = 0.85          # Estimated Jaccard similarity (5-character shingles)
+    RAG_DEDUP_NUM_PERM = 128            # MinHash permutations
+    RAG_DEDUP_BAND_ROWS = 4             # LSH rows per band (candidate recall vs. comparisons)
+    # Content-addressed cache of build-time embeddings shared by all schools and rebuilds
+    # (see embedding_cache.py); least recently used vectors are deleted beyond the size cap
+    EMBEDDING_CACHE_ENABLED = os.environ.get('EMBEDDING_CACHE_ENABLED', 'True').lower() == 'true'
+    EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH') or os.path.join(os.path.dirname(__file__), 'embedding_cache')
+    EMBEDDING_CACHE_MAX_MB = int(os.environ.get('EMBEDDING_CACHE_MAX_MB', 512))
+    # Store chunk texts in an offset-indexed blob with interned metadata (see compact_docstore.py)
+    RAG_COMPACT_DOCSTORE = True
+    # First-pass vector search precision: 'none' (float32 JSON store), 'int8' or 'float16'
+    # Quantized modes re-score the top candidates against full-precision vectors (see quantized_vectors.py)
+    RAG_VECTOR_QUANTIZATION = os.environ.get('RAG_VECTOR_QUANTIZATION', 'none').lower()
+    RAG_QUANTIZED_RESCORE_FACTOR = 4    # Candidates re-scored exactly = top_k * factor
+    # Memory budget of loaded indexes (estimated, see rag_service.estimate_index_bytes); least
+    # recently used schools are evicted beyond it and reloaded on their next question. 0 = no cap
+    RAG_INDEX_CACHE_MAX_MB = int(os.environ.get('RAG_INDEX_CACHE_MAX_MB', 2048))
+    # Comma-separated schools that are never evicted (and are warmed up first)
+    RAG_INDEX_CACHE_PINNED = tuple(s.strip() for s in os.environ.get('RAG_INDEX_CACHE_PINNED', '').split(',') if s.strip())
+    # Import RAG dependencies and load every index at startup instead of on the first /ask
+    RAG_WARMUP_ON_START = os.environ.get('RAG_WARMUP_ON_START', 'False').lower() == 'true'
+
+    # Pre-generated FAQ answers (see faq_answers.py): built from FAQ_SOURCE_PATH/<school_id>.txt
+    # and served for first-turn questions whose embedding matches a FAQ question closely enough
+    FAQ_ANSWERS_ENABLED = os.environ.get('FAQ_ANSWERS_ENABLED', 'True').lower() == 'true'
+    FAQ_SOURCE_PATH = os.path.join(SCHOOL_DATA_PATH, 'faq')
+    FAQ_MATCH_THRESHOLD = 0.92          # Cosine similarity to a FAQ question required to serve its answer
+
+    # Adaptive retrieval depth (how many dense candidates are sent to rerank)
+    RAG_ADAPTIVE_DEPTH_ENABLED = True
+    RAG_CANDIDATE_TOP_K = 20            # Default rerank depth
+    RAG_CANDIDATE_MIN_TOP_K = 8         # Rerank depth when the top dense hit clearly leads
+    RAG_CANDIDATE_MAX_TOP_K = 40        # Rerank depth when the top dense hits are ambiguous
+    RAG_DENSE_CONFIDENT_SCORE = 0.6     # Dense score above which a clear leader skips rerank
+    RAG_CONFIDENT_MARGIN = 0.08         # Top-1 vs top-2 dense score gap considered a clear lead
+    RAG_AMBIGUOUS_MARGIN = 0.02         # Top-1 vs top-2 dense score gap considered ambiguous
+
+    # System prompt layout (see prompt_cache.py): 'cache_friendly' keeps a stable per-school
+    # prefix first so provider context caching can hit, 'legacy' is the original layout,
+    # 'ab' assigns each session to one of them (PROMPT_AB_SPLIT = share on cache_friendly)
+    PROMPT_LAYOUT = os.environ.get('PROMPT_LAYOUT', 'cache_friendly').lower()
+    PROMPT_AB_SPLIT = float(os.environ.get('PROMPT_AB_SPLIT', 0.5))
+    PROMPT_CACHED_TOKEN_PRICE_RATIO = 0.4   # Price of a cached prompt token relative to a regular one
+
+    # Speculative retrieval while typing (see prefetch.py): the frontend posts its draft after a
+    # pause, and /ask reuses the draft's embedding / dense candidates
+    PREFETCH_ENABLED = os.environ.get('PREFETCH_ENABLED', 'True').lower() == 'true'
+    PREFETCH_MIN_CHARS = 8              # Shorter drafts are not prefetched
+    PREFETCH_MIN_INTERVAL = float(os.environ.get('PREFETCH_MIN_INTERVAL', 1.0))  # Seconds between prefetches of one session
+    PREFETCH_MAX_IN_FLIGHT = int(os.environ.get('PREFETCH_MAX_IN_FLIGHT', 2))    # Concurrent prefetches, all sessions
+    PREFETCH_TTL_SECONDS = 120          # Prefetched drafts older than this are not reused
+    PREFETCH_MAX_ENTRIES = 256          # Oldest drafts are dropped beyond this
+    PREFETCH_MAX_EXTENSION_CHARS = 24   # A question may extend a draft by this much and reuse its candidates
 
     # Web search configuration
     ENABLE_WEB_SEARCH_FALLBACK = True   # Whether to enable web search fallback
     WEB_SEARCH_STRATEGY = 'standard'    # Search strategy: standard, pro (pro returns more sources)
 
-# Set Qwen API key
-import dashscope
-dashscope.api_key = Config.DASHSCOPE_API_KEY
\ No newline at end of file
+    # Upstream admission control (limits concurrent DashScope calls)
+    # UPSTREAM_MAX_CONCURRENCY + UPSTREAM_MAX_QUEUE must stay below SERVE_THREADS so
+    # cheap endpoints always have a thread available: the queue is clamped at startup,
+    # and the service refuses to start if the concurrency alone reaches SERVE_THREADS
+    SERVE_THREADS = int(os.environ.get('SERVE_THREADS', 32))    # Request threads per worker (gunicorn.conf.py)
+    UPSTREAM_MAX_CONCURRENCY = int(os.environ.get('UPSTREAM_MAX_CONCURRENCY', 8))
+    UPSTREAM_MAX_QUEUE = int(os.environ.get('UPSTREAM_MAX_QUEUE', 16))
+    UPSTREAM_QUEUE_TIMEOUT = float(os.environ.get('UPSTREAM_QUEUE_TIMEOUT', 5))     # Max seconds to wait for a slot
+    # Max seconds a caller waits for one admitted call; a call past its deadline keeps
+    # running (and holding its slot) until its HTTP request returns, see HTTP_READ_TIMEOUT
+    UPSTREAM_CALL_TIMEOUT = float(os.environ.get('UPSTREAM_CALL_TIMEOUT', 60))
+    UPSTREAM_RETRIEVE_TIMEOUT = float(os.environ.get('UPSTREAM_RETRIEVE_TIMEOUT', 15))    # Per embedding / rerank call
+
+    # Shared HTTP transport for DashScope calls (keep-alive pooling, timeouts, retries)
+    HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))
+    HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 60))
+    HTTP_POOL_HOSTS = 4                 # Number of per-host pools kept
+    HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 16))  # Persistent connections per host
+    HTTP_MAX_RETRIES = 2                # Retries for idempotent calls only
+    HTTP_RETRY_BACKOFF_BASE = 0.2       # Seconds, doubled per attempt (full jitter)
+    HTTP_RETRY_BACKOFF_CAP = 2.0
+    HTTP_RETRY_BUDGET_RATIO = 0.1       # Retries allowed as a share of recent requests
+    HTTP_RETRY_BUDGET_MIN_PER_SEC = 0.5
+    # Endpoints without side effects whose POSTs may be retried (embedding, rerank)
+    HTTP_IDEMPOTENT_PATHS = ('/services/embeddings/', '/services/rerank/')
+
+    # Response compression and conditional caching (see http_caching.py)
+    HTTP_COMPRESSION_ENABLED = os.environ.get('HTTP_COMPRESSION_ENABLED', 'True').lower() == 'true'
+    HTTP_COMPRESS_MIN_BYTES = 1024      # Smaller bodies are sent uncompressed
+    HTTP_GZIP_LEVEL = 6                 # Per-request compression; static bodies are compressed once at max level
+    HTTP_BROTLI_QUALITY = 5
+    INDEX_CACHE_CONTROL = 'no-cache'    # Revalidate index.html with its ETag on every load
+    SCHOOLS_CACHE_CONTROL = 'public, max-age=3600'
+    CHAT_HISTORY_CACHE_CONTROL = 'private, no-cache'
+
+    # Structured event log (JSON lines, see event_log.py); '-' writes to stdout
+    EVENT_LOG_PATH = os.environ.get('EVENT_LOG_PATH', '-')
+    EVENT_LOG_SAMPLE_RATE = float(os.environ.get('EVENT_LOG_SAMPLE_RATE', 1.0))  # Share of request events kept
+    EVENT_LOG_SLOW_MS = 5000            # Slower requests are always logged, like failures
+    EVENT_LOG_QUEUE_SIZE = 10000        # Events beyond this backlog are dropped, never waited on
+    EVENT_LOG_SKIP_PATHS = ('/health', '/prefetch')  # Polled / per-keystroke endpoints that would flood the log
+
+    # Admin endpoints (profiling); disabled while ADMIN_TOKEN is unset
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+    # On-demand profiling (see profiling.py)
+    PROFILE_OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'profiles')
+    PROFILE_MAX_FILES = 50              # Older dumps are deleted
+    PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.01))  # Seconds between stack samples
+    PROFILE_MAX_STACKS = 20000          # Distinct stacks kept per profile, the rest are bucketed
+    PROFILE_SAMPLER_ENABLED = os.environ.get('PROFILE_SAMPLER_ENABLED', 'False').lower() == 'true'
+
+    # Query router configuration (classify questions before retrieval)
+    QUERY_ROUTER_ENABLED = os.environ.get('QUERY_ROUTER_ENABLED', 'True').lower() == 'true'
+    QUERY_ROUTER_MIN_SIMILARITY = 0.2   # Minimum centroid similarity to leave the RAG path
+    QUERY_ROUTER_MIN_MARGIN = 0.1       # Minimum lead over the RAG centroid to leave the RAG path
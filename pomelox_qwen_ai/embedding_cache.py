@@ -0,0 +1,209 @@
+"""
+Embedding Cache Module
+Content-addressed on-disk store of document embeddings, shared by every
+school and every rebuild
+
+Each vector is stored under the hash of (model, text type, embedded text), so
+a chunk that appears in several schools' documents (visa guidance, bank
+accounts, phone plans) or survives a rebuild unchanged is embedded once.
+The knowledge base build wraps its embedding model in CachedEmbedding and only
+sends cache misses to DashScope.
+
+Layout under EMBEDDING_CACHE_PATH:
+    <2-hex prefix>/<sha256>.f32 - float32 vector; the mtime is its last use
+    stats.json                  - cumulative hit / miss counts
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, List
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from config import Config
+
+VECTOR_SUFFIX = '.f32'
+STATS_FILE = 'stats.json'
+
+
+def cache_key(model: str, text_type: str, text: str) -> str:
+    """Content address of one embedding"""
+    return hashlib.sha256('\0'.join((model, text_type, text)).encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Directory of cached vectors with per-instance hit/miss counters
+
+    Writes go to a temporary file that is renamed into place, so concurrent
+    builds sharing a cache directory never read a partial vector.
+    """
+
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = cache_dir or Config.EMBEDDING_CACHE_PATH
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key + VECTOR_SUFFIX)
+
+    def get(self, key: str):
+        """Cached vector as a list of floats, or None; a hit marks the vector as recently used"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                vector = np.frombuffer(f.read(), dtype=np.float32)
+            os.utime(path)
+        except OSError:
+            return None
+        return vector.tolist()
+
+    def put(self, key: str, vector: list):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(np.asarray(vector, dtype=np.float32).tobytes())
+        os.replace(tmp_path, path)
+
+    def lookup(self, keys: list) -> list:
+        """Cached vectors for the given keys (None for misses), counted towards the hit rate"""
+        vectors = [self.get(key) for key in keys]
+        hits = sum(vector is not None for vector in vectors)
+        with self._lock:
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return vectors
+
+    def stats(self) -> dict:
+        """Hit / miss counts of this instance"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else None,
+        }
+
+    def _entries(self) -> list:
+        """(path, bytes, mtime) of every cached vector"""
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for prefix in os.listdir(self.cache_dir):
+            shard = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(shard):
+                continue
+            for name in os.listdir(shard):
+                if name.endswith(VECTOR_SUFFIX):
+                    stat = os.stat(os.path.join(shard, name))
+                    entries.append((os.path.join(shard, name), stat.st_size, stat.st_mtime))
+        return entries
+
+    def usage(self) -> dict:
+        """Number of cached vectors and their total size"""
+        entries = self._entries()
+        return {'vectors': len(entries), 'bytes': sum(size for _, size, _ in entries)}
+
+    def gc(self, max_bytes: int = None) -> dict:
+        """
+        Delete the least recently used vectors until the cache fits its budget
+
+        Args:
+            max_bytes: Size budget (defaults to EMBEDDING_CACHE_MAX_MB)
+
+        Returns:
+            dict: Vectors and bytes removed and kept
+        """
+        if max_bytes is None:
+            max_bytes = Config.EMBEDDING_CACHE_MAX_MB * 1024 * 1024
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        removed = removed_bytes = 0
+        for path, size, _ in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+            removed_bytes += size
+        return {'removed': removed, 'removed_bytes': removed_bytes,
+                'vectors': len(entries) - removed, 'bytes': total}
+
+    def record_run(self) -> dict:
+        """Add this instance's counts to the cumulative stats file and return the totals"""
+        path = os.path.join(self.cache_dir, STATS_FILE)
+        totals = self.load_totals()
+        totals['hits'] += self.hits
+        totals['misses'] += self.misses
+        totals['runs'] += 1
+        totals['updated_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(totals, f)
+        return totals
+
+    def load_totals(self) -> dict:
+        """Cumulative hit / miss counts over all recorded builds"""
+        path = os.path.join(self.cache_dir, STATS_FILE)
+        totals = {'hits': 0, 'misses': 0, 'runs': 0}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                totals.update(json.load(f))
+        return totals
+
+
+class CachedEmbedding(BaseEmbedding):
+    """
+    Embedding model that consults an EmbeddingCache before calling the wrapped model
+
+    Document embeddings are requested in batches; only the texts missing from
+    the cache are sent to the wrapped model, and their vectors are stored.
+    Query embeddings are cached the same way under the 'query' text type.
+    """
+    _inner: Any = PrivateAttr()
+    _cache: Any = PrivateAttr()
+    _text_type: str = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, cache: EmbeddingCache, **kwargs: Any):
+        super().__init__(model_name=inner.model_name, embed_batch_size=inner.embed_batch_size, **kwargs)
+        self._inner = inner
+        self._cache = cache
+        self._text_type = getattr(inner, '_text_type', None) or 'document'
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    def _cached(self, texts: List[str], text_type: str, compute) -> List[List[float]]:
+        keys = [cache_key(self.model_name, text_type, text) for text in texts]
+        vectors = self._cache.lookup(keys)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = compute([texts[i] for i in missing])
+            for i, vector in zip(missing, computed):
+                self._cache.put(keys[i], vector)
+                vectors[i] = vector
+        return vectors
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._cached(texts, self._text_type, self._inner._get_text_embeddings)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._cached([query], 'query', lambda queries: [self._inner._get_query_embedding(queries[0])])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embedding(text)
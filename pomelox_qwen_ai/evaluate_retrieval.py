@@ -0,0 +1,470 @@
+"""
+检索离线评估脚本
+用带标注的问题集（eval_data/questions.jsonl）逐个学校调用 retrieve()，扫描相似度阈值、
+高质量阈值、候选数（top-k）与分块数的组合，报告每组设置的联网搜索比例、检索命中率以及估算的 p50/p95 延迟
+
+查询嵌入与重排序分数缓存在 eval_data/cache/ 中：首次运行调用 DashScope 填充缓存，
+之后的重复运行与参数扫描不再产生 API 调用
+
+问题集每行一个 JSON：
+    {"school_id": "UCI", "question": "...", "answerable": true, "expected": ["SIR"]}
+answerable 表示知识库中有答案；expected 中任意一个片段出现在检索内容里即视为命中
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from config import Config
+from query_router import classify, ROUTE_RAG, ROUTE_WEB_SEARCH
+
+EVAL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'eval_data')
+QUESTIONS_PATH = os.path.join(EVAL_DIR, 'questions.jsonl')
+CACHE_DIR = os.path.join(EVAL_DIR, 'cache')
+RESULTS_PATH = os.path.join(EVAL_DIR, 'results.json')
+
+# 没有实测数据时使用的延迟假设（毫秒），可通过 --events 用线上事件日志替换
+DEFAULT_LATENCY_MS = {
+    'embed': 150.0,
+    'rerank_base': 300.0,
+    'rerank_per_doc': 5.0,
+    'generate_knowledge_base': 2500.0,
+    'generate_web_search': 7000.0,
+    'generate_direct': 1500.0,
+}
+
+DEFAULT_GRID = {
+    'top_k': 'adaptive,40,20,10',
+    'chunks': '3,5,8',
+    'similarity': '0.1,0.2,0.3',
+    'high_quality': '0.4,0.5,0.6',
+}
+
+
+class CacheMiss(Exception):
+    """离线模式下缓存中没有所需的嵌入或重排序分数，或填充缓存的 API 调用失败"""
+
+
+def _key(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class EvalCache:
+    """
+    查询嵌入与重排序分数的磁盘缓存
+
+    嵌入按问题文本缓存；重排序分数按 (问题, 节点ID) 缓存（交叉编码器对每个文档独立打分），
+    因此不同候选数的设置可以共用同一批分数。同时记录实际调用的耗时，用于估算延迟。
+    """
+
+    def __init__(self, cache_dir: str, offline: bool = False):
+        self.cache_dir = cache_dir
+        self.offline = offline
+        self.embeddings = self._load('embeddings.json')
+        self.rerank = self._load('rerank.json')
+        self.live_calls = 0
+        # retrieve() 会吞掉异常并降级，所以缺失与失败在这里记录，由评估流程检查
+        self.failures = []
+        self._dirty = False
+
+    def _load(self, name: str) -> dict:
+        path = os.path.join(self.cache_dir, name)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {}
+
+    def save(self):
+        if not self._dirty:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for name, data in (('embeddings.json', self.embeddings), ('rerank.json', self.rerank)):
+            with open(os.path.join(self.cache_dir, name), 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+        self._dirty = False
+
+    def _fail(self, message: str):
+        self.failures.append(message)
+        raise CacheMiss(message)
+
+    def _call(self, compute, *args):
+        try:
+            return compute(*args)
+        except Exception as e:
+            self._fail(f"API 调用失败: {e}")
+
+    def embedding(self, query: str, compute) -> list:
+        entry = self.embeddings.get(_key(query))
+        if entry is None:
+            if self.offline:
+                self._fail(f"缓存中没有问题的嵌入: {query}")
+            start = time.perf_counter()
+            vector = self._call(compute)
+            entry = {'query': query, 'vector': vector, 'ms': round((time.perf_counter() - start) * 1000, 1)}
+            self.embeddings[_key(query)] = entry
+            self.live_calls += 1
+            self._dirty = True
+        return entry['vector']
+
+    def rerank_scores(self, query: str, nodes: list, compute) -> dict:
+        """返回 {节点ID: 重排序分数}，只对缓存中缺失的节点调用 compute(missing_nodes)"""
+        entry = self.rerank.setdefault(_key(query), {'query': query, 'scores': {}, 'calls': []})
+        missing = [node for node in nodes if node.node.node_id not in entry['scores']]
+        if missing:
+            if self.offline:
+                self._fail(f"缓存中没有 {len(missing)} 个节点的重排序分数: {query}")
+            start = time.perf_counter()
+            entry['scores'].update(self._call(compute, missing))
+            entry['calls'].append({'docs': len(missing), 'ms': round((time.perf_counter() - start) * 1000, 1)})
+            self.live_calls += 1
+            self._dirty = True
+        return entry['scores']
+
+
+def make_cached_clients(cache: EvalCache, embed_model):
+    """构造带缓存的查询嵌入模型与重排序器工厂（接口与 rag_service 中使用的一致）"""
+    from llama_index.core.base.embeddings.base import BaseEmbedding
+    from llama_index.core.bridge.pydantic import PrivateAttr
+    from llama_index.core.schema import NodeWithScore
+    from llama_index.postprocessor.dashscope_rerank import DashScopeRerank
+
+    class CachedQueryEmbedding(BaseEmbedding):
+        _inner: object = PrivateAttr()
+
+        def __init__(self, inner, **kwargs):
+            super().__init__(model_name=f"cached:{inner.model_name}", **kwargs)
+            self._inner = inner
+
+        def _get_query_embedding(self, query: str) -> list:
+            return cache.embedding(query, lambda: self._inner.get_query_embedding(query))
+
+        async def _aget_query_embedding(self, query: str) -> list:
+            return self._get_query_embedding(query)
+
+        def _get_text_embedding(self, text: str) -> list:
+            return self._inner.get_text_embedding(text)
+
+    class CachedRerank:
+        """重排序器替身：分数来自缓存，记录每次重排序的文档数"""
+        last_docs = 0
+
+        def __init__(self, top_n: int, return_documents: bool = True):
+            self.top_n = top_n
+
+        @staticmethod
+        def _compute(missing, query):
+            reranked = DashScopeRerank(top_n=len(missing), return_documents=True).postprocess_nodes(
+                missing, query_str=query
+            )
+            return {node.node.node_id: node.score for node in reranked}
+
+        def postprocess_nodes(self, nodes, query_str: str):
+            CachedRerank.last_docs = len(nodes)
+            scores = cache.rerank_scores(query_str, nodes, lambda missing: self._compute(missing, query_str))
+            rescored = [NodeWithScore(node=node.node, score=scores[node.node.node_id]) for node in nodes]
+            rescored.sort(key=lambda node: node.score, reverse=True)
+            return rescored[:self.top_n]
+
+    return CachedQueryEmbedding(embed_model), CachedRerank
+
+
+@contextmanager
+def override_config(**values):
+    """临时修改 Config 中的参数"""
+    previous = {name: getattr(Config, name) for name in values}
+    for name, value in values.items():
+        setattr(Config, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(Config, name, value)
+
+
+class LatencyModel:
+    """
+    按阶段估算单个请求的延迟
+
+    每个问题固定一个分位点，不同设置下使用相同的分位点（公共随机数），
+    设置之间的差异只来自路径（知识库 / 联网搜索）与重排序深度的变化
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self.rerank_base = DEFAULT_LATENCY_MS['rerank_base']
+        self.rerank_per_doc = DEFAULT_LATENCY_MS['rerank_per_doc']
+        self.sources = {name: 'assumed' for name in DEFAULT_LATENCY_MS}
+
+    def add_samples(self, stage: str, values: list, source: str):
+        if values:
+            self.samples[stage] = np.asarray(values, dtype=float)
+            self.sources[stage] = f"{source} (n={len(values)})"
+
+    def fit_rerank(self, calls: list, source: str):
+        """用 (文档数, 耗时) 拟合重排序延迟 = 基础耗时 + 每文档耗时 * 文档数"""
+        if not calls:
+            return
+        docs = np.asarray([c[0] for c in calls], dtype=float)
+        ms = np.asarray([c[1] for c in calls], dtype=float)
+        if len(set(docs.tolist())) >= 2:
+            per_doc, base = np.polyfit(docs, ms, 1)
+            self.rerank_per_doc = max(float(per_doc), 0.0)
+            self.rerank_base = max(float(base), 0.0)
+        else:
+            self.rerank_base = max(float(np.median(ms - self.rerank_per_doc * docs)), 0.0)
+        self.sources['rerank_base'] = self.sources['rerank_per_doc'] = f"{source} (n={len(calls)})"
+
+    def value(self, stage: str, quantile: float) -> float:
+        if stage in self.samples:
+            return float(np.quantile(self.samples[stage], quantile))
+        return DEFAULT_LATENCY_MS[stage]
+
+    def rerank(self, docs: int) -> float:
+        return self.rerank_base + self.rerank_per_doc * docs if docs else 0.0
+
+    @classmethod
+    def from_sources(cls, cache: EvalCache, events_path: str = None):
+        model = cls()
+        model.add_samples('embed', [e['ms'] for e in cache.embeddings.values() if 'ms' in e], 'cache')
+        model.fit_rerank([(c['docs'], c['ms']) for e in cache.rerank.values() for c in e['calls']], 'cache')
+        if events_path:
+            model.load_events(events_path)
+        return model
+
+    def load_events(self, path: str):
+        """从结构化事件日志（event_log.py）读取线上各阶段的实测耗时"""
+        generate = {'knowledge_base': [], 'web_search': [], 'direct': []}
+        embed, rerank_calls = [], []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event.get('event') != 'request' or event.get('status') != 200:
+                    continue
+                stages = event.get('stages_ms', {})
+                if 'generate' in stages and event.get('source_type') in generate:
+                    generate[event['source_type']].append(stages['generate'])
+                if 'dense_retrieve' in stages:
+                    embed.append(stages['dense_retrieve'])
+                if 'rerank' in stages and event.get('rerank_depth'):
+                    rerank_calls.append((event['rerank_depth'], stages['rerank']))
+        for source_type, values in generate.items():
+            self.add_samples(f'generate_{source_type}', values, 'events')
+        self.add_samples('embed', embed, 'events')
+        self.fit_rerank(rerank_calls, 'events')
+
+
+def load_questions(path: str) -> list:
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def parse_grid(args) -> list:
+    """展开参数网格；候选数从大到小排列，首次填充缓存时先取最宽的候选集"""
+    top_ks = [v.strip() for v in args.top_k.split(',')]
+    top_ks.sort(key=lambda v: (-(Config.RAG_CANDIDATE_MAX_TOP_K if v == 'adaptive' else int(v)), v == 'adaptive'))
+    chunks = [int(v) for v in args.chunks.split(',')]
+    similarity = [float(v) for v in args.similarity.split(',')]
+    high_quality = [float(v) for v in args.high_quality.split(',')]
+    return [
+        {'top_k': top_k, 'chunks': c, 'similarity': s, 'high_quality': h}
+        for top_k, c, s, h in itertools.product(top_ks, chunks, similarity, high_quality)
+    ]
+
+
+def run_setting(setting: dict, questions: list, quantiles: list, latency: LatencyModel,
+                cache: EvalCache, rerank_cls) -> dict:
+    """用一组参数跑完整个问题集，返回汇总指标"""
+    from rag_service import retrieve
+
+    overrides = {
+        'RAG_HIGH_QUALITY_THRESHOLD': setting['high_quality'],
+        'RAG_ADAPTIVE_DEPTH_ENABLED': setting['top_k'] == 'adaptive',
+    }
+    if setting['top_k'] != 'adaptive':
+        overrides['RAG_CANDIDATE_TOP_K'] = int(setting['top_k'])
+
+    web_search = hits = false_fallback = missed_fallback = 0
+    answerable_count = sum(1 for q in questions if q['answerable'])
+    latencies = []
+
+    with override_config(**overrides):
+        for question, quantile in zip(questions, quantiles):
+            route, _ = classify(question['question'], question['school_id'])
+            if route == ROUTE_WEB_SEARCH and not Config.ENABLE_WEB_SEARCH_FALLBACK:
+                route = ROUTE_RAG
+
+            rerank_docs = 0
+            local_ms = 0.0
+            content = ''
+            if route == ROUTE_RAG:
+                rerank_cls.last_docs = 0
+                start = time.perf_counter()
+                content, _, has_high_quality = retrieve(
+                    question['school_id'], question['question'],
+                    chunk_count=setting['chunks'], similarity_threshold=setting['similarity'],
+                )
+                local_ms = (time.perf_counter() - start) * 1000
+                if cache.failures:
+                    raise CacheMiss(cache.failures[0])
+                rerank_docs = rerank_cls.last_docs
+                path = 'web_search' if not has_high_quality and Config.ENABLE_WEB_SEARCH_FALLBACK else 'knowledge_base'
+            else:
+                path = 'web_search' if route == ROUTE_WEB_SEARCH else 'direct'
+
+            if path == 'web_search':
+                web_search += 1
+                if question['answerable']:
+                    false_fallback += 1
+            elif not question['answerable']:
+                missed_fallback += 1
+            if question['answerable'] and any(text in content for text in question['expected']):
+                hits += 1
+
+            ms = latency.value(f'generate_{path}', quantile)
+            if route == ROUTE_RAG:
+                ms += latency.value('embed', quantile) + local_ms + latency.rerank(rerank_docs)
+            latencies.append(ms)
+
+    unanswerable_count = len(questions) - answerable_count
+    return {
+        **setting,
+        'web_search_rate': round(web_search / len(questions), 4),
+        'false_fallback_rate': round(false_fallback / answerable_count, 4) if answerable_count else None,
+        'missed_fallback_rate': round(missed_fallback / unanswerable_count, 4) if unanswerable_count else None,
+        'hit_rate': round(hits / answerable_count, 4) if answerable_count else None,
+        'p50_ms': round(float(np.percentile(latencies, 50)), 1),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 1),
+    }
+
+
+def is_current(setting: dict) -> bool:
+    top_k = 'adaptive' if Config.RAG_ADAPTIVE_DEPTH_ENABLED else str(Config.RAG_CANDIDATE_TOP_K)
+    return (setting['top_k'] == top_k and setting['chunks'] == Config.RAG_CHUNK_COUNT
+            and setting['similarity'] == Config.RAG_SIMILARITY_THRESHOLD
+            and setting['high_quality'] == Config.RAG_HIGH_QUALITY_THRESHOLD)
+
+
+def recommend(results: list):
+    """在命中率与漏判率不差于当前配置的前提下，选联网搜索比例最低（其次 p95 最低）的设置"""
+    current = next((r for r in results if is_current(r)), None)
+    if current is None:
+        return None, None
+    candidates = [
+        r for r in results
+        if r['hit_rate'] >= current['hit_rate']
+        and (r['missed_fallback_rate'] or 0) <= (current['missed_fallback_rate'] or 0)
+    ]
+    best = min(candidates, key=lambda r: (r['web_search_rate'], r['p95_ms']))
+    return current, best
+
+
+def evaluate(questions: list, grid: list, cache: EvalCache, events_path: str = None, seed: int = 0) -> dict:
+    """
+    评估参数网格
+
+    Args:
+        questions: 带标注的问题列表
+        grid: 参数组合列表（见 parse_grid）
+        cache: 嵌入与重排序缓存
+        events_path: 可选的事件日志路径，用于替换延迟假设
+        seed: 延迟分位点的随机种子
+
+    Returns:
+        dict: 每组设置的指标、延迟模型来源、当前配置与推荐配置
+    """
+    from rag_service import set_retrieval_clients, get_embed_model
+
+    embed_model, rerank_cls = make_cached_clients(cache, get_embed_model())
+    set_retrieval_clients(embed_model=embed_model, rerank_factory=rerank_cls)
+
+    rng = np.random.default_rng(seed)
+    quantiles = rng.random(len(questions)).tolist()
+    try:
+        # 先用候选集最宽的设置跑一遍填充缓存，延迟模型在填充之后再建立
+        run_setting(grid[0], questions, quantiles, LatencyModel(), cache, rerank_cls)
+        latency = LatencyModel.from_sources(cache, events_path)
+        results = [run_setting(setting, questions, quantiles, latency, cache, rerank_cls) for setting in grid]
+    finally:
+        cache.save()
+
+    current, best = recommend(results)
+    return {
+        'questions': len(questions),
+        'live_calls': cache.live_calls,
+        'latency_sources': latency.sources,
+        'results': results,
+        'current': current,
+        'recommended': best,
+    }
+
+
+def print_report(report: dict):
+    print(f"问题数: {report['questions']}, 本次 API 调用: {report['live_calls']}")
+    print("延迟来源: " + ", ".join(f"{k}={v}" for k, v in report['latency_sources'].items()))
+    header = (f"  {'top_k':>8}{'chunks':>7}{'sim':>6}{'hq':>6}{'联网%':>8}{'误判联网%':>10}"
+              f"{'漏判%':>8}{'命中%':>8}{'p50(ms)':>10}{'p95(ms)':>10}")
+    print(header)
+    for r in sorted(report['results'], key=lambda r: (r['web_search_rate'], -r['hit_rate'], r['p95_ms'])):
+        marker = '*' if is_current(r) else ' '
+        print(f"{marker} {r['top_k']:>8}{r['chunks']:>7}{r['similarity']:>6}{r['high_quality']:>6}"
+              f"{r['web_search_rate'] * 100:>8.1f}{(r['false_fallback_rate'] or 0) * 100:>10.1f}"
+              f"{(r['missed_fallback_rate'] or 0) * 100:>8.1f}{(r['hit_rate'] or 0) * 100:>8.1f}"
+              f"{r['p50_ms']:>10.0f}{r['p95_ms']:>10.0f}")
+    print("* 当前配置")
+
+    if report['recommended'] is not None:
+        best = report['recommended']
+        print(f"\n推荐: top_k={best['top_k']}, chunks={best['chunks']}, "
+              f"similarity={best['similarity']}, high_quality={best['high_quality']} "
+              f"(联网 {best['web_search_rate'] * 100:.1f}%, 命中 {best['hit_rate'] * 100:.1f}%, p95 {best['p95_ms']:.0f}ms)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='检索参数离线评估')
+    parser.add_argument('--questions', default=QUESTIONS_PATH, help='带标注的问题集 (JSONL)')
+    parser.add_argument('--school', help='只评估指定学校')
+    parser.add_argument('--top-k', default=DEFAULT_GRID['top_k'], help="候选数，'adaptive' 表示自适应深度")
+    parser.add_argument('--chunks', default=DEFAULT_GRID['chunks'], help='最终使用的分块数')
+    parser.add_argument('--similarity', default=DEFAULT_GRID['similarity'], help='RAG_SIMILARITY_THRESHOLD 候选值')
+    parser.add_argument('--high-quality', default=DEFAULT_GRID['high_quality'], help='RAG_HIGH_QUALITY_THRESHOLD 候选值')
+    parser.add_argument('--events', help='事件日志 (JSONL)，用线上实测耗时代替延迟假设')
+    parser.add_argument('--offline', action='store_true', help='只使用缓存，缺失时报错而不调用 API')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--output', default=RESULTS_PATH, help='结果 JSON 输出路径')
+    args = parser.parse_args(argv)
+
+    questions = load_questions(args.questions)
+    if args.school:
+        questions = [q for q in questions if q['school_id'] == args.school]
+    if not questions:
+        print("问题集为空")
+        return 1
+
+    cache = EvalCache(args.cache_dir, offline=args.offline)
+    try:
+        report = evaluate(questions, parse_grid(args), cache, args.events)
+    except CacheMiss as e:
+        print(f"{e}\n去掉 --offline 运行一次以填充缓存（需要 DASHSCOPE_API_KEY）")
+        return 1
+
+    print_report(report)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入: {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    # 用法:
+    #   python evaluate_retrieval.py                          - 扫描默认参数网格
+    #   python evaluate_retrieval.py --school UCLA --offline  - 只用缓存评估单个学校
+    #   python evaluate_retrieval.py --events logs/events.jsonl --similarity 0.2 --high-quality 0.4,0.45,0.5
+    sys.exit(main())
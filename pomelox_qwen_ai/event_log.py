@@ -0,0 +1,265 @@
+"""
+Event Log Module
+Structured JSON-lines event log written by a background thread
+
+Request threads only put records on a bounded in-memory queue (records are
+dropped and counted when it is full, never waited on); serialization and
+I/O happen on the listener thread. Each request produces one `request`
+event carrying its request id, school, route, scores and stage timings,
+filled in along the way with annotate() and stage(). Standalone events
+(index loads, failures) are written with log_event().
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import g, request
+from config import Config
+
+REQUEST_ID_HEADER = 'X-Request-Id'
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+_LEVELS = {'debug': logging.DEBUG, 'info': logging.INFO, 'warning': logging.WARNING, 'error': logging.ERROR}
+
+_logger = logging.getLogger('pomelox.events')
+_logger.setLevel(logging.DEBUG)
+_logger.propagate = False
+
+_request_state = contextvars.ContextVar('event_log_request', default=None)
+
+
+class _JsonLinesFormatter(logging.Formatter):
+    """Renders the event dict carried in record.msg (runs on the listener thread)"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        event = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'pid': record.process,
+            **record.msg,
+        }
+        return json.dumps(event, ensure_ascii=False, default=str)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks: a full queue drops the record"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The event dict is serialized by the listener, not on the request thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    """Waits for room for the stop sentinel, so stop() drains even a full queue"""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class _EventLog:
+    """Queue, handler and listener of the current process (rebuilt after fork)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._path = None
+        self.handler = None
+        self.listener = None
+
+    def _output_handler(self) -> logging.Handler:
+        if Config.EVENT_LOG_PATH in ('', '-'):
+            handler = logging.StreamHandler(sys.stdout)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(Config.EVENT_LOG_PATH)), exist_ok=True)
+            # Append mode: workers of a pre-forked server can share one file
+            handler = logging.FileHandler(Config.EVENT_LOG_PATH, mode='a', encoding='utf-8')
+        handler.setFormatter(_JsonLinesFormatter())
+        return handler
+
+    def _current(self) -> bool:
+        return self._pid == os.getpid() and self._path == Config.EVENT_LOG_PATH
+
+    def ensure_started(self):
+        if self._current():
+            return
+        with self._lock:
+            if self._current():
+                return
+            # Threads do not survive fork: start a fresh queue and listener per
+            # process (and when the output path was reconfigured)
+            if self.handler is not None:
+                _logger.removeHandler(self.handler)
+                if self._pid == os.getpid():
+                    self.listener.stop()
+                    for handler in self.listener.handlers:
+                        handler.close()
+            log_queue = queue.Queue(maxsize=Config.EVENT_LOG_QUEUE_SIZE)
+            self.handler = _DroppingQueueHandler(log_queue)
+            self.listener = _QueueListener(log_queue, self._output_handler())
+            self.listener.start()
+            _logger.addHandler(self.handler)
+            self._pid = os.getpid()
+            self._path = Config.EVENT_LOG_PATH
+
+    def flush(self):
+        """Drain the queue (stops and restarts the listener); for tests and shutdown"""
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.flush()
+            self.listener.start()
+
+    def stats(self) -> dict:
+        if self.handler is None:
+            return {'queued': 0, 'dropped': 0}
+        return {'queued': self.handler.queue.qsize(), 'dropped': self.handler.dropped}
+
+
+_event_log = _EventLog()
+
+
+def log_event(event: str, level: str = 'info', **fields):
+    """
+    Write one standalone event (tagged with the current request id, if any)
+
+    Args:
+        event: Event name, e.g. 'index_loaded'
+        level: 'debug', 'info', 'warning' or 'error'
+        **fields: JSON-serializable event fields
+    """
+    _event_log.ensure_started()
+    state = _request_state.get()
+    if state is not None:
+        fields.setdefault('request_id', state['request_id'])
+    _logger.log(_LEVELS.get(level, logging.INFO), {'event': event, **fields})
+
+
+def annotate(**fields):
+    """Add fields to the current request's event (no-op outside a request)"""
+    state = _request_state.get()
+    if state is not None:
+        state['fields'].update(fields)
+
+
+@contextmanager
+def stage(name: str):
+    """Time a stage of the current request; repeated stages accumulate"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        state = _request_state.get()
+        if state is not None:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            state['stages'][name] = round(state['stages'].get(name, 0.0) + elapsed_ms, 2)
+
+
+def current_request_id():
+    state = _request_state.get()
+    return state['request_id'] if state is not None else None
+
+
+def begin_request(request_id: str = None):
+    """
+    Open the event of a request in the current context
+
+    Returns:
+        Token for end_request()
+    """
+    state = {
+        'request_id': request_id or uuid.uuid4().hex,
+        'start': time.perf_counter(),
+        'fields': {},
+        'stages': {},
+    }
+    return _request_state.set(state)
+
+
+def end_request(token, status: int = None, error: str = None):
+    """Close the request event and write it unless sampled out"""
+    state = _request_state.get()
+    _request_state.reset(token)
+    if state is None:
+        return
+
+    duration_ms = (time.perf_counter() - state['start']) * 1000
+    # Failures and slow requests are always kept; the rest are sampled
+    keep = (error is not None or (status or 0) >= 500 or duration_ms >= Config.EVENT_LOG_SLOW_MS
+            or random.random() < Config.EVENT_LOG_SAMPLE_RATE)
+    if not keep:
+        return
+
+    event = {
+        'event': 'request',
+        'request_id': state['request_id'],
+        **state['fields'],
+        'status': status,
+        'duration_ms': round(duration_ms, 2),
+        'stages_ms': dict(state['stages']),
+    }
+    if error is not None:
+        event['error'] = error
+    _event_log.ensure_started()
+    _logger.log(logging.ERROR if error or (status or 0) >= 500 else logging.INFO, event)
+
+
+def _before_request():
+    if request.path in Config.EVENT_LOG_SKIP_PATHS:
+        return
+    incoming = request.headers.get(REQUEST_ID_HEADER, '')
+    g.event_log_token = begin_request(incoming if _VALID_REQUEST_ID.match(incoming) else None)
+    annotate(method=request.method, path=request.path)
+
+
+def _after_request(response):
+    request_id = current_request_id()
+    if request_id is not None and 'event_log_token' in g:
+        response.headers[REQUEST_ID_HEADER] = request_id
+        g.event_log_status = response.status_code
+    return response
+
+
+def _teardown_request(exc):
+    token = g.pop('event_log_token', None)
+    if token is not None:
+        end_request(token, status=g.pop('event_log_status', None),
+                    error=f"{type(exc).__name__}: {exc}" if exc is not None else None)
+
+
+def init_app(app):
+    """Register per-request event logging on a Flask app"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+
+
+def flush():
+    """Block until every queued event has been written"""
+    _event_log.flush()
+
+
+def get_event_log_stats() -> dict:
+    """Queue depth and records dropped because the queue was full"""
+    return _event_log.stats()
@@ -0,0 +1,198 @@
+"""
+FAQ Answers Module
+Answers to each school's predictable questions, generated at build time and
+served without retrieval or generation
+
+A school's FAQ list (one question per line in FAQ_SOURCE_PATH/<school_id>.txt)
+is answered when its index is built: each question is retrieved and generated
+exactly like a live /ask, and only answers grounded in a high-quality
+retrieval are kept. Answers are stored next to the index together with the
+question embeddings and a fingerprint of the index they were generated from,
+so a rebuilt index never serves answers from an older build.
+
+File written next to the vector store:
+    faq_answers.json - index fingerprint, questions, embeddings, answers
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from config import Config
+from event_log import annotate, log_event
+from rag_service import retrieve, get_system_prompt, get_embed_model, embed_query
+from upstream import PRIORITY_BACKGROUND
+
+FAQ_FILE = 'faq_answers.json'
+FORMAT_VERSION = 1
+
+# The index file whose content identifies a build
+_FINGERPRINT_FILE = 'index_store.json'
+
+# Loaded answers per school: None when the school has none
+_faq_cache = {}
+_faq_lock = threading.Lock()
+
+
+def faq_source_path(school_id: str) -> str:
+    """Path of a school's FAQ question list"""
+    return os.path.join(Config.FAQ_SOURCE_PATH, f"{school_id}.txt")
+
+
+def read_faq_questions(path: str) -> list:
+    """Read a FAQ list: one question per line, blank lines and '#' comments ignored"""
+    with open(path, 'r', encoding='utf-8') as f:
+        lines = (line.strip() for line in f)
+        return list(dict.fromkeys(line for line in lines if line and not line.startswith('#')))
+
+
+def index_fingerprint(store_dir: str) -> str:
+    """Fingerprint of a persisted index (changes on every rebuild)"""
+    with open(os.path.join(store_dir, _FINGERPRINT_FILE), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+
+def remove_faq_answers(store_dir: str):
+    """Delete stored answers (called before an index is rebuilt)"""
+    path = os.path.join(store_dir, FAQ_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _generate_answer(messages: list) -> str:
+    """Generate one answer with the model used by /ask"""
+    from http_transport import load_dashscope
+    response = load_dashscope().Generation.call(model='qwen-plus', messages=messages, result_format='message')
+    if response.status_code != 200:
+        raise Exception(f'API call failed: {response.message}')
+    return response.output.choices[0].message.content
+
+
+def build_faq_answers(school_id: str, questions: list, generate=None) -> dict:
+    """
+    Pre-generate grounded answers for a school's FAQ list and store them
+    with the school's index
+
+    Args:
+        school_id: School ID (its index must already be persisted)
+        questions: FAQ questions
+        generate: Callable taking a message list and returning the answer (defaults to qwen-plus)
+
+    Returns:
+        dict: Counts of stored answers and of questions skipped (low score, failed)
+    """
+    generate = generate or _generate_answer
+    store_dir = os.path.join(Config.VECTOR_STORE_PATH, school_id)
+    embed_model = get_embed_model()
+
+    entries = []
+    report = {'questions': len(questions), 'answered': 0, 'low_score': 0, 'failed': 0}
+    for question in questions:
+        try:
+            embedding = embed_model.get_query_embedding(question)
+            content, score, has_high_quality = retrieve(school_id, question, query_embedding=embedding,
+                                                        priority=PRIORITY_BACKGROUND)
+            if not has_high_quality:
+                # Live requests would fall back to web search for this question
+                report['low_score'] += 1
+                continue
+            messages = [
+                {'role': 'system', 'content': get_system_prompt(school_id, content)},
+                {'role': 'user', 'content': question},
+            ]
+            answer = generate(messages)
+        except Exception as e:
+            log_event('faq_answer_failed', level='warning', school_id=school_id, question=question, error=str(e))
+            report['failed'] += 1
+            continue
+        entries.append({
+            'question': question,
+            'answer': answer,
+            'rag_score': round(score, 4),
+            'embedding': embedding,
+        })
+        report['answered'] += 1
+
+    with open(os.path.join(store_dir, FAQ_FILE), 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': FORMAT_VERSION,
+            'index_fingerprint': index_fingerprint(store_dir),
+            'generated_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'entries': entries,
+        }, f, ensure_ascii=False)
+
+    with _faq_lock:
+        _faq_cache.pop(school_id, None)
+    return report
+
+
+def _load(school_id: str):
+    """Load a school's stored answers as (normalized embedding matrix, entries), or None"""
+    store_dir = os.path.join(Config.VECTOR_STORE_PATH, school_id)
+    path = os.path.join(store_dir, FAQ_FILE)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            stored = json.load(f)
+        if stored.get('index_fingerprint') != index_fingerprint(store_dir):
+            log_event('faq_answers_stale', level='warning', school_id=school_id,
+                      hint=f'run: python build_knowledge_base.py faq {school_id}')
+            return None
+        entries = stored['entries']
+        if not entries:
+            return None
+
+        import numpy as np
+        matrix = np.asarray([entry.pop('embedding') for entry in entries], dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        log_event('faq_answers_loaded', school_id=school_id, answers=len(entries))
+        return matrix / norms, entries
+    except Exception as e:
+        log_event('faq_answers_load_failed', level='error', school_id=school_id, error=str(e))
+        return None
+
+
+def _get(school_id: str):
+    if school_id not in _faq_cache:
+        with _faq_lock:
+            if school_id not in _faq_cache:
+                _faq_cache[school_id] = _load(school_id)
+    return _faq_cache[school_id]
+
+
+def has_faq_answers(school_id: str) -> bool:
+    """Whether the school has stored answers that match its current index"""
+    return Config.FAQ_ANSWERS_ENABLED and _get(school_id) is not None
+
+
+def match_faq(school_id: str, question: str, query_embedding: list = None) -> tuple:
+    """
+    Find the stored answer whose question is closest to the given one
+
+    Args:
+        school_id: School ID
+        question: User question
+        query_embedding: Embedding of the question, if already computed
+
+    Returns:
+        tuple: (matched entry with its 'similarity', or None below FAQ_MATCH_THRESHOLD;
+            question embedding, reusable by retrieve())
+    """
+    faq = _get(school_id)
+    embedding = query_embedding if query_embedding is not None else embed_query(question)
+    if faq is None:
+        return None, embedding
+
+    import numpy as np
+    matrix, entries = faq
+    query = np.asarray(embedding, dtype=np.float32)
+    similarities = matrix @ (query / (np.linalg.norm(query) or 1.0))
+    best = int(similarities.argmax())
+    similarity = float(similarities[best])
+    annotate(faq_similarity=round(similarity, 4))
+    if similarity < Config.FAQ_MATCH_THRESHOLD:
+        return None, embedding
+    return {**entries[best], 'similarity': similarity}, embedding
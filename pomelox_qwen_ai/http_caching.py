@@ -0,0 +1,169 @@
+"""
+HTTP Caching Module
+gzip/brotli response compression, strong ETags with 304 Not Modified and
+Cache-Control for the static page and read-mostly endpoints
+"""
+import gzip
+import hashlib
+import os
+import threading
+
+from flask import Response, current_app, request
+from config import Config
+
+try:
+    import brotli
+except ImportError:     # Optional: without it only gzip is offered
+    brotli = None
+
+# Mimetypes worth compressing (already-compressed formats are skipped)
+COMPRESSIBLE_MIMETYPES = frozenset({
+    'text/html', 'text/plain', 'text/css', 'text/javascript',
+    'application/json', 'application/javascript',
+})
+
+_STATIC_GZIP_LEVEL = 9
+_STATIC_BROTLI_QUALITY = 11
+
+
+def supported_encodings() -> tuple:
+    """Content codings this process can produce, in order of preference"""
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate_encoding(body_size: int, mimetype: str):
+    """
+    Pick the content coding for the current request
+
+    Returns:
+        str or None: 'br', 'gzip' or None (send identity)
+    """
+    if not Config.HTTP_COMPRESSION_ENABLED or body_size < Config.HTTP_COMPRESS_MIN_BYTES:
+        return None
+    if mimetype not in COMPRESSIBLE_MIMETYPES:
+        return None
+    accepted = request.accept_encodings
+    for encoding in supported_encodings():
+        if accepted.quality(encoding) > 0:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: str, static: bool = False) -> bytes:
+    """Compress a body; static bodies are compressed once, so use the max level"""
+    if encoding == 'br':
+        quality = _STATIC_BROTLI_QUALITY if static else Config.HTTP_BROTLI_QUALITY
+        return brotli.compress(body, quality=quality)
+    level = _STATIC_GZIP_LEVEL if static else Config.HTTP_GZIP_LEVEL
+    # mtime=0 keeps the output (and therefore the ETag) reproducible
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+
+def _encoded_etag(etag: str, encoding) -> str:
+    """Each coding is a different representation, so it gets its own strong ETag"""
+    return f"{etag}-{encoding}" if encoding else etag
+
+
+class CachedBody:
+    """
+    A response body with its strong ETag; compressed variants are built on
+    first request and kept for the lifetime of the object
+    """
+
+    def __init__(self, body: bytes, mimetype: str, static: bool = False):
+        self.body = body
+        self.mimetype = mimetype
+        self.static = static
+        self.etag = hashlib.sha256(body).hexdigest()[:32]
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding) -> bytes:
+        if encoding is None:
+            return self.body
+        data = self._encoded.get(encoding)
+        if data is None:
+            data = compress(self.body, encoding, static=self.static)
+            if self.static:
+                with self._lock:
+                    self._encoded[encoding] = data
+        return data
+
+
+class StaticFile:
+    """A file served from memory, reloaded when its mtime or size changes"""
+
+    def __init__(self, path: str, mimetype: str):
+        self.path = path
+        self.mimetype = mimetype
+        self._lock = threading.Lock()
+        self._signature = None
+        self._cached = None
+
+    def get(self) -> CachedBody:
+        """Raises FileNotFoundError when the file is missing"""
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature != self._signature:
+            with self._lock:
+                if signature != self._signature:
+                    with open(self.path, 'rb') as f:
+                        self._cached = CachedBody(f.read(), self.mimetype, static=True)
+                    self._signature = signature
+        return self._cached
+
+
+def cached_response(cached: CachedBody, cache_control: str) -> Response:
+    """
+    Build a response for a cached body: 304 when the client's ETag still
+    matches, otherwise the best encoding the client accepts
+
+    Args:
+        cached: Body with ETag
+        cache_control: Cache-Control header value
+
+    Returns:
+        Response
+    """
+    encoding = negotiate_encoding(len(cached.body), cached.mimetype)
+    etag = _encoded_etag(cached.etag, encoding)
+
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = Response(cached.encoded(encoding), mimetype=cached.mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def json_response(payload, cache_control: str) -> Response:
+    """Serialize like jsonify() and answer conditionally"""
+    body = current_app.json.dumps(payload).encode('utf-8') + b'\n'
+    return cached_response(CachedBody(body, 'application/json'), cache_control)
+
+
+def compress_response(response: Response) -> Response:
+    """after_request hook: compress other sufficiently large responses"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    body = response.get_data()
+    encoding = negotiate_encoding(len(body), response.mimetype)
+    response.vary.add('Accept-Encoding')
+    if encoding is None:
+        return response
+
+    response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    """Register response compression on a Flask app"""
+    app.after_request(compress_response)
@@ -0,0 +1,248 @@
+"""
+HTTP Transport Module
+Shared keep-alive connection pool, timeouts and budgeted retries for every
+DashScope call (generation, embedding and rerank)
+"""
+import random
+import threading
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from config import Config
+from event_log import log_event
+
+# Status codes worth retrying for idempotent calls
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+
+class RetryBudget:
+    """
+    Sliding-window retry budget
+
+    Retries are allowed up to `ratio` of the requests seen in the last
+    `window` seconds, plus a small fixed allowance, so retries can never
+    multiply load on an upstream that is already failing.
+    """
+
+    def __init__(self, ratio: float, min_per_second: float, window: float = 10.0):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self._lock = threading.Lock()
+        self._requests = deque()
+        self._retries = deque()
+
+    def _prune(self, now: float):
+        cutoff = now - self.window
+        while self._requests and self._requests[0] < cutoff:
+            self._requests.popleft()
+        while self._retries and self._retries[0] < cutoff:
+            self._retries.popleft()
+
+    def record_request(self):
+        """Register one first attempt"""
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            self._requests.append(now)
+
+    def try_spend(self) -> bool:
+        """Take one retry from the budget if available"""
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            allowed = self.min_per_second * self.window + self.ratio * len(self._requests)
+            if len(self._retries) >= allowed:
+                return False
+            self._retries.append(now)
+            return True
+
+
+class PooledSession(requests.Session):
+    """
+    requests.Session with pooled persistent connections, default timeouts
+    and jittered retries for idempotent calls
+
+    The session is shared for the whole process, so close() is a no-op;
+    callers that use it as a context manager do not tear down the pool.
+    """
+
+    def __init__(self):
+        super().__init__()
+        adapter = HTTPAdapter(
+            pool_connections=Config.HTTP_POOL_HOSTS,
+            pool_maxsize=Config.HTTP_POOL_MAXSIZE,
+            max_retries=0,
+        )
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+        self._adapter = adapter
+        self._budget = RetryBudget(Config.HTTP_RETRY_BUDGET_RATIO, Config.HTTP_RETRY_BUDGET_MIN_PER_SEC)
+        self._stats_lock = threading.Lock()
+        self._host_stats = {}
+
+    def _count(self, host: str, key: str):
+        with self._stats_lock:
+            stats = self._host_stats.setdefault(
+                host, {'requests': 0, 'retries': 0, 'retries_denied': 0, 'errors': 0}
+            )
+            stats[key] += 1
+
+    @staticmethod
+    def _is_idempotent(method: str, url: str) -> bool:
+        """GET/HEAD, and POSTs to endpoints known to be side-effect free"""
+        if method.upper() in ('GET', 'HEAD', 'OPTIONS'):
+            return True
+        path = urlsplit(url).path
+        return any(marker in path for marker in Config.HTTP_IDEMPOTENT_PATHS)
+
+    @staticmethod
+    def _backoff(attempt: int, response=None) -> float:
+        """Full-jitter exponential backoff, honouring Retry-After when present"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), Config.HTTP_RETRY_BACKOFF_CAP)
+        ceiling = min(Config.HTTP_RETRY_BACKOFF_CAP, Config.HTTP_RETRY_BACKOFF_BASE * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    def request(self, method, url, *args, **kwargs):
+        # Service-wide timeouts replace whatever the SDK passes
+        kwargs['timeout'] = (Config.HTTP_CONNECT_TIMEOUT, Config.HTTP_READ_TIMEOUT)
+        host = urlsplit(url).netloc
+        max_retries = Config.HTTP_MAX_RETRIES if self._is_idempotent(method, url) else 0
+
+        self._count(host, 'requests')
+        self._budget.record_request()
+
+        attempt = 0
+        while True:
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                self._count(host, 'errors')
+                if attempt >= max_retries or not self._retry_allowed(host):
+                    raise
+                time.sleep(self._backoff(attempt))
+                attempt += 1
+                continue
+
+            if response.status_code not in RETRYABLE_STATUS or attempt >= max_retries:
+                return response
+            if not self._retry_allowed(host):
+                return response
+
+            delay = self._backoff(attempt, response)
+            response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def _retry_allowed(self, host: str) -> bool:
+        if self._budget.try_spend():
+            self._count(host, 'retries')
+            return True
+        self._count(host, 'retries_denied')
+        return False
+
+    def close(self):
+        """Shared session: keep the pool alive when callers 'close' it"""
+
+    def shutdown(self):
+        """Really close all pooled connections"""
+        super().close()
+
+    def stats(self) -> dict:
+        """Per-host request/retry counters and connection pool usage"""
+        with self._stats_lock:
+            hosts = {host: dict(values) for host, values in self._host_stats.items()}
+
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = pool.host if pool.port in (None, 80, 443) else f"{pool.host}:{pool.port}"
+            entry = hosts.setdefault(host, {})
+            entry['connections_opened'] = entry.get('connections_opened', 0) + pool.num_connections
+            entry['pooled_requests'] = entry.get('pooled_requests', 0) + pool.num_requests
+            # The pool queue is pre-filled with None placeholders for unopened slots
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None)
+            entry['idle_connections'] = entry.get('idle_connections', 0) + idle
+            entry['pool_maxsize'] = pool.pool.maxsize
+
+        for entry in hosts.values():
+            if entry.get('pooled_requests'):
+                entry['connection_reuse_ratio'] = round(
+                    1 - entry.get('connections_opened', 0) / entry['pooled_requests'], 3
+                )
+        return hosts
+
+
+# Shared session for the whole service
+session = PooledSession()
+
+
+class _DashScopeRequestsShim:
+    """Stands in for the `requests` module inside the DashScope SDK so its
+    per-call `requests.Session()` resolves to the shared pooled session"""
+
+    def Session(self):
+        return session
+
+    def __getattr__(self, name):
+        return getattr(requests, name)
+
+
+_dashscope = None
+_dashscope_lock = threading.Lock()
+
+
+def load_dashscope():
+    """
+    Import the DashScope SDK on first use, set the API key and install the
+    pooled transport
+
+    Returns:
+        module: The configured dashscope module
+    """
+    global _dashscope
+    if _dashscope is not None:
+        return _dashscope
+
+    with _dashscope_lock:
+        if _dashscope is None:
+            import dashscope
+            dashscope.api_key = Config.DASHSCOPE_API_KEY
+            install_dashscope_transport()
+            _dashscope = dashscope
+    return _dashscope
+
+
+def install_dashscope_transport() -> bool:
+    """
+    Route all DashScope SDK HTTP calls through the shared pooled session
+
+    Returns:
+        bool: Whether the SDK hook was installed
+    """
+    try:
+        from dashscope.api_entities import http_request
+    except ImportError as e:
+        log_event('transport_not_installed', level='warning', reason=f"DashScope SDK not available: {e}")
+        return False
+
+    if not hasattr(http_request, 'requests'):
+        log_event('transport_not_installed', level='warning', reason='Unexpected DashScope SDK layout')
+        return False
+
+    if not isinstance(http_request.requests, _DashScopeRequestsShim):
+        http_request.requests = _DashScopeRequestsShim()
+    return True
+
+
+def get_transport_stats() -> dict:
+    """Get transport metrics for diagnostics"""
+    return session.stats()
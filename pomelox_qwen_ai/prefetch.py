@@ -0,0 +1,242 @@
+"""
+Prefetch Module
+Speculative retrieval while the user is still typing
+
+After a pause in typing, the frontend posts its draft question to /prefetch.
+The query embedding and the dense candidate set for (school_id, draft) are
+computed in the background and kept for a short time. /ask reuses both
+when the submitted question equals the draft. When the question extends the
+draft by a few characters, the draft's candidates are only a candidate set:
+all of them are reranked with the actual question, never skipped on the
+strength of the draft's dense scores.
+
+Prefetches never compete with answers: each session may prefetch at most once
+per PREFETCH_MIN_INTERVAL seconds, at most PREFETCH_MAX_IN_FLIGHT run at once,
+and a newer draft or the /ask of the same session cancels a prefetch that has
+not reached its embedding call yet. The embedding is started with
+scheduler.submit(), which only takes an upstream slot that is free right now
+(never while calls are queued), and the /prefetch request returns without
+waiting for it. Schools whose index is not loaded yet are not prefetched:
+the cold load is left to /ask.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from config import Config
+from event_log import annotate, log_event
+from query_router import classify, ROUTE_DIRECT, ROUTE_WEB_SEARCH
+from rag_service import is_index_loaded, get_embed_model, search_candidates
+from upstream import scheduler, UpstreamSaturated
+
+# Outcomes of a prefetch request (ACCEPTED prefetches end as PREFETCHED, CANCELLED or FAILED)
+ACCEPTED = 'accepted'
+PREFETCHED = 'prefetched'
+CACHED = 'cached'
+IN_FLIGHT = 'in_flight'
+SKIPPED = 'skipped'
+RATE_LIMITED = 'rate_limited'
+BUSY = 'busy'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+
+_lock = threading.Lock()
+_entries = OrderedDict()    # (school_id, draft) -> {'embedding', 'candidates', 'created'}, oldest first
+_pending = {}               # client key -> cancellation token of its latest prefetch
+_running_keys = set()       # (school_id, draft) currently being computed
+_last_accepted = {}         # client key -> time.monotonic() of its last accepted prefetch
+_stats = {
+    'requests': 0,
+    ACCEPTED: 0, PREFETCHED: 0, CACHED: 0, IN_FLIGHT: 0, SKIPPED: 0, RATE_LIMITED: 0, BUSY: 0, CANCELLED: 0, FAILED: 0,
+    'reused_exact': 0, 'reused_extension': 0, 'not_reused': 0,
+}
+
+
+class _Token:
+    """Cancellation flag of one prefetch"""
+
+    def __init__(self):
+        self.cancelled = False
+
+
+def normalize(text: str) -> str:
+    """Drafts and questions are compared with whitespace collapsed"""
+    return ' '.join(text.split())
+
+
+def _count(outcome: str) -> str:
+    with _lock:
+        _stats[outcome] += 1
+    return outcome
+
+
+def _fresh(entry: dict, now: float) -> bool:
+    return now - entry['created'] <= Config.PREFETCH_TTL_SECONDS
+
+
+def _admit(client_key: str, key: tuple, now: float):
+    """Apply the rate limits; returns (outcome, token) with token set when the prefetch may run"""
+    with _lock:
+        _stats['requests'] += 1
+        entry = _entries.get(key)
+        if entry is not None and _fresh(entry, now):
+            _stats[CACHED] += 1
+            return CACHED, None
+        if key in _running_keys:
+            _stats[IN_FLIGHT] += 1
+            return IN_FLIGHT, None
+        last = _last_accepted.get(client_key)
+        if last is not None and now - last < Config.PREFETCH_MIN_INTERVAL:
+            _stats[RATE_LIMITED] += 1
+            return RATE_LIMITED, None
+        if len(_running_keys) >= Config.PREFETCH_MAX_IN_FLIGHT:
+            _stats[BUSY] += 1
+            return BUSY, None
+
+        # A newer draft supersedes the session's previous prefetch
+        previous = _pending.get(client_key)
+        if previous is not None:
+            previous.cancelled = True
+        token = _Token()
+        _pending[client_key] = token
+        _running_keys.add(key)
+        _last_accepted[client_key] = now
+        if len(_last_accepted) > 4 * Config.PREFETCH_MAX_ENTRIES:
+            for stale in [k for k, t in _last_accepted.items() if now - t >= Config.PREFETCH_MIN_INTERVAL]:
+                del _last_accepted[stale]
+        return None, token
+
+
+def prefetch(client_key: str, school_id: str, draft: str) -> str:
+    """
+    Start computing the query embedding and dense candidates of a draft question
+
+    Args:
+        client_key: Session ID (or client address) the rate limit applies to
+        school_id: School ID
+        draft: Text typed so far
+
+    Returns:
+        str: Outcome (ACCEPTED, CACHED, IN_FLIGHT, SKIPPED, RATE_LIMITED or BUSY)
+    """
+    draft = normalize(draft)
+    if len(draft) < Config.PREFETCH_MIN_CHARS or not is_index_loaded(school_id):
+        return _count(SKIPPED)
+    # Questions /ask would answer without retrieval are not worth an embedding call
+    route, _ = classify(draft, school_id) if Config.QUERY_ROUTER_ENABLED else (None, None)
+    if route == ROUTE_DIRECT or (route == ROUTE_WEB_SEARCH and Config.ENABLE_WEB_SEARCH_FALLBACK):
+        return _count(SKIPPED)
+
+    key = (school_id, draft)
+    outcome, token = _admit(client_key, key, time.monotonic())
+    if token is None:
+        return outcome
+
+    def embed():
+        # The session may have moved on while the call waited for a worker thread
+        return None if token.cancelled else get_embed_model().get_query_embedding(draft)
+
+    try:
+        future = scheduler.submit(embed)
+    except UpstreamSaturated:
+        _finish(client_key, key, token)
+        return _count(BUSY)
+    future.add_done_callback(lambda done: _complete(client_key, school_id, key, token, done))
+    return _count(ACCEPTED)
+
+
+def _finish(client_key: str, key: tuple, token: _Token):
+    with _lock:
+        _running_keys.discard(key)
+        if _pending.get(client_key) is token:
+            del _pending[client_key]
+
+
+def _complete(client_key: str, school_id: str, key: tuple, token: _Token, future):
+    """Keep the result of a finished embedding call (runs on the upstream worker thread)"""
+    try:
+        embedding = future.result()
+        if embedding is None:
+            _count(CANCELLED)
+            return
+        # The embedding is paid for; the (local) dense search is cheap, so keep the result
+        candidates = search_candidates(school_id, key[1], embedding)
+    except Exception as e:
+        log_event('prefetch_failed', level='warning', school_id=school_id, error=str(e))
+        _count(FAILED)
+        return
+    finally:
+        _finish(client_key, key, token)
+
+    with _lock:
+        _entries[key] = {'embedding': embedding, 'candidates': candidates, 'created': time.monotonic()}
+        _entries.move_to_end(key)
+        while len(_entries) > Config.PREFETCH_MAX_ENTRIES:
+            _entries.popitem(last=False)
+        _stats[PREFETCHED] += 1
+
+
+def cancel(client_key: str):
+    """Cancel the client's pending prefetch (its question has been submitted)"""
+    with _lock:
+        token = _pending.pop(client_key, None)
+    if token is not None:
+        token.cancelled = True
+
+
+def find(school_id: str, question: str):
+    """
+    Prefetched work reusable for a submitted question
+
+    Args:
+        school_id: School ID
+        question: Submitted question
+
+    Returns:
+        dict or None: {'embedding', 'candidates', 'exact'}; the embedding is only
+            returned when the question equals the draft (an extended question
+            has a different embedding; the draft's candidates must be reranked in full,
+            see retrieve(rerank_all=True))
+    """
+    question = normalize(question)
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get((school_id, question))
+        exact = entry is not None and _fresh(entry, now)
+        if not exact:
+            entry = None
+            # The longest draft the question extends by at most PREFETCH_MAX_EXTENSION_CHARS
+            for (entry_school, draft), candidate in _entries.items():
+                if entry_school == school_id and _fresh(candidate, now) and question.startswith(draft) \
+                        and len(question) - len(draft) <= Config.PREFETCH_MAX_EXTENSION_CHARS \
+                        and (entry is None or len(draft) > entry['draft_length']):
+                    entry = dict(candidate, draft_length=len(draft))
+        outcome = 'reused_exact' if exact else ('reused_extension' if entry is not None else 'not_reused')
+        _stats[outcome] += 1
+
+    annotate(prefetch=outcome)
+    if entry is None:
+        return None
+    return {'embedding': entry['embedding'] if exact else None, 'candidates': entry['candidates'], 'exact': exact}
+
+
+def get_prefetch_stats() -> dict:
+    """Prefetch outcomes, reuse by /ask and cached drafts"""
+    with _lock:
+        stats = dict(_stats)
+        stats['cached_drafts'] = len(_entries)
+        stats['in_flight_now'] = len(_running_keys)
+    asked = stats['reused_exact'] + stats['reused_extension'] + stats['not_reused']
+    stats['reuse_rate'] = round((stats['reused_exact'] + stats['reused_extension']) / asked, 4) if asked else None
+    return stats
+
+
+def reset_prefetch_state():
+    """Drop cached drafts, pending prefetches and statistics"""
+    with _lock:
+        _entries.clear()
+        _pending.clear()
+        _running_keys.clear()
+        _last_accepted.clear()
+        for key in _stats:
+            _stats[key] = 0
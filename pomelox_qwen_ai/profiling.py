@@ -0,0 +1,431 @@
+"""
+Profiling Module
+Admin-gated on-demand profiling of live requests (cProfile dumped as
+pstats, or stack sampling dumped as flamegraph-compatible collapsed
+stacks) and a low-overhead always-on stack sampler
+
+A request is profiled when the next-N counter is armed through the admin
+endpoint, or when it carries `X-Profile: cprofile|sample` together with a
+valid `X-Admin-Token`. Upstream calls run in the scheduler's executor
+threads; they join the request's session through `profiled_thread()`.
+"""
+import contextvars
+import cProfile
+import hmac
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, jsonify, request
+from config import Config
+
+MODE_CPROFILE = 'cprofile'
+MODE_SAMPLE = 'sample'
+PROFILE_MODES = (MODE_CPROFILE, MODE_SAMPLE)
+
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+# Bucket for new stacks once the distinct-stack cap is reached
+_OVERFLOW_STACK = '[other stacks]'
+
+_current_session = contextvars.ContextVar('profile_session', default=None)
+
+
+def _frame_label(code, _cache={}) -> str:
+    label = _cache.get(code)
+    if label is None:
+        label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        _cache[code] = label
+    return label
+
+
+def collapse_stack(frame) -> str:
+    """Render a frame chain root-first, ';'-separated (collapsed-stack format)"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+
+def _count_stack(counter: Counter, stack: str, max_stacks: int):
+    if stack in counter or len(counter) < max_stacks:
+        counter[stack] += 1
+    else:
+        counter[_OVERFLOW_STACK] += 1
+
+
+def format_collapsed(counter: Counter) -> str:
+    """One 'frame;frame;frame count' line per stack, as read by flamegraph.pl / speedscope"""
+    return ''.join(f"{stack} {count}\n" for stack, count in counter.most_common())
+
+
+class ProfileSession:
+    """
+    Profile of one request across every thread that works on it
+
+    cProfile keeps one profiler per thread (merged into a single pstats file
+    at the end); sampling mode lets the shared sampler thread collect the
+    stacks of the threads registered with the session.
+    """
+
+    def __init__(self, mode: str, label: str):
+        self.mode = mode
+        self.label = label
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.started = time.perf_counter()
+        self.closed = False
+        self._lock = threading.Lock()
+        self._profiles = []
+        self._threads = set()
+        self.stacks = Counter()
+
+    def enter_thread(self):
+        """Start profiling the calling thread, returns a token for exit_thread()"""
+        if self.mode == MODE_CPROFILE:
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler already owns this interpreter (Python 3.12+)
+                return None
+            return profile
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads.add(ident)
+        sampler.wake()
+        return ident
+
+    def exit_thread(self, token):
+        if token is None:
+            return
+        if self.mode == MODE_CPROFILE:
+            token.disable()
+            with self._lock:
+                if not self.closed:
+                    self._profiles.append(token)
+        else:
+            with self._lock:
+                self._threads.discard(token)
+
+    def sampled_threads(self) -> set:
+        with self._lock:
+            return set(self._threads) if not self.closed else set()
+
+    def add_sample(self, stack: str):
+        with self._lock:
+            _count_stack(self.stacks, stack, Config.PROFILE_MAX_STACKS)
+
+    def finish(self) -> str:
+        """Close the session and write its dump, returns the file name"""
+        with self._lock:
+            self.closed = True
+            profiles = list(self._profiles)
+            self._threads.clear()
+
+        os.makedirs(Config.PROFILE_OUTPUT_DIR, exist_ok=True)
+        if self.mode == MODE_CPROFILE:
+            name = f"{self.id}.pstats"
+            if profiles:
+                stats = pstats.Stats(profiles[0])
+                for profile in profiles[1:]:
+                    stats.add(profile)
+                stats.dump_stats(os.path.join(Config.PROFILE_OUTPUT_DIR, name))
+            else:
+                name = None
+        else:
+            name = f"{self.id}.collapsed"
+            with open(os.path.join(Config.PROFILE_OUTPUT_DIR, name), 'w', encoding='utf-8') as f:
+                f.write(format_collapsed(self.stacks))
+
+        if name:
+            _prune_dumps()
+            dumps.append({
+                'name': name,
+                'mode': self.mode,
+                'label': self.label,
+                'seconds': round(time.perf_counter() - self.started, 3),
+            })
+            del dumps[:-Config.PROFILE_MAX_FILES]
+        return name
+
+
+# Recent dumps, newest last
+dumps = []
+
+
+def _prune_dumps():
+    """Keep only the newest PROFILE_MAX_FILES dump files on disk"""
+    try:
+        names = sorted(os.listdir(Config.PROFILE_OUTPUT_DIR))
+    except OSError:
+        return
+    for name in names[:-Config.PROFILE_MAX_FILES]:
+        try:
+            os.remove(os.path.join(Config.PROFILE_OUTPUT_DIR, name))
+        except OSError:
+            pass
+
+
+class StackSampler:
+    """
+    Single background thread that samples the stacks of busy threads
+
+    Only threads that are handling a request or running an upstream call
+    are sampled, so idle pool threads do not drown the profile. The thread
+    runs while the always-on sampler is enabled or a sampling session is
+    open, and parks otherwise.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.enabled = False
+        self.samples = Counter()
+        self.ticks = 0
+        self.tick_seconds = 0.0
+        self.sessions = set()
+        self._busy = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def mark_busy(self, ident: int):
+        with self._lock:
+            self._busy[ident] = self._busy.get(ident, 0) + 1
+
+    def mark_idle(self, ident: int):
+        with self._lock:
+            depth = self._busy.get(ident, 0) - 1
+            if depth > 0:
+                self._busy[ident] = depth
+            else:
+                self._busy.pop(ident, None)
+
+    def wake(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                    self._thread.start()
+        self._wakeup.set()
+
+    def set_enabled(self, enabled: bool):
+        self.enabled = enabled
+        if enabled:
+            self.wake()
+
+    def add_session(self, session: ProfileSession):
+        with self._lock:
+            self.sessions.add(session)
+
+    def remove_session(self, session: ProfileSession):
+        with self._lock:
+            self.sessions.discard(session)
+
+    def reset(self):
+        with self._lock:
+            self.samples = Counter()
+            self.ticks = 0
+            self.tick_seconds = 0.0
+
+    def _sample_sessions(self) -> list:
+        with self._lock:
+            return [s for s in self.sessions if s.mode == MODE_SAMPLE and not s.closed]
+
+    def _run(self):
+        while True:
+            sessions = self._sample_sessions()
+            if not self.enabled and not sessions:
+                self._wakeup.clear()
+                self._wakeup.wait()
+                continue
+
+            start = time.perf_counter()
+            frames = sys._current_frames()
+            with self._lock:
+                busy = list(self._busy)
+            stacks = {}
+            for ident in busy:
+                frame = frames.get(ident)
+                if frame is not None:
+                    stacks[ident] = collapse_stack(frame)
+
+            if self.enabled:
+                with self._lock:
+                    for stack in stacks.values():
+                        _count_stack(self.samples, stack, Config.PROFILE_MAX_STACKS)
+            for session in sessions:
+                for ident in session.sampled_threads():
+                    if ident in stacks:
+                        session.add_sample(stacks[ident])
+            del frames
+
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.ticks += 1
+                self.tick_seconds += elapsed
+            time.sleep(max(self.interval - elapsed, 0.0))
+
+    def collapsed(self) -> str:
+        with self._lock:
+            return format_collapsed(self.samples)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'interval_seconds': self.interval,
+                'ticks': self.ticks,
+                'distinct_stacks': len(self.samples),
+                'samples': sum(self.samples.values()),
+                'avg_tick_ms': round(self.tick_seconds / self.ticks * 1000, 3) if self.ticks else None,
+                # Share of one core spent sampling (GIL time taken from request threads)
+                'overhead_ratio': round(self.tick_seconds / (self.ticks * self.interval), 4) if self.ticks else None,
+            }
+
+
+sampler = StackSampler(Config.PROFILE_SAMPLE_INTERVAL)
+
+
+@contextmanager
+def profiled_thread():
+    """
+    Mark the calling thread busy for the sampler and, when the current
+    context belongs to a profiled request, profile it as part of that request
+    """
+    ident = threading.get_ident()
+    sampler.mark_busy(ident)
+    session = _current_session.get()
+    token = session.enter_thread() if session is not None and not session.closed else None
+    try:
+        yield
+    finally:
+        if session is not None:
+            session.exit_thread(token)
+        sampler.mark_idle(ident)
+
+
+class _Arming:
+    """Next-N-requests trigger set through the admin endpoint"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.remaining = 0
+        self.mode = MODE_CPROFILE
+        self.path_prefix = '/ask'
+
+    def arm(self, count: int, mode: str, path_prefix: str):
+        with self._lock:
+            self.remaining = count
+            self.mode = mode
+            self.path_prefix = path_prefix
+
+    def take(self, path: str):
+        """Consume one armed slot if the path matches, returns the mode or None"""
+        if self.remaining <= 0:
+            return None
+        with self._lock:
+            if self.remaining > 0 and path.startswith(self.path_prefix):
+                self.remaining -= 1
+                return self.mode
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'remaining': self.remaining, 'mode': self.mode, 'path_prefix': self.path_prefix}
+
+
+arming = _Arming()
+
+
+def is_admin_request() -> bool:
+    """Constant-time check of the admin token header (always False when no token is configured)"""
+    token = request.headers.get(ADMIN_TOKEN_HEADER, '')
+    return bool(Config.ADMIN_TOKEN) and hmac.compare_digest(token, Config.ADMIN_TOKEN)
+
+
+def admin_required(view):
+    """Reject the request unless it carries the configured admin token"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not Config.ADMIN_TOKEN:
+            return jsonify({'error': 'Admin endpoints are disabled (ADMIN_TOKEN not set)'}), 403
+        if not is_admin_request():
+            return jsonify({'error': 'Invalid admin token'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _requested_mode():
+    """Profiling mode for the current request, or None"""
+    if request.path.startswith('/admin/'):
+        return None
+    header_mode = request.headers.get(PROFILE_HEADER, '').lower()
+    if header_mode in PROFILE_MODES and is_admin_request():
+        return header_mode
+    return arming.take(request.path)
+
+
+def _before_request():
+    g.profile_ident = threading.get_ident()
+    sampler.mark_busy(g.profile_ident)
+    if sampler.enabled:
+        # Threads do not survive fork: restarts the sampler in pre-forked workers
+        sampler.wake()
+
+    mode = _requested_mode()
+    if mode is None:
+        return
+    session = ProfileSession(mode, f"{request.method} {request.path}")
+    sampler.add_session(session)
+    g.profile_session = session
+    g.profile_context_token = _current_session.set(session)
+    g.profile_thread_token = session.enter_thread()
+
+
+def _finish_session():
+    session = g.pop('profile_session', None)
+    if session is None:
+        return None
+    session.exit_thread(g.pop('profile_thread_token', None))
+    _current_session.reset(g.pop('profile_context_token'))
+    sampler.remove_session(session)
+    return session.finish()
+
+
+def _after_request(response):
+    name = _finish_session()
+    if name:
+        response.headers[PROFILE_ID_HEADER] = name
+    return response
+
+
+def _teardown_request(exc):
+    # Requests that failed before after_request still close their session
+    _finish_session()
+    ident = g.pop('profile_ident', None)
+    if ident is not None:
+        sampler.mark_idle(ident)
+
+
+def init_app(app):
+    """Register the per-request profiling hooks on a Flask app"""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    # The sampler thread itself starts with the first request
+    sampler.enabled = Config.PROFILE_SAMPLER_ENABLED
+
+
+def get_profiling_stats() -> dict:
+    """Armed trigger, sampler counters and recent dumps"""
+    return {'armed': arming.stats(), 'sampler': sampler.stats(), 'dumps': list(dumps)}
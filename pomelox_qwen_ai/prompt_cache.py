@@ -0,0 +1,134 @@
+"""
+Prompt Cache Module
+A/B assignment of the system prompt layout and tracking of the provider's
+context-cache usage reported with each generation
+
+The cache-friendly layout starts every prompt of a school with the same
+instructions, so DashScope can reuse the prefill of that prefix across
+requests; the legacy layout embeds the references inside the instructions.
+Token usage (including cached prompt tokens) and generation latency are
+aggregated per layout to compare the two.
+"""
+import threading
+import zlib
+from collections import deque
+
+from config import Config
+from event_log import annotate
+from rag_service import PROMPT_LAYOUT_CACHE_FRIENDLY, PROMPT_LAYOUT_LEGACY
+
+PROMPT_LAYOUTS = (PROMPT_LAYOUT_CACHE_FRIENDLY, PROMPT_LAYOUT_LEGACY)
+# DashScope only caches prompt prefixes of at least this many tokens
+PROVIDER_CACHE_MIN_TOKENS = 256
+# PROMPT_LAYOUT value that splits sessions between the two layouts
+PROMPT_LAYOUT_AB = 'ab'
+
+# Recent generation latencies kept per layout for percentiles
+_LATENCY_WINDOW = 1000
+
+_stats_lock = threading.Lock()
+
+
+def _empty_stats() -> dict:
+    return {
+        'requests': 0,
+        'cache_hit_requests': 0,
+        'input_tokens': 0,
+        'cached_tokens': 0,
+        'output_tokens': 0,
+        'latencies_ms': deque(maxlen=_LATENCY_WINDOW),
+    }
+
+
+_stats = {layout: _empty_stats() for layout in PROMPT_LAYOUTS}
+
+
+def choose_layout(session_id: str) -> str:
+    """
+    Prompt layout for a request
+
+    In A/B mode the layout is derived from the session ID, so every turn of a
+    conversation uses the same layout (and can hit the cache of earlier turns).
+
+    Args:
+        session_id: Chat session ID
+
+    Returns:
+        str: PROMPT_LAYOUT_CACHE_FRIENDLY or PROMPT_LAYOUT_LEGACY
+    """
+    if Config.PROMPT_LAYOUT in PROMPT_LAYOUTS:
+        return Config.PROMPT_LAYOUT
+    if Config.PROMPT_LAYOUT == PROMPT_LAYOUT_AB:
+        bucket = zlib.crc32(session_id.encode('utf-8')) % 1000
+        return PROMPT_LAYOUT_CACHE_FRIENDLY if bucket < Config.PROMPT_AB_SPLIT * 1000 else PROMPT_LAYOUT_LEGACY
+    return PROMPT_LAYOUT_CACHE_FRIENDLY
+
+
+def cached_tokens(usage) -> int:
+    """Prompt tokens served from the provider's context cache, 0 when not reported"""
+    if not usage:
+        return 0
+    details = usage.get('prompt_tokens_details') or {}
+    return int(details.get('cached_tokens') or 0)
+
+
+def record_usage(layout: str, usage, seconds: float):
+    """
+    Record the token usage and latency of one generation
+
+    Args:
+        layout: Prompt layout the request used
+        usage: `usage` of the DashScope response (dict-like, may be None)
+        seconds: Wall time of the generation call
+    """
+    input_tokens = int(usage.get('input_tokens') or 0) if usage else 0
+    output_tokens = int(usage.get('output_tokens') or 0) if usage else 0
+    cached = cached_tokens(usage)
+    latency_ms = seconds * 1000
+
+    with _stats_lock:
+        stats = _stats[layout]
+        stats['requests'] += 1
+        stats['cache_hit_requests'] += 1 if cached else 0
+        stats['input_tokens'] += input_tokens
+        stats['cached_tokens'] += cached
+        stats['output_tokens'] += output_tokens
+        stats['latencies_ms'].append(latency_ms)
+
+    annotate(prompt_layout=layout, input_tokens=input_tokens, cached_tokens=cached, output_tokens=output_tokens)
+
+
+def _percentile(values: list, fraction: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 1)
+
+
+def get_prompt_cache_stats() -> dict:
+    """Per-layout cache hit rates, token counts and generation latency"""
+    with _stats_lock:
+        snapshot = {layout: dict(stats, latencies_ms=list(stats['latencies_ms'])) for layout, stats in _stats.items()}
+
+    layouts = {}
+    for layout, stats in snapshot.items():
+        latencies = stats.pop('latencies_ms')
+        input_tokens = stats['input_tokens']
+        # Cached prompt tokens are billed at a fraction of the input price
+        billed = input_tokens - stats['cached_tokens'] * (1 - Config.PROMPT_CACHED_TOKEN_PRICE_RATIO)
+        layouts[layout] = {
+            **stats,
+            'cache_hit_rate': round(stats['cache_hit_requests'] / stats['requests'], 4) if stats['requests'] else None,
+            'cached_token_ratio': round(stats['cached_tokens'] / input_tokens, 4) if input_tokens else None,
+            'billed_input_token_ratio': round(billed / input_tokens, 4) if input_tokens else None,
+            'generate_p50_ms': _percentile(latencies, 0.5),
+            'generate_p95_ms': _percentile(latencies, 0.95),
+        }
+    return {'layout': Config.PROMPT_LAYOUT, 'ab_split': Config.PROMPT_AB_SPLIT, 'layouts': layouts}
+
+
+def reset_prompt_cache_stats():
+    """Clear the collected statistics (e.g. when starting a new A/B run)"""
+    with _stats_lock:
+        for layout in PROMPT_LAYOUTS:
+            _stats[layout] = _empty_stats()
@@ -0,0 +1,275 @@
+"""
+Quantized Vector Store Module
+First-pass similarity search over int8 (scalar-quantized) or float16
+embeddings, with exact re-scoring of the top candidates against the
+full-precision vectors, which stay memory-mapped on disk
+
+Files written next to the vector store:
+    vectors.ids.json      - node IDs in row order
+    vectors.f32.npy       - L2-normalized float32 vectors (memory-mapped, used for re-scoring)
+    vectors.int8.npy      - per-row symmetric int8 codes
+    vectors.int8_scale.npy - per-row dequantization scale
+    vectors.f16.npy       - float16 copy of the normalized vectors
+"""
+import json
+import os
+from typing import Any, List, Optional
+
+import numpy as np
+from llama_index.core.bridge.pydantic import PrivateAttr
+from llama_index.core.schema import BaseNode
+from llama_index.core.vector_stores.types import (
+    BasePydanticVectorStore,
+    VectorStoreQuery,
+    VectorStoreQueryResult,
+)
+from compact_docstore import ReadOnlyStoreError
+from config import Config
+
+IDS_FILE = 'vectors.ids.json'
+FULL_FILE = 'vectors.f32.npy'
+INT8_FILE = 'vectors.int8.npy'
+INT8_SCALE_FILE = 'vectors.int8_scale.npy'
+FLOAT16_FILE = 'vectors.f16.npy'
+LEGACY_VECTOR_FILE = 'default__vector_store.json'
+QUANTIZED_FILES = (IDS_FILE, FULL_FILE, INT8_FILE, INT8_SCALE_FILE, FLOAT16_FILE)
+
+QUANTIZATION_MODES = ('int8', 'float16')
+
+# Rows dequantized per matmul block, bounds the temporary float32 buffer
+_BLOCK_ROWS = 4096
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def quantize_store(store_dir: str) -> dict:
+    """
+    Write full-precision, int8 and float16 vector files from the
+    persisted llama-index vector store
+
+    Args:
+        store_dir: Vector store directory of one school
+
+    Returns:
+        dict: Byte sizes of the first-pass representations
+    """
+    with open(os.path.join(store_dir, LEGACY_VECTOR_FILE), 'r', encoding='utf-8') as f:
+        embedding_dict = json.load(f)['embedding_dict']
+
+    ids = list(embedding_dict.keys())
+    full = _normalize(np.asarray([embedding_dict[i] for i in ids], dtype=np.float32))
+
+    scales = np.abs(full).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.round(full / scales[:, None]).astype(np.int8)
+
+    with open(os.path.join(store_dir, IDS_FILE), 'w', encoding='utf-8') as f:
+        json.dump(ids, f)
+    np.save(os.path.join(store_dir, FULL_FILE), full)
+    np.save(os.path.join(store_dir, INT8_FILE), codes)
+    np.save(os.path.join(store_dir, INT8_SCALE_FILE), scales.astype(np.float32))
+    np.save(os.path.join(store_dir, FLOAT16_FILE), full.astype(np.float16))
+
+    return {
+        'vectors': len(ids),
+        'float32_bytes': full.nbytes,
+        'int8_bytes': codes.nbytes + scales.astype(np.float32).nbytes,
+        'float16_bytes': full.astype(np.float16).nbytes,
+    }
+
+
+class QuantizedVectorStore(BasePydanticVectorStore):
+    """
+    Read-only vector store: approximate first pass on quantized vectors,
+    exact cosine re-scoring of the best candidates
+    """
+
+    stores_text: bool = False
+    mode: str = 'int8'
+    rescore_factor: int = 4
+
+    _ids: List[str] = PrivateAttr()
+    _codes: np.ndarray = PrivateAttr()
+    _scales: Optional[np.ndarray] = PrivateAttr()
+    _full: np.ndarray = PrivateAttr()
+
+    def __init__(self, store_dir: str, mode: str = 'int8', rescore_factor: int = 4, **kwargs: Any):
+        if mode not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization mode: {mode}")
+        super().__init__(mode=mode, rescore_factor=rescore_factor, **kwargs)
+
+        with open(os.path.join(store_dir, IDS_FILE), 'r', encoding='utf-8') as f:
+            self._ids = json.load(f)
+        if mode == 'int8':
+            self._codes = np.load(os.path.join(store_dir, INT8_FILE))
+            self._scales = np.load(os.path.join(store_dir, INT8_SCALE_FILE))
+        else:
+            self._codes = np.load(os.path.join(store_dir, FLOAT16_FILE))
+            self._scales = None
+        # Full precision stays on disk; only re-scored rows are paged in
+        self._full = np.load(os.path.join(store_dir, FULL_FILE), mmap_mode='r')
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "QuantizedVectorStore"
+
+    @property
+    def client(self) -> Any:
+        return None
+
+    @property
+    def resident_bytes(self) -> int:
+        """Bytes held in memory for the first pass"""
+        return self._codes.nbytes + (self._scales.nbytes if self._scales is not None else 0)
+
+    def first_pass_scores(self, query: np.ndarray) -> np.ndarray:
+        """Approximate cosine similarity of every row to a normalized query"""
+        scores = np.empty(len(self._ids), dtype=np.float32)
+        for start in range(0, len(self._ids), _BLOCK_ROWS):
+            block = self._codes[start:start + _BLOCK_ROWS].astype(np.float32) @ query
+            if self._scales is not None:
+                block *= self._scales[start:start + _BLOCK_ROWS]
+            scores[start:start + _BLOCK_ROWS] = block
+        return scores
+
+    def search(self, query: np.ndarray, top_k: int, candidate_mask: np.ndarray = None) -> tuple:
+        """
+        Two-stage search
+
+        Args:
+            query: Normalized float32 query vector
+            top_k: Number of results
+            candidate_mask: Optional boolean mask of rows allowed in the result
+
+        Returns:
+            tuple: (row indices, exact cosine scores), best first
+        """
+        approx = self.first_pass_scores(query)
+        if candidate_mask is not None:
+            approx = np.where(candidate_mask, approx, -np.inf)
+            available = int(candidate_mask.sum())
+        else:
+            available = len(approx)
+
+        top_k = min(top_k, available)
+        if top_k <= 0:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+
+        candidate_count = min(available, top_k * self.rescore_factor)
+        # Sorted row order keeps the memory-mapped reads sequential
+        candidates = np.sort(np.argpartition(-approx, candidate_count - 1)[:candidate_count])
+        exact = np.asarray(self._full[candidates], dtype=np.float32) @ query
+        order = np.argsort(-exact)[:top_k]
+        return candidates[order], exact[order]
+
+    def query(self, query: VectorStoreQuery, **kwargs: Any) -> VectorStoreQueryResult:
+        if query.filters is not None:
+            raise ValueError("Metadata filters are not supported by the quantized vector store")
+
+        vector = np.asarray(query.query_embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector = vector / norm
+
+        mask = None
+        if query.node_ids is not None:
+            allowed = set(query.node_ids)
+            mask = np.fromiter((node_id in allowed for node_id in self._ids), dtype=bool, count=len(self._ids))
+
+        rows, scores = self.search(vector, query.similarity_top_k, mask)
+        return VectorStoreQueryResult(
+            similarities=scores.tolist(),
+            ids=[self._ids[row] for row in rows],
+        )
+
+    def add(self, nodes: List[BaseNode], **add_kwargs: Any) -> List[str]:
+        raise ReadOnlyStoreError('Quantized vector store is read-only; rebuild the knowledge base to change it')
+
+    def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+        raise ReadOnlyStoreError('Quantized vector store is read-only; rebuild the knowledge base to change it')
+
+
+def has_quantized_store(store_dir: str) -> bool:
+    """Check whether a vector store directory holds quantized vector files"""
+    return all(os.path.exists(os.path.join(store_dir, name)) for name in QUANTIZED_FILES)
+
+
+def remove_quantized_store(store_dir: str):
+    """Delete the quantized vector files (called before an index is rebuilt)"""
+    for name in QUANTIZED_FILES:
+        path = os.path.join(store_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def load_quantized_vector_store(store_dir: str, mode: str = None) -> Optional[QuantizedVectorStore]:
+    """
+    Open the quantized vector store of a school
+
+    Args:
+        store_dir: Vector store directory of one school
+        mode: 'int8' or 'float16' (defaults to config value)
+
+    Returns:
+        QuantizedVectorStore or None (if the quantized files are missing)
+    """
+    if not has_quantized_store(store_dir):
+        return None
+    return QuantizedVectorStore(
+        store_dir,
+        mode=mode or Config.RAG_VECTOR_QUANTIZATION,
+        rescore_factor=Config.RAG_QUANTIZED_RESCORE_FACTOR,
+    )
+
+
+def check_recall(store_dir: str, mode: str, k: int = 20, num_queries: int = 200, seed: int = 0) -> dict:
+    """
+    Measure recall@k of the quantized search against exact search
+
+    Queries are synthesized from the store itself (normalized sums of two
+    random chunk vectors plus noise), so the check runs offline.
+
+    Args:
+        store_dir: Vector store directory of one school
+        mode: 'int8' or 'float16'
+        k: Result depth compared
+        num_queries: Number of synthetic queries
+        seed: Random seed
+
+    Returns:
+        dict: recall of the first pass alone and after re-scoring, plus memory sizes
+    """
+    store = QuantizedVectorStore(store_dir, mode=mode, rescore_factor=Config.RAG_QUANTIZED_RESCORE_FACTOR)
+    full = np.asarray(store._full, dtype=np.float32)
+    n = len(full)
+    k = min(k, n)
+
+    rng = np.random.default_rng(seed)
+    pairs = rng.integers(0, n, size=(num_queries, 2))
+    queries = full[pairs[:, 0]] + full[pairs[:, 1]]
+    queries += rng.normal(scale=0.5 / np.sqrt(full.shape[1]), size=queries.shape).astype(np.float32)
+    queries = _normalize(queries.astype(np.float32))
+
+    first_pass_hits = 0
+    rescored_hits = 0
+    for query in queries:
+        exact_top = set(np.argsort(-(full @ query))[:k].tolist())
+        approx_top = set(np.argsort(-store.first_pass_scores(query))[:k].tolist())
+        rescored_top = set(store.search(query, k)[0].tolist())
+        first_pass_hits += len(exact_top & approx_top)
+        rescored_hits += len(exact_top & rescored_top)
+
+    total = k * len(queries)
+    return {
+        'mode': mode,
+        'vectors': n,
+        'k': k,
+        'recall_first_pass': round(first_pass_hits / total, 4),
+        'recall_rescored': round(rescored_hits / total, 4),
+        'float32_bytes': full.nbytes,
+        'resident_bytes': store.resident_bytes,
+    }
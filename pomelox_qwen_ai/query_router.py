@@ -0,0 +1,273 @@
+"""
+Query Router Module
+Lightweight local classifier that decides, before any retrieval happens,
+whether a question needs the school knowledge base at all
+"""
+import math
+import re
+import threading
+import time
+import zlib
+from functools import lru_cache
+from config import Config
+from event_log import annotate
+
+# Route names
+ROUTE_DIRECT = 'direct'          # Small talk / general questions: generate without retrieval
+ROUTE_RAG = 'rag'                # School-specific questions: retrieve from knowledge base
+ROUTE_WEB_SEARCH = 'web_search'  # Time-sensitive questions: go straight to web search
+
+# Whole-message small talk (greetings, thanks, goodbyes)
+SMALL_TALK_PATTERN = re.compile(
+    r"^\s*(hi+|hello+|hey+|yo|hiya|howdy|good\s+(morning|afternoon|evening|night)|"
+    r"thanks?(\s+you)?(\s+(so|very)\s+much)?|thank\s+you(\s+(so|very)\s+much)?|thx|ty|"
+    r"ok(ay)?|cool|great|nice|got\s+it|bye+|goodbye|see\s+you|"
+    r"how\s+are\s+you|who\s+are\s+you|what\s+can\s+you\s+do|"
+    r"你好|您好|嗨|谢谢|多谢|好的|再见)"
+    r"[\s!.?~,，。！？]*$",
+    re.IGNORECASE,
+)
+
+# Signals that the answer depends on what is happening right now. Words that
+# are just as common in school questions ("latest date to drop", "TOEFL score",
+# "news channel", "currently enrolled") are left out: such questions go through
+# RAG, and web search remains the fallback when the knowledge base has no answer
+TIME_SENSITIVE_PATTERN = re.compile(
+    r"\b(today|tonight|tomorrow|yesterday|right\s+now|at\s+the\s+moment|"
+    r"this\s+(week|weekend)|breaking|weather|forecast|"
+    r"stock\s+(price|market)|exchange\s+rate)\b|今天|明天|天气|汇率",
+    re.IGNORECASE,
+)
+
+# Topics that only the school knowledge base can answer well
+SCHOOL_TOPIC_PATTERN = re.compile(
+    r"\b(school|campus|universit(y|ies)|college|admissions?|admitted|apply|application|"
+    r"deadline|enroll(ment)?|registration|register|orientation|housing|dorms?|"
+    r"residence|tuition|fees?|scholarships?|financial\s+aid|courses?|class(es)?|major|"
+    r"semester|quarter|credits?|units?|grades?|prerequisites?|waitlist|drop|exams?|midterms?|finals?|"
+    r"toefl|ielts|duolingo|sat|gre|gmat|test\s+scores?|"
+    r"professor|faculty|library|students?|visa|i-20|opt|cpt|transit|shuttle|bus|"
+    r"parking|meal\s+plan|dining|health\s+insurance|ship|clubs?|sir|gpa|transcript)\b|"
+    r"学校|校园|申请|录取|宿舍|学费|选课|课程|签证|新生|住宿|专业|托福|雅思|考试|成绩",
+    re.IGNORECASE,
+)
+
+# Seed examples for the embedding-centroid fallback classifier
+SEED_EXAMPLES = {
+    ROUTE_DIRECT: [
+        "hi there",
+        "hello, nice to meet you",
+        "thank you so much for the help",
+        "what is the capital of France",
+        "how do I write a for loop in python",
+        "tell me a joke",
+        "translate this sentence into English",
+        "what is machine learning",
+        "how many minutes are in a day",
+        "can you help me improve my essay grammar",
+    ],
+    ROUTE_RAG: [
+        "when is the housing application deadline",
+        "how do I register for classes",
+        "where is the international student office",
+        "what documents do I need for orientation",
+        "how do I get an I-20",
+        "how much is tuition for international students",
+        "which bus goes to campus",
+        "how do I waive the student health insurance",
+        "how do I submit my SIR",
+        "what meal plans are available in the dorms",
+    ],
+    ROUTE_WEB_SEARCH: [
+        "what is the weather today",
+        "latest news about the election",
+        "what happened in the world this week",
+        "current exchange rate between dollar and yuan",
+        "who won the game last night",
+        "stock price of apple right now",
+        "is there a storm forecast for tomorrow",
+        "breaking news today",
+    ],
+}
+
+# Dimension of the hashed character n-gram feature space
+_FEATURE_DIM = 512
+
+# Function words carry no routing signal and would dominate short questions
+_STOPWORDS = frozenset(
+    "a an the is are was were be to of in on at for and or but do does did i me my you your "
+    "we our it this that what which who whom how when where why can could would should will "
+    "please there with about from into by as if so".split()
+)
+
+# Routing statistics
+_stats_lock = threading.Lock()
+_stats = {
+    'decisions': {ROUTE_DIRECT: 0, ROUTE_RAG: 0, ROUTE_WEB_SEARCH: 0},
+    'by_reason': {},
+    'retrieval_skipped': 0,
+    'estimated_latency_saved_ms': 0.0,
+    'retrieval_latency_ewma_ms': None,
+}
+
+
+def _featurize(text: str) -> list:
+    """
+    Map text into a normalized hashed character trigram vector
+
+    Args:
+        text: Input text
+
+    Returns:
+        list: L2-normalized feature vector of length _FEATURE_DIM
+    """
+    vector = [0.0] * _FEATURE_DIM
+    for word in re.findall(r"\w+", text.lower()):
+        if word in _STOPWORDS:
+            continue
+        padded = f"#{word}#"
+        grams = [padded[i:i + 3] for i in range(max(len(padded) - 2, 1))]
+        for gram in grams:
+            vector[zlib.crc32(gram.encode('utf-8')) % _FEATURE_DIM] += 1.0
+
+    norm = math.sqrt(sum(v * v for v in vector))
+    if norm == 0:
+        return vector
+    return [v / norm for v in vector]
+
+
+@lru_cache(maxsize=1)
+def _centroids() -> dict:
+    """Build (once) the normalized centroid vector for each route"""
+    centroids = {}
+    for route, examples in SEED_EXAMPLES.items():
+        total = [0.0] * _FEATURE_DIM
+        for example in examples:
+            for i, v in enumerate(_featurize(example)):
+                total[i] += v
+        norm = math.sqrt(sum(v * v for v in total)) or 1.0
+        centroids[route] = [v / norm for v in total]
+    return centroids
+
+
+def _school_terms(school_id: str) -> list:
+    """Lower-cased names a question may use to refer to the given school"""
+    school_info = Config.SCHOOLS.get(school_id, {})
+    terms = {school_id.lower()}
+    for key in ('name', 'name_cn'):
+        if school_info.get(key):
+            terms.add(school_info[key].lower())
+    return [term for term in terms if term]
+
+
+def classify(question: str, school_id: str) -> tuple:
+    """
+    Classify a question into a route
+
+    Args:
+        question: User question
+        school_id: School ID the question is asked against
+
+    Returns:
+        tuple: (route, reason) - chosen route and the rule that decided it
+    """
+    text = question.strip()
+    lowered = text.lower()
+
+    if SMALL_TALK_PATTERN.match(text):
+        return ROUTE_DIRECT, 'small_talk'
+
+    mentions_school = (
+        any(term in lowered for term in _school_terms(school_id))
+        or SCHOOL_TOPIC_PATTERN.search(text) is not None
+    )
+    if mentions_school:
+        return ROUTE_RAG, 'school_topic'
+
+    if TIME_SENSITIVE_PATTERN.search(text):
+        return ROUTE_WEB_SEARCH, 'time_sensitive'
+
+    # No rule fired: compare against the seed centroids. Web search is only
+    # ever chosen by the explicit time-sensitive rule above.
+    features = _featurize(text)
+    scores = {
+        route: sum(a * b for a, b in zip(features, centroid))
+        for route, centroid in _centroids().items()
+    }
+    margin = scores[ROUTE_DIRECT] - max(scores[ROUTE_RAG], scores[ROUTE_WEB_SEARCH])
+
+    # Only leave the (safe) RAG path when the centroid model is clearly confident
+    if scores[ROUTE_DIRECT] >= Config.QUERY_ROUTER_MIN_SIMILARITY \
+            and margin >= Config.QUERY_ROUTER_MIN_MARGIN:
+        return ROUTE_DIRECT, 'centroid'
+    return ROUTE_RAG, 'default'
+
+
+def route_query(question: str, school_id: str) -> str:
+    """
+    Decide how a question should be answered and record the decision
+
+    Args:
+        question: User question
+        school_id: School ID
+
+    Returns:
+        str: One of ROUTE_DIRECT, ROUTE_RAG, ROUTE_WEB_SEARCH
+    """
+    if not Config.QUERY_ROUTER_ENABLED:
+        return ROUTE_RAG
+
+    start = time.perf_counter()
+    route, reason = classify(question, school_id)
+
+    # Web search route is only meaningful when the fallback is allowed
+    if route == ROUTE_WEB_SEARCH and not Config.ENABLE_WEB_SEARCH_FALLBACK:
+        route, reason = ROUTE_RAG, 'web_search_disabled'
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    with _stats_lock:
+        _stats['decisions'][route] += 1
+        _stats['by_reason'][reason] = _stats['by_reason'].get(reason, 0) + 1
+        saved_ms = 0.0
+        if route != ROUTE_RAG:
+            _stats['retrieval_skipped'] += 1
+            saved_ms = _stats['retrieval_latency_ewma_ms'] or 0.0
+            _stats['estimated_latency_saved_ms'] += saved_ms
+
+    annotate(route=route, route_reason=reason, route_classify_ms=round(elapsed_ms, 3),
+             route_saved_ms=round(saved_ms, 1))
+    return route
+
+
+def record_retrieval_latency(seconds: float):
+    """
+    Feed an observed retrieval latency into the running estimate used to
+    compute how much time a skipped retrieval saved
+
+    Args:
+        seconds: Wall time spent in retrieve()
+    """
+    latency_ms = seconds * 1000
+    with _stats_lock:
+        current = _stats['retrieval_latency_ewma_ms']
+        if current is None:
+            _stats['retrieval_latency_ewma_ms'] = latency_ms
+        else:
+            _stats['retrieval_latency_ewma_ms'] = 0.8 * current + 0.2 * latency_ms
+
+
+def get_router_stats() -> dict:
+    """Get a snapshot of routing decisions and estimated latency savings"""
+    with _stats_lock:
+        snapshot = {
+            'decisions': dict(_stats['decisions']),
+            'by_reason': dict(_stats['by_reason']),
+            'retrieval_skipped': _stats['retrieval_skipped'],
+            'estimated_latency_saved_ms': round(_stats['estimated_latency_saved_ms'], 1),
+            'retrieval_latency_ewma_ms': (
+                round(_stats['retrieval_latency_ewma_ms'], 1)
+                if _stats['retrieval_latency_ewma_ms'] is not None else None
+            ),
+        }
+    return snapshot
@@ -3,29 +3,262 @@ RAG Service Module
 Provides Retrieval-Augmented Generation functionality based on school knowledge base
 """
 import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
 from config import Config
-from llama_index.core import StorageContext, load_index_from_storage, Settings
-from llama_index.embeddings.dashscope import (
-    DashScopeEmbedding,
-    DashScopeTextEmbeddingModels,
-    DashScopeTextEmbeddingType,
-)
-from llama_index.postprocessor.dashscope_rerank import DashScopeRerank
+from http_transport import load_dashscope
+from event_log import log_event, annotate, stage
+from upstream import scheduler, UpstreamSaturated, UpstreamTimeout, PRIORITY_INTERACTIVE
+
+# Heavy llama-index / DashScope dependencies are imported on first use (or
+# by warmup()), so processes that never retrieve do not pay for them
+_deps = None
+_deps_lock = threading.Lock()
+
+# Loaded indexes, least recently used first; evicted beyond RAG_INDEX_CACHE_MAX_MB
+_index_cache = OrderedDict()
+_index_sizes = {}           # school_id -> estimated bytes
+_index_last_used = {}       # school_id -> time.time() of the last lookup
+_index_cache_lock = threading.Lock()
+_index_cache_stats = {'hits': 0, 'loads': 0, 'reloads': 0, 'evictions': 0}
+_evicted_schools = set()    # Schools evicted at least once (a later load counts as a reload)
+
+# Approximate CPython object sizes used by estimate_index_bytes()
+_BOXED_FLOAT_BYTES = 24 + 8     # float object + list slot
+_LIST_BYTES = 56
+_DICT_ENTRY_BYTES = 100         # key/value slots plus a short key string
+
+
+def _load_dependencies():
+    """
+    Import llama-index and configure the embedding model (once)
+
+    Returns:
+        SimpleNamespace: StorageContext, load_index_from_storage, QueryBundle, DashScopeRerank,
+            load_compact_docstore, load_quantized_vector_store, embed_model
+    """
+    global _deps
+    if _deps is not None:
+        return _deps
+
+    with _deps_lock:
+        if _deps is None:
+            load_dashscope()
+            from llama_index.core import StorageContext, load_index_from_storage, Settings
+            from llama_index.core.schema import QueryBundle
+            from llama_index.embeddings.dashscope import (
+                DashScopeEmbedding,
+                DashScopeTextEmbeddingModels,
+                DashScopeTextEmbeddingType,
+            )
+            from llama_index.postprocessor.dashscope_rerank import DashScopeRerank
+            from compact_docstore import load_compact_docstore
+            from quantized_vectors import load_quantized_vector_store
+
+            # Configure embedding model
+            embed_model = DashScopeEmbedding(
+                model_name=DashScopeTextEmbeddingModels.TEXT_EMBEDDING_V2,
+                text_type=DashScopeTextEmbeddingType.TEXT_TYPE_DOCUMENT,
+            )
+            Settings.embed_model = embed_model
+
+            _deps = SimpleNamespace(
+                StorageContext=StorageContext,
+                load_index_from_storage=load_index_from_storage,
+                QueryBundle=QueryBundle,
+                DashScopeRerank=DashScopeRerank,
+                load_compact_docstore=load_compact_docstore,
+                load_quantized_vector_store=load_quantized_vector_store,
+                embed_model=embed_model,
+            )
+    return _deps
+
+
+def get_embed_model():
+    """Get the shared DashScope embedding model (imports dependencies on first use)"""
+    return _load_dependencies().embed_model
+
+
+def embed_query(query: str, priority: int = PRIORITY_INTERACTIVE) -> list:
+    """
+    Embed a question through the upstream scheduler
+
+    Args:
+        query: Question text
+        priority: Upstream priority (PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND)
+
+    Returns:
+        list: Query embedding
+    """
+    return scheduler.call(get_embed_model().get_query_embedding, query,
+                          priority=priority, timeout=Config.UPSTREAM_RETRIEVE_TIMEOUT)
+
+
+def set_retrieval_clients(embed_model=None, rerank_factory=None):
+    """
+    Replace the query embedding model and/or reranker used by retrieve(),
+    e.g. with cached clients for offline evaluation
+
+    Args:
+        embed_model: llama-index embedding model for queries
+        rerank_factory: Callable taking (top_n, return_documents) that returns a node postprocessor
+    """
+    deps = _load_dependencies()
+    if embed_model is not None:
+        from llama_index.core import Settings
+        deps.embed_model = embed_model
+        Settings.embed_model = embed_model
+        with _index_cache_lock:
+            indexes = list(_index_cache.values())
+        for index in indexes:
+            index._embed_model = embed_model
+    if rerank_factory is not None:
+        deps.DashScopeRerank = rerank_factory
+
+
+def warmup(school_ids: list = None) -> list:
+    """
+    Import RAG dependencies and preload school indexes ahead of the first request
+
+    Args:
+        school_ids: Schools to preload (defaults to the pinned schools, then every configured school)
+
+    Returns:
+        list: School IDs whose index was loaded (and is still cached)
+    """
+    _load_dependencies()
+    if school_ids is None:
+        school_ids = list(dict.fromkeys([*Config.RAG_INDEX_CACHE_PINNED, *Config.SCHOOLS.keys()]))
+    loaded = []
+    for school_id in school_ids:
+        if os.path.exists(os.path.join(Config.VECTOR_STORE_PATH, school_id)) and load_index(school_id) is not None:
+            loaded.append(school_id)
+    # Loading past the memory budget evicts earlier non-pinned schools
+    with _index_cache_lock:
+        return [school_id for school_id in loaded if school_id in _index_cache]
+
+
+def _deep_sizeof(obj, seen: set = None) -> int:
+    """Approximate size of a JSON-like structure (dicts, lists, strings, numbers)"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_sizeof(k, seen) + _deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(_deep_sizeof(item, seen) for item in obj)
+    return size
+
+
+def estimate_index_bytes(index) -> int:
+    """
+    Approximate memory held by a loaded index
+
+    Counts the first-pass vectors (JSON-loaded embeddings are lists of boxed
+    floats), the docstore's in-memory tables and the index struct. Memory-mapped
+    files (compact chunk text, full-precision vectors) live in the page cache
+    and are not counted.
 
-# Configure embedding model
-EMBED_MODEL = DashScopeEmbedding(
-    model_name=DashScopeTextEmbeddingModels.TEXT_EMBEDDING_V2,
-    text_type=DashScopeTextEmbeddingType.TEXT_TYPE_DOCUMENT,
-)
-Settings.embed_model = EMBED_MODEL
+    Args:
+        index: VectorStoreIndex returned by load_index()
 
-# Index cache to avoid repeated loading
-_index_cache = {}
+    Returns:
+        int: Estimated bytes
+    """
+    total = 0
+    vector_store = index.vector_store
+    if hasattr(vector_store, 'resident_bytes'):
+        total += vector_store.resident_bytes + _DICT_ENTRY_BYTES * len(vector_store._ids)
+    elif hasattr(vector_store, 'data'):
+        data = vector_store.data
+        total += sum(_LIST_BYTES + _BOXED_FLOAT_BYTES * len(vector) for vector in data.embedding_dict.values())
+        total += _DICT_ENTRY_BYTES * len(data.embedding_dict)
+        total += _deep_sizeof(data.text_id_to_ref_doc_id) + _deep_sizeof(data.metadata_dict)
+
+    # Container attributes of the kvstore: the compact node table or the whole legacy docstore
+    kvstore = getattr(index.docstore, '_kvstore', None)
+    for value in vars(kvstore).values() if kvstore is not None else ():
+        if isinstance(value, (dict, list)):
+            total += _deep_sizeof(value)
+
+    total += _DICT_ENTRY_BYTES * len(index.index_struct.nodes_dict)
+    return total
+
+
+def _cache_index(school_id: str, index, size: int):
+    """Insert a loaded index as most recently used and evict LRU schools over the budget"""
+    budget = Config.RAG_INDEX_CACHE_MAX_MB * 1024 * 1024
+    evicted = []
+    with _index_cache_lock:
+        _index_cache[school_id] = index
+        _index_cache.move_to_end(school_id)
+        _index_sizes[school_id] = size
+        _index_last_used[school_id] = time.time()
+        _index_cache_stats['loads'] += 1
+        if school_id in _evicted_schools:
+            _index_cache_stats['reloads'] += 1
+
+        used = sum(_index_sizes.values())
+        if budget > 0:
+            for victim in list(_index_cache):
+                if used <= budget:
+                    break
+                if victim == school_id or victim in Config.RAG_INDEX_CACHE_PINNED:
+                    continue
+                del _index_cache[victim]
+                _index_last_used.pop(victim, None)
+                victim_size = _index_sizes.pop(victim)
+                used -= victim_size
+                _evicted_schools.add(victim)
+                _index_cache_stats['evictions'] += 1
+                evicted.append((victim, victim_size))
+
+    for victim, victim_size in evicted:
+        log_event('index_evicted', school_id=victim, bytes=victim_size, for_school=school_id)
+    if budget > 0 and used > budget:
+        # Pinned schools and the index just loaded are never evicted
+        log_event('index_cache_over_budget', level='warning', used_bytes=used, budget_bytes=budget)
+
+
+def get_index_cache_stats() -> dict:
+    """Cached schools (least recently used first) with their estimated sizes, and hit/load/eviction counts"""
+    now = time.time()
+    with _index_cache_lock:
+        schools = [
+            {
+                'school_id': school_id,
+                'bytes': _index_sizes[school_id],
+                'pinned': school_id in Config.RAG_INDEX_CACHE_PINNED,
+                'idle_seconds': round(now - _index_last_used[school_id], 1),
+            }
+            for school_id in _index_cache
+        ]
+        counts = dict(_index_cache_stats)
+    return {
+        'budget_bytes': Config.RAG_INDEX_CACHE_MAX_MB * 1024 * 1024,
+        'used_bytes': sum(school['bytes'] for school in schools),
+        'pinned': list(Config.RAG_INDEX_CACHE_PINNED),
+        'loaded': len(schools),
+        **counts,
+        'schools': schools,
+    }
+
+
+def is_index_loaded(school_id: str) -> bool:
+    """Whether the school's index is in the cache (load_index() would not touch the disk)"""
+    with _index_cache_lock:
+        return school_id in _index_cache
 
 
 def load_index(school_id: str):
     """
-    Load school vector index (with caching)
+    Load school vector index (with memory-capped LRU caching)
 
     Args:
         school_id: School ID, e.g., 'UCI', 'UCSD', etc.
@@ -33,71 +266,170 @@ def load_index(school_id: str):
     Returns:
         VectorStoreIndex or None (if knowledge base doesn't exist)
     """
-    if school_id in _index_cache:
-        return _index_cache[school_id]
+    with _index_cache_lock:
+        index = _index_cache.get(school_id)
+        if index is not None:
+            _index_cache.move_to_end(school_id)
+            _index_last_used[school_id] = time.time()
+            _index_cache_stats['hits'] += 1
+            return index
 
     index_path = os.path.join(Config.VECTOR_STORE_PATH, school_id)
 
     if not os.path.exists(index_path):
-        print(f"Knowledge base does not exist: {index_path}")
+        log_event('index_missing', level='warning', school_id=school_id, path=index_path)
         return None
 
+    start = time.perf_counter()
     try:
-        storage_context = StorageContext.from_defaults(persist_dir=index_path)
-        index = load_index_from_storage(storage_context)
-        _index_cache[school_id] = index
-        print(f"Knowledge base loaded: {school_id}")
+        deps = _load_dependencies()
+        # Prefer the compact docstore (chunk text read on demand) when present
+        docstore = deps.load_compact_docstore(index_path)
+
+        # Quantized first-pass search when configured and the store has been quantized
+        vector_store = None
+        if Config.RAG_VECTOR_QUANTIZATION != 'none':
+            vector_store = deps.load_quantized_vector_store(index_path)
+            if vector_store is None:
+                log_event('quantized_vectors_missing', level='warning', school_id=school_id,
+                          hint='run: python build_knowledge_base.py quantize')
+
+        storage_context = deps.StorageContext.from_defaults(
+            persist_dir=index_path, docstore=docstore, vector_store=vector_store
+        )
+        index = deps.load_index_from_storage(storage_context)
+        size = estimate_index_bytes(index)
+        _cache_index(school_id, index, size)
+        log_event('index_loaded', school_id=school_id, nodes=len(index.index_struct.nodes_dict),
+                  bytes=size, seconds=round(time.perf_counter() - start, 3))
         return index
     except Exception as e:
-        print(f"Failed to load knowledge base [{school_id}]: {e}")
+        log_event('index_load_failed', level='error', school_id=school_id, error=str(e))
         return None
 
 
-def retrieve(school_id: str, query: str, chunk_count: int = None, similarity_threshold: float = None) -> tuple:
+def _dense_search(index, query: str, query_embedding: list = None, priority: int = PRIORITY_INTERACTIVE) -> list:
+    """Dense candidates for a question, best first (embeds the question unless the embedding is given)"""
+    # Dense search over the in-memory store is cheap, so fetch the widest
+    # candidate set once and let the score distribution decide how much
+    # of it is worth sending to the (remote) reranker
+    if Config.RAG_ADAPTIVE_DEPTH_ENABLED:
+        search_top_k = min(Config.RAG_CANDIDATE_MAX_TOP_K, len(index.index_struct.nodes_dict))
+    else:
+        search_top_k = Config.RAG_CANDIDATE_TOP_K
+    with stage('dense_retrieve'):
+        # Only the embedding call takes an upstream slot; the search itself is local
+        if query_embedding is None:
+            query_embedding = embed_query(query, priority)
+        retriever = index.as_retriever(similarity_top_k=max(search_top_k, 1))
+        return retriever.retrieve(_load_dependencies().QueryBundle(query, embedding=query_embedding))
+
+
+def search_candidates(school_id: str, query: str, query_embedding: list) -> list:
+    """
+    Dense candidate set retrieve() would rerank for a question (used by prefetch)
+
+    Args:
+        school_id: School ID
+        query: Question text
+        query_embedding: Embedding of the question
+
+    Returns:
+        list: NodeWithScore candidates, best first (empty if the knowledge base doesn't exist)
+    """
+    index = load_index(school_id)
+    if index is None:
+        return []
+    return _dense_search(index, query, query_embedding)
+
+
+def retrieve(school_id: str, query: str, chunk_count: int = None, similarity_threshold: float = None,
+             query_embedding: list = None, candidates: list = None, rerank_all: bool = False,
+             priority: int = PRIORITY_INTERACTIVE) -> tuple:
     """
     Retrieve relevant content from school knowledge base
 
+    Only the question embedding and the rerank go through the upstream
+    scheduler; loading the index and the dense search run on the caller's
+    thread, so a cold index never holds an upstream slot.
+
     Args:
         school_id: School ID
         query: User question
         chunk_count: Number of chunks to retrieve (defaults to config value)
         similarity_threshold: Similarity threshold (defaults to config value)
+        query_embedding: Embedding of the question, if already computed (skips the embedding call)
+        candidates: Dense candidates from search_candidates(), if already computed (skips the dense search)
+        rerank_all: Rerank every candidate with the question; set when the candidates were
+            scored against other text (a prefetched draft), so their dense scores say nothing
+            about this question and can neither skip nor size the rerank
+        priority: Upstream priority of the embedding and rerank calls
 
     Returns:
         tuple: (retrieved text content, highest relevance score, whether has high quality results)
+
+    Raises:
+        UpstreamSaturated, UpstreamTimeout: The question could not be embedded
+            (a saturated or failed rerank falls back to the dense order instead)
     """
     chunk_count = chunk_count or Config.RAG_CHUNK_COUNT
     similarity_threshold = similarity_threshold or Config.RAG_SIMILARITY_THRESHOLD
     # High quality threshold (used to determine if web search is needed)
     high_quality_threshold = getattr(Config, 'RAG_HIGH_QUALITY_THRESHOLD', 0.5)
 
-    index = load_index(school_id)
+    with stage('load_index'):
+        index = load_index(school_id)
     if index is None:
         return "", 0.0, False
 
     try:
-        # Create retriever, get more results for reranking
-        retriever = index.as_retriever(similarity_top_k=20)
-        nodes = retriever.retrieve(query)
+        store_size = len(index.index_struct.nodes_dict)
+        nodes = candidates if candidates is not None else _dense_search(index, query, query_embedding, priority)
 
         if not nodes:
             return "", 0.0, False
 
-        # Use DashScope Rerank for reranking
-        try:
-            reranker = DashScopeRerank(top_n=chunk_count, return_documents=True)
-            reranked_nodes = reranker.postprocess_nodes(nodes, query_str=query)
-        except Exception as e:
-            print(f"Rerank failed, using original results: {e}")
+        if rerank_all:
+            rerank_depth, skip_rerank, reason = len(nodes), False, 'rerank_all'
+        elif Config.RAG_ADAPTIVE_DEPTH_ENABLED:
+            rerank_depth, skip_rerank, reason = choose_rerank_depth(
+                [node.score or 0.0 for node in nodes], chunk_count, store_size
+            )
+        else:
+            rerank_depth, skip_rerank, reason = Config.RAG_CANDIDATE_TOP_K, False, 'fixed'
+        annotate(rerank_reason=reason, store_size=store_size, candidates=len(nodes),
+                 rerank_depth=0 if skip_rerank else rerank_depth, dense_top_score=round(nodes[0].score or 0.0, 4))
+
+        if skip_rerank:
+            # The dense ranking is already decisive; its top hits are used as-is,
+            # subject to the same thresholds as reranked hits below
             reranked_nodes = nodes[:chunk_count]
+        else:
+            # Use DashScope Rerank for reranking
+            rerank_candidates = nodes[:rerank_depth]
+            try:
+                reranker = _load_dependencies().DashScopeRerank(top_n=chunk_count, return_documents=True)
+                with stage('rerank'):
+                    reranked_nodes = scheduler.call(
+                        reranker.postprocess_nodes, rerank_candidates, query_str=query,
+                        priority=priority, timeout=Config.UPSTREAM_RETRIEVE_TIMEOUT
+                    )
+            except Exception as e:
+                # Fall back to the dense order
+                log_event('rerank_failed', level='warning', school_id=school_id, error=str(e))
+                annotate(rerank_failed=True)
+                # Candidates scored against other text are not ranked for this question
+                if rerank_all:
+                    rerank_candidates = _dense_search(index, query, query_embedding, priority)
+                reranked_nodes = rerank_candidates[:chunk_count]
 
         # Get the highest score
-        max_score = max([node.score for node in reranked_nodes]) if reranked_nodes else 0.0
+        max_score = max([node.score or 0.0 for node in reranked_nodes]) if reranked_nodes else 0.0
 
         # Filter by similarity threshold and assemble text
         chunk_texts = []
         for i, node in enumerate(reranked_nodes):
-            if node.score >= similarity_threshold:
+            if (node.score or 0.0) >= similarity_threshold:
                 chunk_texts.append(f"[Reference {i+1}]\n{node.text}")
 
         retrieved_content = "\n\n".join(chunk_texts)
@@ -105,11 +437,47 @@ def retrieve(school_id: str, query: str, chunk_count: int = None, similarity_thr
 
         return retrieved_content, max_score, has_high_quality
 
+    except (UpstreamSaturated, UpstreamTimeout):
+        # Surfaced to the caller (503 / 504) rather than answered without references
+        raise
     except Exception as e:
-        print(f"Retrieval failed [{school_id}]: {e}")
+        log_event('retrieval_failed', level='error', school_id=school_id, error=str(e))
         return "", 0.0, False
 
 
+def choose_rerank_depth(dense_scores: list, chunk_count: int, store_size: int) -> tuple:
+    """
+    Decide how many dense candidates to send to the reranker
+
+    Args:
+        dense_scores: Dense similarity scores of the candidates, best first
+        chunk_count: Number of chunks that will finally be used
+        store_size: Number of nodes in the school's store
+
+    Returns:
+        tuple: (rerank depth, whether to skip rerank entirely, decision reason)
+    """
+    top1 = dense_scores[0] if dense_scores else 0.0
+    top2 = dense_scores[1] if len(dense_scores) > 1 else 0.0
+    margin = top1 - top2
+
+    if store_size <= chunk_count:
+        # Every node will be returned anyway; rerank only to score them
+        return store_size, False, 'small_store'
+
+    if top1 >= Config.RAG_DENSE_CONFIDENT_SCORE and margin >= Config.RAG_CONFIDENT_MARGIN:
+        return 0, True, 'confident'
+
+    if margin >= Config.RAG_CONFIDENT_MARGIN:
+        # Clear winner but not a strong enough match to trust without rerank
+        return min(Config.RAG_CANDIDATE_MIN_TOP_K, len(dense_scores)), False, 'clear_margin'
+
+    if margin < Config.RAG_AMBIGUOUS_MARGIN:
+        return min(Config.RAG_CANDIDATE_MAX_TOP_K, len(dense_scores)), False, 'ambiguous'
+
+    return min(Config.RAG_CANDIDATE_TOP_K, len(dense_scores)), False, 'default'
+
+
 def retrieve_simple(school_id: str, query: str) -> str:
     """
     Simplified retrieval function, returns only text content (backward compatible)
@@ -118,7 +486,47 @@ def retrieve_simple(school_id: str, query: str) -> str:
     return content
 
 
-def get_system_prompt(school_id: str, retrieved_content: str, use_web_search: bool = False) -> str:
+# System prompt layouts (see prompt_cache.py for the A/B assignment)
+PROMPT_LAYOUT_CACHE_FRIENDLY = 'cache_friendly'
+PROMPT_LAYOUT_LEGACY = 'legacy'
+
+
+def get_prompt_prefix(school_id: str) -> str:
+    """
+    Stable start of the system prompt of a school, identical for every
+    request and mode so the provider can cache it across requests
+
+    Only fixed instructions that hold in every mode belong here; the prefix
+    must stay above the provider's minimum cacheable length (see
+    prompt_cache.PROVIDER_CACHE_MIN_TOKENS), and mode-specific instructions
+    go after it, in get_system_prompt().
+
+    Args:
+        school_id: School ID
+
+    Returns:
+        Prompt prefix (without per-request content)
+    """
+    school_info = Config.SCHOOLS.get(school_id, {})
+    school_name = school_info.get('name', school_id)
+    return f"""You are an AI assistant dedicated to {school_name}.
+
+You help current and incoming international students with questions about studying and living at {school_name}: admissions and enrollment, visas and immigration documents, housing, transportation, course registration, campus services, health insurance, banking and phone plans, and everyday life in the surrounding area.
+
+Response requirements (they apply to every answer; instructions for the current question follow):
+1. Responses should be accurate, friendly, and helpful
+2. Always respond in English
+3. Never invent dates, deadlines, fees, phone numbers, addresses, or links; if a detail is not known, say so
+4. If the question involves specific school policies or information you cannot confirm, suggest that students consult official school channels, such as the responsible office or the school website
+5. Rules on visas, immigration status, tuition, and financial aid change over time; when an answer depends on them, remind the student to verify the current rules
+6. Keep answers focused on the question, use numbered steps for procedures, and do not repeat the question back
+7. If a question is ambiguous, answer the most likely interpretation and briefly mention what information would change the answer
+8. Do not ask for or repeat personal information such as passport numbers, student ID numbers, or passwords
+9. For emergencies or safety concerns, tell the student to contact local emergency services or campus police first"""
+
+
+def get_system_prompt(school_id: str, retrieved_content: str, use_web_search: bool = False,
+                      layout: str = PROMPT_LAYOUT_CACHE_FRIENDLY) -> str:
     """
     Generate school-specific system prompt
 
@@ -126,10 +534,40 @@ def get_system_prompt(school_id: str, retrieved_content: str, use_web_search: bo
         school_id: School ID
         retrieved_content: Content retrieved by RAG
         use_web_search: Whether to use web search mode
+        layout: PROMPT_LAYOUT_CACHE_FRIENDLY (stable prefix, then per-request
+            content and mode instructions) or PROMPT_LAYOUT_LEGACY (references
+            inside the instructions)
 
     Returns:
         Complete system prompt
     """
+    if layout == PROMPT_LAYOUT_LEGACY:
+        return _legacy_system_prompt(school_id, retrieved_content, use_web_search)
+
+    if retrieved_content:
+        context = f"""Reference materials:
+
+{retrieved_content}
+
+Instructions for this question:
+1. Prioritize using information from the reference materials to answer questions
+2. If the reference materials don't contain relevant information, honestly inform the user and try to provide general advice"""
+    elif use_web_search:
+        context = """The current question did not find highly relevant information in the knowledge base. The system has enabled web search to obtain the latest information.
+
+Instructions for this question:
+1. Answer questions based on web search results, ensuring accuracy and timeliness
+2. If search results are not highly relevant to the question, clearly inform the user
+3. When citing web information, include source references at the end of your response
+4. Prefer English language web sources and results"""
+    else:
+        context = ("No relevant reference materials were retrieved. "
+                   "Please answer the student's question based on your knowledge.")
+    return f"{get_prompt_prefix(school_id)}\n\n{context}"
+
+
+def _legacy_system_prompt(school_id: str, retrieved_content: str, use_web_search: bool) -> str:
+    """Original prompt layout with the references before the requirements (A/B baseline)"""
     school_info = Config.SCHOOLS.get(school_id, {})
     school_name = school_info.get('name', school_id)
 
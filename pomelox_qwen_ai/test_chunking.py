@@ -0,0 +1,139 @@
+import zipfile
+
+import chunking
+from config import Config
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+
+STYLES_XML = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:styles xmlns:w="{W_NS}">
+  <w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/></w:style>
+  <w:style w:type="paragraph" w:styleId="Heading2"><w:name w:val="heading 2"/></w:style>
+</w:styles>"""
+
+
+def paragraph(text, style=None, bold=False, numbered=False):
+    properties = ''
+    if style or numbered:
+        properties = '<w:pPr>'
+        if style:
+            properties += f'<w:pStyle w:val="{style}"/>'
+        if numbered:
+            properties += '<w:numPr><w:ilvl w:val="0"/><w:numId w:val="1"/></w:numPr>'
+        properties += '</w:pPr>'
+    run_properties = '<w:rPr><w:b/></w:rPr>' if bold else ''
+    return f'<w:p>{properties}<w:r>{run_properties}<w:t xml:space="preserve">{text}</w:t></w:r></w:p>'
+
+
+def table(rows):
+    cells = ''.join(
+        '<w:tr>' + ''.join(f'<w:tc><w:p><w:r><w:t>{cell}</w:t></w:r></w:p></w:tc>' for cell in row) + '</w:tr>'
+        for row in rows
+    )
+    return f'<w:tbl>{cells}</w:tbl>'
+
+
+def write_docx(path, body):
+    document = f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>' \
+               f'<w:document xmlns:w="{W_NS}"><w:body>{body}</w:body></w:document>'
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('word/document.xml', document)
+        archive.writestr('word/styles.xml', STYLES_XML)
+
+
+BOILERPLATE = '请勿更改或翻译CHINESE UNION，无论语言都使用CHINESE UNION(VITA Global) Non-Profit Organization作为组织名称。'
+
+
+def make_school_docx(path):
+    housing = ''.join(f'宿舍区第{i}栋楼提供单人间与双人间，新生需要在五月前通过学校住房门户提交申请。' for i in range(30))
+    body = ''.join([
+        paragraph('住房', style='Heading1'),
+        paragraph(housing),
+        paragraph(BOILERPLATE),
+        paragraph('校内宿舍', style='Heading2'),
+        paragraph('申请步骤', bold=True),
+        paragraph('登录学校住房门户并填写偏好', numbered=True),
+        paragraph('缴纳押金五百美元', numbered=True),
+        paragraph('等待分配结果邮件', numbered=True),
+        paragraph('交通', style='Heading1'),
+        table([['线路', '起点', '终点'], *[[f'{i}路', f'校园北门{i}', f'市中心站{i}'] for i in range(80)]]),
+        paragraph('新生手机卡', style='Heading1'),
+        paragraph('推荐使用 T-Mobile 或 Mint Mobile 的学生套餐，在校园附近门店即可办理。'),
+        paragraph(BOILERPLATE),
+        paragraph(BOILERPLATE.replace('。', '！')),
+    ])
+    write_docx(path, body)
+
+
+def test_structure_and_token_limits(tmp_path, monkeypatch):
+    """测试分块遵循标题、列表与表格结构，并遵守 token 上限"""
+    monkeypatch.setattr(Config, 'RAG_CHUNK_MAX_TOKENS', 200)
+    path = str(tmp_path / 'school.docx')
+    make_school_docx(path)
+
+    blocks = chunking.read_docx_blocks(path)
+    kinds = [block.kind for block in blocks]
+    assert kinds.count(chunking.KIND_HEADING) == 5     # 三个一级标题、一个二级标题、一个加粗标题
+    assert kinds.count(chunking.KIND_LIST) == 1
+    assert kinds.count(chunking.KIND_TABLE) == 1
+
+    chunks = chunking.chunk_blocks(blocks)
+    for chunk in chunks:
+        print(chunk['tokens'], chunk['section'])
+        assert chunk['tokens'] <= 200
+        assert chunk['text'].startswith(chunk['section'])
+
+    # 列表完整保留在所属标题下，且不与交通表格混在一起
+    list_chunk = next(c for c in chunks if '缴纳押金' in c['text'])
+    assert list_chunk['section'].startswith('住房')
+    assert '校内宿舍' in list_chunk['text'] and '申请步骤' in list_chunk['text']
+    assert '登录学校住房门户' in list_chunk['text'] and '等待分配结果邮件' in list_chunk['text']
+    assert '线路' not in list_chunk['text']
+
+    # 长表格按行拆分，每块重复表头
+    table_chunks = [c for c in chunks if c['section'] == '交通']
+    assert len(table_chunks) > 1
+    assert all('线路 | 起点 | 终点' in c['text'] for c in table_chunks)
+
+
+def test_long_heading_path(monkeypatch):
+    """测试标题路径过长时省略外层标题，正文不会被拆成单个字符"""
+    monkeypatch.setattr(Config, 'RAG_CHUNK_MAX_TOKENS', 60)
+    headings = [chunking._Block(chunking.KIND_HEADING, [f'{name}相关的说明与注意事项'], level=level)
+                for level, name in enumerate(['新生入学', '校内住宿', '宿舍申请', '押金退还'], start=1)]
+    body = chunking._Block(chunking.KIND_PARAGRAPH, ['押金在退宿检查后三十天内退还。', '损坏物品的费用从押金中扣除。'])
+    chunks = chunking.chunk_blocks([*headings, body], min_tokens=0)
+
+    print([(c['tokens'], c['section']) for c in chunks])
+    assert len(chunks) == 1
+    assert chunks[0]['section'] == '宿舍申请相关的说明与注意事项 > 押金退还相关的说明与注意事项'
+    assert chunks[0]['tokens'] <= 60
+    assert '押金在退宿检查后三十天内退还。损坏物品的费用从押金中扣除。' in chunks[0]['text']
+
+    # 单个标题本身就超过上限：正文仍按句子成块
+    long_heading = chunking._Block(chunking.KIND_HEADING, ['押金' * 30], level=1)
+    chunks = chunking.chunk_blocks([long_heading, body], min_tokens=0)
+    assert all(len(c['text'].split('\n\n', 1)[1]) > 1 for c in chunks)
+
+
+def test_duplicates_removed_before_embedding(tmp_path):
+    """测试完全重复与近似重复的分块被去除，并报告数量"""
+    path = str(tmp_path / 'school.docx')
+    make_school_docx(path)
+
+    boilerplate = chunking._Block(chunking.KIND_PARAGRAPH, [BOILERPLATE])
+    near_copy = chunking._Block(chunking.KIND_PARAGRAPH, [BOILERPLATE.replace('。', '！')])
+    unrelated = chunking._Block(chunking.KIND_PARAGRAPH, ['图书馆期末周二十四小时开放，需要刷学生卡进入。'])
+    heading = chunking._Block(chunking.KIND_HEADING, ['组织介绍'], level=1)
+    chunks = chunking.chunk_blocks([heading, boilerplate, heading, boilerplate, heading, near_copy,
+                                    heading, unrelated], min_tokens=0)
+    assert len(chunks) == 4
+
+    kept, report = chunking.remove_near_duplicates(chunks)
+    assert report == {'exact': 1, 'near': 1}
+    assert [c['text'] for c in kept] == [chunks[0]['text'], chunks[3]['text']]
+
+    _, report = chunking.chunk_document(path)
+    print(f"分块报告: {report}")
+    assert report['chunks'] == report['chunks_before_dedup'] - report['exact_duplicates'] - report['near_duplicates']
+    assert report['max_tokens'] <= Config.RAG_CHUNK_MAX_TOKENS
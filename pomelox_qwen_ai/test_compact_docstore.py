@@ -0,0 +1,102 @@
+import os
+import zlib
+
+import pytest
+from llama_index.core import VectorStoreIndex
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import Document, NodeRelationship, TextNode
+
+from compact_docstore import (
+    compact_store, load_compact_docstore, remove_compact_store, has_compact_store,
+    LEGACY_DOCSTORE_FILE, ReadOnlyStoreError,
+)
+
+
+class HashEmbedding(BaseEmbedding):
+    """用文本哈希生成向量代替 DashScope"""
+
+    def _vector(self, text):
+        seed = zlib.crc32(text.encode('utf-8'))
+        return [((seed >> i) & 0xFF) / 255.0 for i in range(8)]
+
+    def _get_text_embedding(self, text):
+        return self._vector(text)
+
+    def _get_query_embedding(self, query):
+        return self._vector(query)
+
+    async def _aget_query_embedding(self, query):
+        return self._vector(query)
+
+
+def build_store(store_dir):
+    """构建一个带元数据与节点关系的小索引并保存"""
+    source = Document(text='', id_='UCLACU.docx', metadata={'file_name': 'UCLACU.docx'})
+    texts = ['住宿 > 申请: 宿舍申请 5 月 1 日截止。', '交通 > 校车: Bruin Bus 每 10 分钟一班。', 'Visa: bring your I-20.']
+    nodes = []
+    for i, text in enumerate(texts):
+        node = TextNode(
+            text=text,
+            metadata={'file_name': 'UCLACU.docx', 'section': text.split(':')[0]},
+            excluded_embed_metadata_keys=['file_name', 'section'],
+            start_char_idx=i * 100,
+            end_char_idx=i * 100 + len(text),
+        )
+        node.relationships[NodeRelationship.SOURCE] = source.as_related_node_info()
+        nodes.append(node)
+    nodes[0].relationships[NodeRelationship.NEXT] = nodes[1].as_related_node_info()
+    nodes[1].relationships[NodeRelationship.PREVIOUS] = nodes[0].as_related_node_info()
+
+    index = VectorStoreIndex(nodes, embed_model=HashEmbedding())
+    index.storage_context.persist(store_dir)
+    return index.docstore
+
+
+def test_compact_round_trip(tmp_path):
+    """测试紧凑文档存储读回的节点文本、元数据与关系与原始文档存储一致"""
+    store_dir = str(tmp_path)
+    original = build_store(store_dir)
+
+    report = compact_store(store_dir)
+    print(f"紧凑存储报告: {report}")
+    assert report['nodes'] == 3
+    assert not os.path.exists(os.path.join(store_dir, LEGACY_DOCSTORE_FILE))
+
+    compact = load_compact_docstore(store_dir)
+    assert set(compact.docs) == set(original.docs)
+    for node_id, expected in original.docs.items():
+        node = compact.get_node(node_id)
+        assert node.text == expected.text
+        assert node.metadata == expected.metadata
+        assert node.excluded_embed_metadata_keys == expected.excluded_embed_metadata_keys
+        assert (node.start_char_idx, node.end_char_idx) == (expected.start_char_idx, expected.end_char_idx)
+        assert node.relationships == expected.relationships
+        assert node.hash == expected.hash
+    assert compact.get_all_ref_doc_info() == original.get_all_ref_doc_info()
+
+
+def test_remove_compact_store(tmp_path):
+    """测试重建前删除紧凑文件后不再加载旧的紧凑文档存储"""
+    store_dir = str(tmp_path)
+    build_store(store_dir)
+    compact_store(store_dir)
+    assert has_compact_store(store_dir)
+
+    remove_compact_store(store_dir)
+    assert load_compact_docstore(store_dir) is None
+    assert not any(name.startswith('docstore.') for name in os.listdir(store_dir))
+
+
+def test_compact_store_is_read_only(tmp_path):
+    """测试写入或删除紧凑文档存储的节点时抛出 ReadOnlyStoreError"""
+    store_dir = str(tmp_path)
+    original = build_store(store_dir)
+    compact_store(store_dir)
+    compact = load_compact_docstore(store_dir)
+    node = next(iter(original.docs.values()))
+
+    with pytest.raises(ReadOnlyStoreError):
+        compact.add_documents([node])
+    with pytest.raises(ReadOnlyStoreError):
+        compact.delete_document(node.node_id)
+    assert compact.get_node(node.node_id).text == node.text
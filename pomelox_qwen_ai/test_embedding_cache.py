@@ -0,0 +1,93 @@
+import os
+import zlib
+
+from llama_index.core import VectorStoreIndex
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.schema import TextNode
+
+from embedding_cache import EmbeddingCache, CachedEmbedding
+
+BOILERPLATE = [
+    'Opening a US bank account: bring your passport, I-20 and proof of address.',
+    'Phone plans: most students choose a prepaid plan from a major carrier.',
+]
+
+
+class CountingEmbedding(BaseEmbedding):
+    """用文本哈希生成向量代替 DashScope，并记录实际嵌入的文本"""
+    embedded: list = []
+
+    def _vector(self, text):
+        seed = zlib.crc32(text.encode('utf-8'))
+        return [((seed >> i) & 0xFF) / 255.0 for i in range(8)]
+
+    def _get_text_embeddings(self, texts):
+        self.embedded.extend(texts)
+        return [self._vector(text) for text in texts]
+
+    def _get_text_embedding(self, text):
+        return self._get_text_embeddings([text])[0]
+
+    def _get_query_embedding(self, query):
+        self.embedded.append(query)
+        return self._vector(query)
+
+    async def _aget_query_embedding(self, query):
+        return self._get_query_embedding(query)
+
+
+def build_index(embed_model, school_texts):
+    nodes = [TextNode(text=text) for text in school_texts]
+    return VectorStoreIndex(nodes, embed_model=embed_model)
+
+
+def test_shared_chunks_are_embedded_once(tmp_path):
+    """测试多个学校共有的分块与重复构建只调用一次嵌入，并统计命中率"""
+    inner = CountingEmbedding(model_name='text-embedding-v2', embedded=[])
+    cache = EmbeddingCache(str(tmp_path))
+    embed_model = CachedEmbedding(inner, cache)
+
+    build_index(embed_model, BOILERPLATE + ['UCI: the Anteater Express shuttle is free.'])
+    build_index(embed_model, BOILERPLATE + ['UCLA: the Bruin Bus runs every 10 minutes.'])
+    assert len(inner.embedded) == 4
+    assert cache.stats() == {'hits': 2, 'misses': 4, 'hit_rate': 0.3333}
+
+    # 新的构建进程（新的缓存实例）直接从磁盘读取，向量与首次嵌入一致（float32 精度）
+    rebuild_cache = EmbeddingCache(str(tmp_path))
+    index = build_index(CachedEmbedding(inner, rebuild_cache), BOILERPLATE)
+    assert len(inner.embedded) == 4
+    assert rebuild_cache.stats()['hit_rate'] == 1.0
+    stored = index.vector_store.data.embedding_dict
+    for node in index.docstore.docs.values():
+        expected = inner._vector(node.get_content())
+        assert all(abs(a - b) < 1e-6 for a, b in zip(stored[node.node_id], expected))
+
+    # 不同模型或文本类型使用不同的键
+    other = CachedEmbedding(CountingEmbedding(model_name='text-embedding-v3', embedded=[]), rebuild_cache)
+    other.get_text_embedding(BOILERPLATE[0])
+    other.get_query_embedding(BOILERPLATE[0])
+    assert rebuild_cache.stats()['misses'] == 2
+
+    cache.record_run()
+    totals = rebuild_cache.record_run()
+    print(f"累计命中统计: {totals}")
+    assert totals['runs'] == 2
+    assert totals['hits'] == 4
+
+
+def test_gc_removes_least_recently_used(tmp_path):
+    """测试超出大小上限时按最近使用时间清理，最近命中的向量保留"""
+    cache = EmbeddingCache(str(tmp_path))
+    keys = [f'{i:02x}' + 'a' * 62 for i in range(4)]
+    for age, key in enumerate(keys):
+        cache.put(key, [0.5] * 16)
+        path = cache._path(key)
+        os.utime(path, (1000 + age, 1000 + age))
+
+    assert cache.lookup([keys[0]])[0] == [0.5] * 16     # 命中后变为最近使用
+    assert cache.usage() == {'vectors': 4, 'bytes': 4 * 64}
+
+    report = cache.gc(max_bytes=2 * 64)
+    print(f"清理结果: {report}")
+    assert report == {'removed': 2, 'removed_bytes': 128, 'vectors': 2, 'bytes': 128}
+    assert cache.lookup(keys) == [[0.5] * 16, None, None, [0.5] * 16]
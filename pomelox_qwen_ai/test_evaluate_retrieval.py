@@ -0,0 +1,88 @@
+import json
+import os
+
+import numpy as np
+
+import evaluate_retrieval
+from config import Config
+from compact_docstore import CompactKVStore
+
+SCHOOL = 'UCLA'
+
+
+def store_nodes():
+    """读取 UCLA 知识库的节点文本与向量"""
+    store_dir = os.path.join(Config.VECTOR_STORE_PATH, SCHOOL)
+    with open(os.path.join(store_dir, 'default__vector_store.json'), 'r', encoding='utf-8') as f:
+        vectors = json.load(f)['embedding_dict']
+    kv = CompactKVStore(store_dir)
+    texts = {node_id: kv.get(node_id, 'docstore/data')['__data__']['text'] for node_id in vectors}
+    return vectors, texts
+
+
+def write_cache(cache_dir, questions, vectors, texts):
+    """构造合成缓存：可回答的问题嵌入等于目标分块的向量，目标分块重排序分数为 0.8"""
+    rng = np.random.default_rng(0)
+    dim = len(next(iter(vectors.values())))
+    embeddings, rerank = {}, {}
+    for q in questions:
+        targets = [i for i, t in enumerate(texts) if q['expected'] and any(e in texts[t] for e in q['expected'])]
+        node_ids = list(texts)
+        if targets:
+            vector = vectors[node_ids[targets[0]]]
+        else:
+            vector = rng.normal(size=dim).tolist()
+        key = evaluate_retrieval._key(q['question'])
+        embeddings[key] = {'query': q['question'], 'vector': vector, 'ms': 100.0}
+        scores = {node_id: (0.8 if i in targets else 0.1) for i, node_id in enumerate(node_ids)}
+        rerank[key] = {'query': q['question'], 'scores': scores, 'calls': [{'docs': 40, 'ms': 500.0}]}
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, 'embeddings.json'), 'w', encoding='utf-8') as f:
+        json.dump(embeddings, f)
+    with open(os.path.join(cache_dir, 'rerank.json'), 'w', encoding='utf-8') as f:
+        json.dump(rerank, f)
+
+
+def test_sweep_from_cache(tmp_path):
+    """测试仅依靠缓存完成参数扫描，并正确统计联网比例、误判与命中率"""
+    questions = [
+        {'school_id': SCHOOL, 'question': 'UCLA新生宿舍怎么申请？', 'answerable': True, 'expected': ['De Neve']},
+        {'school_id': SCHOOL, 'question': 'UCLA在附近哪里买车？', 'answerable': True, 'expected': ['Santa Monica Honda']},
+        {'school_id': SCHOOL, 'question': 'UCLA的化学系教授里谁在做电池研究？', 'answerable': False, 'expected': []},
+    ]
+    vectors, texts = store_nodes()
+    cache_dir = str(tmp_path / 'cache')
+    write_cache(cache_dir, questions, vectors, texts)
+
+    cache = evaluate_retrieval.EvalCache(cache_dir, offline=True)
+    grid = [
+        {'top_k': '20', 'chunks': 5, 'similarity': 0.2, 'high_quality': 0.5},
+        {'top_k': '20', 'chunks': 5, 'similarity': 0.2, 'high_quality': 0.9},
+    ]
+    report = evaluate_retrieval.evaluate(questions, grid, cache)
+    assert report['live_calls'] == 0
+    assert report['latency_sources']['embed'] == 'cache (n=3)'
+
+    default, strict = report['results']
+    assert default['hit_rate'] == 1.0
+    assert default['false_fallback_rate'] == 0.0
+    assert default['missed_fallback_rate'] == 0.0
+    assert default['web_search_rate'] == round(1 / 3, 4)
+
+    # 高质量阈值高于所有重排序分数：全部走联网搜索，延迟随之上升
+    assert strict['web_search_rate'] == 1.0
+    assert strict['false_fallback_rate'] == 1.0
+    assert strict['p50_ms'] > default['p50_ms']
+
+
+def test_offline_miss_is_reported(tmp_path):
+    """测试离线模式下缓存缺失时报错，而不是被 retrieve() 静默降级"""
+    questions = [{'school_id': SCHOOL, 'question': '缓存里没有的问题', 'answerable': True, 'expected': ['x']}]
+    cache = evaluate_retrieval.EvalCache(str(tmp_path / 'cache'), offline=True)
+    grid = [{'top_k': '20', 'chunks': 5, 'similarity': 0.2, 'high_quality': 0.5}]
+    try:
+        evaluate_retrieval.evaluate(questions, grid, cache)
+    except evaluate_retrieval.CacheMiss as e:
+        assert '缓存中没有' in str(e)
+    else:
+        raise AssertionError('expected CacheMiss')
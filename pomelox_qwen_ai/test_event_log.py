@@ -0,0 +1,113 @@
+import json
+import time
+
+from flask import Flask, jsonify
+
+import event_log
+from config import Config
+from upstream import scheduler
+
+
+def fake_retrieve():
+    """模拟在上游执行线程中运行的检索：记录字段与阶段耗时"""
+    with event_log.stage('dense_retrieve'):
+        time.sleep(0.01)
+    event_log.annotate(rerank_reason='confident')
+    event_log.log_event('index_loaded', school_id='UCI')
+    return 0.8
+
+
+def make_app():
+    app = Flask(__name__)
+    event_log.init_app(app)
+
+    @app.route('/ask')
+    def ask():
+        event_log.annotate(school_id='UCI', route='rag')
+        with event_log.stage('retrieve'):
+            score = scheduler.call(fake_retrieve)
+        event_log.annotate(rag_score=score)
+        return jsonify({'ok': True})
+
+    @app.route('/fail')
+    def fail():
+        raise RuntimeError('boom')
+
+    @app.route('/health')
+    def health():
+        return jsonify({'status': 'healthy'})
+
+    return app
+
+
+def read_events(path):
+    event_log.flush()
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_request_event_fields(monkeypatch, tmp_path):
+    """测试每个请求写出一条 JSON 事件，包含请求 ID、学校、路由、分数和阶段耗时"""
+    path = str(tmp_path / 'events.jsonl')
+    monkeypatch.setattr(Config, 'EVENT_LOG_PATH', path)
+    c = make_app().test_client()
+
+    response = c.get('/ask', headers={'X-Request-Id': 'req-123'})
+    assert response.headers['X-Request-Id'] == 'req-123'
+    c.get('/health')
+
+    events = read_events(path)
+    print(events)
+    request_events = [e for e in events if e['event'] == 'request']
+    assert len(request_events) == 1     # /health 不记录
+    event = request_events[0]
+    assert event['request_id'] == 'req-123'
+    assert event['school_id'] == 'UCI'
+    assert event['route'] == 'rag'
+    assert event['rag_score'] == 0.8
+    assert event['rerank_reason'] == 'confident'       # 来自执行线程
+    assert event['status'] == 200
+    assert event['stages_ms']['dense_retrieve'] >= 10
+    assert event['stages_ms']['retrieve'] >= event['stages_ms']['dense_retrieve']
+
+    loaded = [e for e in events if e['event'] == 'index_loaded']
+    assert loaded[0]['request_id'] == 'req-123'
+
+
+def test_sampling_keeps_failures(monkeypatch, tmp_path):
+    """测试采样率为 0 时普通请求不记录，失败请求仍然记录"""
+    path = str(tmp_path / 'events.jsonl')
+    monkeypatch.setattr(Config, 'EVENT_LOG_PATH', path)
+    monkeypatch.setattr(Config, 'EVENT_LOG_SAMPLE_RATE', 0.0)
+    c = make_app().test_client()
+
+    c.get('/ask')
+    assert c.get('/fail').status_code == 500
+
+    events = [e for e in read_events(path) if e['event'] == 'request']
+    assert len(events) == 1
+    assert events[0]['path'] == '/fail'
+    assert events[0]['level'] == 'error'
+    assert 'RuntimeError' in events[0]['error']
+
+
+def test_full_queue_drops_instead_of_blocking(monkeypatch, tmp_path):
+    """测试队列已满时丢弃事件并计数，不阻塞调用方"""
+    monkeypatch.setattr(Config, 'EVENT_LOG_PATH', str(tmp_path / 'events.jsonl'))
+    monkeypatch.setattr(Config, 'EVENT_LOG_QUEUE_SIZE', 1)
+    event_log.log_event('warmup')
+    event_log.flush()
+
+    listener = event_log._event_log.listener
+    listener.stop()     # 模拟写入线程跟不上
+    try:
+        dropped_before = event_log.get_event_log_stats()['dropped']
+        start = time.perf_counter()
+        for i in range(100):
+            event_log.log_event('burst', i=i)
+        assert time.perf_counter() - start < 0.5
+        assert event_log.get_event_log_stats()['dropped'] - dropped_before == 99
+    finally:
+        listener.start()
+        monkeypatch.setattr(Config, 'EVENT_LOG_QUEUE_SIZE', 10000)
+        event_log.flush()
@@ -0,0 +1,123 @@
+import math
+import os
+import zlib
+
+import app as app_module
+import faq_answers
+import rag_service
+from config import Config
+
+FAQ_QUESTIONS = [
+    'When is the housing application deadline?',
+    'How do I get to campus from the airport?',
+    'What is the weather like on Mars?',
+]
+
+
+class FakeEmbedModel:
+    """用字符三元组哈希向量代替 DashScope 嵌入，并记录调用次数"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_query_embedding(self, text):
+        self.calls += 1
+        vector = [0.0] * 64
+        text = text.lower()
+        for i in range(len(text) - 2):
+            vector[zlib.crc32(text[i:i + 3].encode('utf-8')) % 64] += 1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+
+def fake_retrieve(school_id, question, query_embedding=None, priority=None):
+    """模拟检索：与学校无关的问题得分低"""
+    assert query_embedding is not None
+    if 'Mars' in question:
+        return '', 0.1, False
+    return '[Reference 1]\nHousing applications close on May 1.', 0.8, True
+
+
+def setup_store(monkeypatch, tmp_path, content='{"index_store/data": {}}'):
+    monkeypatch.setattr(Config, 'VECTOR_STORE_PATH', str(tmp_path))
+    store_dir = tmp_path / 'UCI'
+    store_dir.mkdir(exist_ok=True)
+    (store_dir / 'index_store.json').write_text(content, encoding='utf-8')
+    faq_answers._faq_cache.clear()
+    embed_model = FakeEmbedModel()
+    monkeypatch.setattr(faq_answers, 'get_embed_model', lambda: embed_model)
+    monkeypatch.setattr(rag_service, 'get_embed_model', lambda: embed_model)
+    monkeypatch.setattr(faq_answers, 'retrieve', fake_retrieve)
+    return str(store_dir), embed_model
+
+
+def build(store_dir):
+    report = faq_answers.build_faq_answers(
+        'UCI', FAQ_QUESTIONS, generate=lambda messages: f"Answer to: {messages[-1]['content']}"
+    )
+    print(f"FAQ 构建报告: {report}")
+    return report
+
+
+def test_build_and_match(monkeypatch, tmp_path):
+    """测试构建时只保存检索质量足够的答案，提问与 FAQ 足够接近时命中"""
+    store_dir, _ = setup_store(monkeypatch, tmp_path)
+    report = build(store_dir)
+    assert report == {'questions': 3, 'answered': 2, 'low_score': 1, 'failed': 0}
+    assert faq_answers.has_faq_answers('UCI')
+
+    match, embedding = faq_answers.match_faq('UCI', 'When is the housing application deadline')
+    assert match['answer'] == 'Answer to: When is the housing application deadline?'
+    assert match['similarity'] >= Config.FAQ_MATCH_THRESHOLD
+    assert len(embedding) == 64
+
+    match, embedding = faq_answers.match_faq('UCI', 'Which dining hall serves breakfast?')
+    assert match is None
+    assert embedding is not None
+
+
+def test_rebuilt_index_invalidates_answers(monkeypatch, tmp_path):
+    """测试索引重建后旧答案不再使用"""
+    store_dir, _ = setup_store(monkeypatch, tmp_path)
+    build(store_dir)
+
+    setup_store(monkeypatch, tmp_path, content='{"index_store/data": {"rebuilt": true}}')
+    assert not faq_answers.has_faq_answers('UCI')
+
+    faq_answers.remove_faq_answers(store_dir)
+    assert not os.path.exists(os.path.join(store_dir, faq_answers.FAQ_FILE))
+
+
+def test_ask_serves_faq_on_first_turn_only(monkeypatch, tmp_path):
+    """测试 /ask 首轮命中 FAQ 时不检索不生成；后续轮次走正常流程并复用问题嵌入"""
+    store_dir, embed_model = setup_store(monkeypatch, tmp_path)
+    build(store_dir)
+
+    retrieved = []
+
+    def tracking_retrieve(school_id, question, query_embedding=None, candidates=None, rerank_all=False):
+        retrieved.append(query_embedding)
+        return '[Reference 1]\nHousing applications close on May 1.', 0.8, True
+
+    monkeypatch.setattr(app_module, 'retrieve', tracking_retrieve)
+    monkeypatch.setattr(app_module, 'call_ai_with_web_search', lambda *args, **kwargs: ('Live answer', None))
+    client = app_module.app.test_client()
+
+    calls_before = embed_model.calls
+    first = client.post('/ask', json={'school_id': 'UCI', 'session_id': 'faq-test',
+                                      'question': 'When is the housing application deadline?'}).get_json()
+    assert first['answer'] == 'Answer to: When is the housing application deadline?'
+    assert first['source_type'] == 'knowledge_base'
+    assert first['faq_match']['question'] == FAQ_QUESTIONS[0]
+    assert retrieved == []
+    assert embed_model.calls == calls_before + 1
+
+    follow_up = client.post('/ask', json={'school_id': 'UCI', 'session_id': 'faq-test',
+                                          'question': 'When is the housing application deadline?'}).get_json()
+    assert follow_up['answer'] == 'Live answer'
+    assert 'faq_match' not in follow_up
+
+    miss = client.post('/ask', json={'school_id': 'UCI', 'session_id': 'faq-test-2',
+                                     'question': 'Which dining hall on campus serves breakfast?'}).get_json()
+    assert miss['answer'] == 'Live answer'
+    assert retrieved[-1] is not None      # 未命中时复用已计算的问题嵌入
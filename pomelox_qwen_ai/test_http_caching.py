@@ -0,0 +1,89 @@
+import gzip
+import json
+
+import app as app_module
+import http_caching
+
+
+def client():
+    return app_module.app.test_client()
+
+
+def test_index_is_compressed_and_revalidated():
+    """测试 index.html 按 Accept-Encoding 压缩，携带 ETag 再次请求返回 304"""
+    c = client()
+    response = c.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    with open(app_module.index_page.path, 'rb') as f:
+        assert gzip.decompress(response.data) == f.read()
+    print(f"index.html 压缩后: {len(response.data)} 字节")
+
+    etag = response.headers['ETag']
+    revalidated = c.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+    assert revalidated.headers['ETag'] == etag
+
+
+def test_identity_and_compressed_etags_differ():
+    """测试不同编码是不同的表示，ETag 不能互相命中"""
+    c = client()
+    plain = c.get('/', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in plain.headers
+    gzipped = c.get('/', headers={'Accept-Encoding': 'gzip'})
+    assert plain.headers['ETag'] != gzipped.headers['ETag']
+
+    response = c.get('/', headers={'Accept-Encoding': 'gzip', 'If-None-Match': plain.headers['ETag']})
+    assert response.status_code == 200
+
+
+def test_brotli_preferred_when_available():
+    """测试安装 brotli 时优先使用 br 编码"""
+    if http_caching.brotli is None:
+        print("未安装 brotli，跳过")
+        return
+    response = client().get('/', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert http_caching.brotli.decompress(response.data).startswith(b'<!')
+
+
+def test_schools_cache_headers():
+    """测试 /schools 返回 Cache-Control 与 ETag，条件请求返回 304"""
+    c = client()
+    response = c.get('/schools')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'public, max-age=3600'
+    assert set(response.get_json()['schools']) == set(app_module.Config.SCHOOLS)
+
+    revalidated = c.get('/schools', headers={'If-None-Match': response.headers['ETag']})
+    assert revalidated.status_code == 304
+
+
+def test_chat_history_compressed(tmp_path, monkeypatch):
+    """测试 /chat-history 大响应被压缩，历史变化后 ETag 失效"""
+    history_path = tmp_path / 'chat_history.json'
+    chats = [{'sessionId': str(i), 'title': 'Chat', 'messages': [{'role': 'user', 'content': 'x' * 200}]}
+             for i in range(20)]
+    history_path.write_text(json.dumps(chats), encoding='utf-8')
+    monkeypatch.setattr(app_module, 'CHAT_HISTORY_PATH', str(history_path))
+
+    c = client()
+    response = c.get('/chat-history', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.data))['chats'] == chats
+    etag = response.headers['ETag']
+    assert c.get('/chat-history', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code == 304
+
+    history_path.write_text(json.dumps(chats[1:]), encoding='utf-8')
+    changed = c.get('/chat-history', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert changed.status_code == 200
+
+
+def test_small_responses_not_compressed():
+    """测试低于阈值的响应不压缩"""
+    response = client().get('/router-stats', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
@@ -0,0 +1,125 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import http_transport
+from config import Config
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """本地 HTTP 替身：记录连接来源端口，按路径返回不同状态码"""
+    protocol_version = 'HTTP/1.1'
+    client_ports = set()
+    failures_left = {}
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        StandInHandler.client_ports.add(self.client_address[1])
+
+        remaining = StandInHandler.failures_left.get(self.path, 0)
+        if remaining > 0:
+            StandInHandler.failures_left[self.path] = remaining - 1
+            self._reply(503, {'message': 'busy'})
+        else:
+            self._reply(200, {'ok': True})
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stand_in():
+    """启动本地替身服务，返回 (server, base_url)"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def test_connections_are_reused():
+    """测试连续请求复用同一条 keep-alive 连接"""
+    server, base_url = start_stand_in()
+    StandInHandler.client_ports.clear()
+    session = http_transport.PooledSession()
+    try:
+        for _ in range(5):
+            response = session.post(f'{base_url}/api/v1/services/aigc/text-generation/generation', json={})
+            assert response.status_code == 200
+        print(f"连接数: {len(StandInHandler.client_ports)}")
+        assert len(StandInHandler.client_ports) == 1
+
+        host_stats = session.stats()[f'127.0.0.1:{server.server_address[1]}']
+        assert host_stats['connections_opened'] == 1
+        assert host_stats['requests'] == 5
+    finally:
+        session.shutdown()
+        server.shutdown()
+
+
+def test_idempotent_call_is_retried():
+    """测试嵌入接口遇到 503 时自动重试"""
+    server, base_url = start_stand_in()
+    path = '/api/v1/services/embeddings/text-embedding/text-embedding'
+    StandInHandler.failures_left[path] = 1
+    session = http_transport.PooledSession()
+    try:
+        response = session.post(f'{base_url}{path}', json={})
+        assert response.status_code == 200
+        host_stats = session.stats()[f'127.0.0.1:{server.server_address[1]}']
+        assert host_stats['retries'] == 1
+    finally:
+        session.shutdown()
+        server.shutdown()
+
+
+def test_generation_is_not_retried():
+    """测试生成接口（非幂等）不重试，直接返回 503"""
+    server, base_url = start_stand_in()
+    path = '/api/v1/services/aigc/text-generation/generation'
+    StandInHandler.failures_left[path] = 1
+    session = http_transport.PooledSession()
+    try:
+        response = session.post(f'{base_url}{path}', json={})
+        assert response.status_code == 503
+        host_stats = session.stats()[f'127.0.0.1:{server.server_address[1]}']
+        assert host_stats['retries'] == 0
+    finally:
+        StandInHandler.failures_left.pop(path, None)
+        session.shutdown()
+        server.shutdown()
+
+
+def test_retry_budget_limits_retries():
+    """测试重试预算耗尽后不再重试"""
+    budget = http_transport.RetryBudget(ratio=0.0, min_per_second=0.1, window=10.0)
+    assert budget.try_spend()
+    assert not budget.try_spend()
+
+
+def test_dashscope_sdk_uses_shared_session():
+    """测试 DashScope SDK 内部创建的 Session 即共享连接池"""
+    assert http_transport.install_dashscope_transport()
+    from dashscope.api_entities import http_request
+    with http_request.requests.Session() as session:
+        assert session is http_transport.session
+    # 上下文退出后连接池仍然可用
+    assert http_transport.session.adapters
+
+
+if __name__ == "__main__":
+    print("=== 测试共享 HTTP 传输层 ===\n")
+    print(f"超时配置: connect={Config.HTTP_CONNECT_TIMEOUT}s read={Config.HTTP_READ_TIMEOUT}s")
+
+    test_connections_are_reused()
+    test_idempotent_call_is_retried()
+    test_generation_is_not_retried()
+    test_retry_budget_limits_retries()
+    test_dashscope_sdk_uses_shared_session()
+    print("全部通过")
@@ -0,0 +1,87 @@
+import gc
+import tracemalloc
+from types import SimpleNamespace
+
+import pytest
+
+import app as app_module
+import rag_service
+from config import Config
+
+MB = 1024 * 1024
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    """每个测试使用空的索引缓存和统计"""
+    def clear():
+        rag_service._index_cache.clear()
+        rag_service._index_sizes.clear()
+        rag_service._index_last_used.clear()
+        rag_service._evicted_schools.clear()
+        for key in rag_service._index_cache_stats:
+            rag_service._index_cache_stats[key] = 0
+    clear()
+    yield
+    clear()
+
+
+def fake_load(school_id, size_mb):
+    """模拟一次索引加载（不读取磁盘）"""
+    rag_service._cache_index(school_id, SimpleNamespace(school_id=school_id), size_mb * MB)
+
+
+def test_lru_eviction_respects_budget_and_pins(monkeypatch):
+    """测试超出内存预算时按最近最少使用淘汰，固定学校不被淘汰，重新加载被计数"""
+    monkeypatch.setattr(Config, 'RAG_INDEX_CACHE_MAX_MB', 10)
+    monkeypatch.setattr(Config, 'RAG_INDEX_CACHE_PINNED', ('UCLA',))
+
+    fake_load('UCLA', 4)
+    fake_load('UCI', 3)
+    fake_load('UCSD', 3)
+    assert list(rag_service._index_cache) == ['UCLA', 'UCI', 'UCSD']
+
+    rag_service._index_cache.move_to_end('UCI')     # UCI 最近被访问
+    fake_load('NYU', 2)                             # 超出预算：淘汰最久未用的非固定学校 UCSD
+    assert list(rag_service._index_cache) == ['UCLA', 'UCI', 'NYU']
+
+    fake_load('UCSD', 3)                            # 再次加载 UCSD：淘汰 UCI
+    stats = rag_service.get_index_cache_stats()
+    print(f"索引缓存统计: {stats}")
+    assert [school['school_id'] for school in stats['schools']] == ['UCLA', 'NYU', 'UCSD']
+    assert stats['used_bytes'] == 9 * MB
+    assert stats['loads'] == 5
+    assert stats['evictions'] == 2
+    assert stats['reloads'] == 1
+    assert stats['schools'][0]['pinned'] is True
+
+
+def test_load_index_hits_and_endpoint(monkeypatch):
+    """测试已缓存的索引直接命中，并可从诊断端点查看"""
+    index = rag_service.load_index('UCSD')
+    assert index is not None
+    assert rag_service.load_index('UCSD') is index
+
+    stats = app_module.app.test_client().get('/index-cache-stats').get_json()
+    assert stats['loaded'] == 1
+    assert stats['hits'] == 1
+    assert stats['loads'] == 1
+    assert stats['schools'][0]['school_id'] == 'UCSD'
+    assert stats['schools'][0]['bytes'] > 0
+
+
+def test_estimate_matches_allocated_memory():
+    """测试索引内存估算与实际分配的内存相差不大"""
+    rag_service._load_dependencies()
+    rag_service.load_index('UW')            # 预热首次加载才触发的导入
+    rag_service._index_cache.clear()
+
+    gc.collect()
+    tracemalloc.start()
+    index = rag_service.load_index('UCB')
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    estimate = rag_service.estimate_index_bytes(index)
+    print(f"估算 {estimate / MB:.2f} MB，实际分配 {allocated / MB:.2f} MB")
+    assert 0.7 * allocated < estimate < 1.3 * allocated
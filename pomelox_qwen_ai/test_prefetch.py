@@ -0,0 +1,147 @@
+import time
+from concurrent.futures import Future
+
+import pytest
+
+import app as app_module
+import prefetch
+from config import Config
+from upstream import UpstreamScheduler
+
+DRAFT = 'When is the housing application deadline'
+SCHOOL_CANDIDATES = ['dense candidate 1', 'dense candidate 2']
+
+
+class FakeEmbedModel:
+    """记录被嵌入的文本，代替 DashScope"""
+
+    def __init__(self):
+        self.embedded = []
+
+    def get_query_embedding(self, text):
+        self.embedded.append(text)
+        return [float(len(text))] * 4
+
+
+class DeferredScheduler:
+    """submit() 只记录调用，run() 时才执行，用于观察嵌入开始前的状态"""
+
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, fn):
+        future = Future()
+        self.calls.append((fn, future))
+        return future
+
+    def run(self):
+        for fn, future in self.calls:
+            future.set_result(fn())
+
+
+def wait_for_prefetches():
+    deadline = time.monotonic() + 2
+    while prefetch.get_prefetch_stats()['in_flight_now']:
+        assert time.monotonic() < deadline, 'prefetch did not finish'
+        time.sleep(0.005)
+
+
+@pytest.fixture(autouse=True)
+def fake_backend(monkeypatch):
+    """预取不访问磁盘和 DashScope；每个测试使用空的预取状态"""
+    embed_model = FakeEmbedModel()
+    monkeypatch.setattr(prefetch, 'get_embed_model', lambda: embed_model)
+    monkeypatch.setattr(prefetch, 'is_index_loaded', lambda school_id: True)
+    monkeypatch.setattr(prefetch, 'search_candidates', lambda school_id, query, embedding: list(SCHOOL_CANDIDATES))
+    monkeypatch.setattr(app_module, 'has_faq_answers', lambda school_id: False)
+    monkeypatch.setattr(app_module, 'call_ai_with_web_search', lambda *args, **kwargs: ('Answer', None))
+    prefetch.reset_prefetch_state()
+    yield embed_model
+    prefetch.reset_prefetch_state()
+
+
+def test_ask_reuses_prefetched_draft(monkeypatch, fake_backend):
+    """测试最终问题与草稿相同时复用嵌入和候选集，稍作补充时只把草稿的候选集交给重排序"""
+    monkeypatch.setattr(Config, 'PREFETCH_MIN_INTERVAL', 0)
+    retrieved = []
+
+    def tracking_retrieve(school_id, question, query_embedding=None, candidates=None, rerank_all=False):
+        retrieved.append((query_embedding, candidates, rerank_all))
+        return '[Reference 1]\nHousing applications close on May 1.', 0.8, True
+
+    monkeypatch.setattr(app_module, 'retrieve', tracking_retrieve)
+    client = app_module.app.test_client()
+
+    response = client.post('/prefetch', json={'school_id': 'UCLA', 'session_id': 's1', 'draft': DRAFT + '  '})
+    assert response.status_code == 202
+    assert response.get_json() == {'status': prefetch.ACCEPTED}
+    wait_for_prefetches()
+    assert client.post('/prefetch', json={'school_id': 'UCLA', 'session_id': 's2', 'draft': DRAFT}) \
+        .get_json() == {'status': prefetch.CACHED}
+    assert fake_backend.embedded == [DRAFT]
+
+    client.post('/ask', json={'school_id': 'UCLA', 'session_id': 's1', 'question': DRAFT})
+    client.post('/ask', json={'school_id': 'UCLA', 'session_id': 's2', 'question': DRAFT + ' for fall?'})
+    client.post('/ask', json={'school_id': 'UCLA', 'session_id': 's3',
+                              'question': DRAFT + ' if I transfer from a community college in spring?'})
+    client.post('/ask', json={'school_id': 'UCI', 'session_id': 's4', 'question': DRAFT})
+    assert retrieved == [
+        ([float(len(DRAFT))] * 4, SCHOOL_CANDIDATES, False),    # 与草稿相同
+        (None, SCHOOL_CANDIDATES, True),                        # 扩展了草稿：重新嵌入，全部候选用问题重排序
+        (None, None, False),                                    # 扩展太多
+        (None, None, False),                                    # 其他学校
+    ]
+
+    stats = client.get('/prefetch-stats').get_json()
+    print(f"预取统计: {stats}")
+    assert stats['reused_exact'] == 1
+    assert stats['reused_extension'] == 1
+    assert stats['not_reused'] == 2
+    assert stats['reuse_rate'] == 0.5
+
+
+def test_rate_limits_and_cancellation(monkeypatch, fake_backend):
+    """测试会话限流、上游繁忙、索引未加载与闲聊时不预取，提交问题后取消尚未嵌入的预取"""
+    client = app_module.app.test_client()
+
+    assert client.post('/prefetch', json={'school_id': 'UCLA', 'session_id': 's1', 'draft': 'hello there'}) \
+        .get_json() == {'status': prefetch.SKIPPED}
+    assert client.post('/prefetch', json={'school_id': 'UCLA', 'session_id': 's1', 'draft': DRAFT}) \
+        .get_json() == {'status': prefetch.ACCEPTED}
+    response = client.post('/prefetch', json={'school_id': 'UCLA', 'session_id': 's1', 'draft': DRAFT + ' for fall'})
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+    wait_for_prefetches()
+
+    # 冷索引留给 /ask 加载
+    with monkeypatch.context() as cold:
+        cold.setattr(prefetch, 'is_index_loaded', lambda school_id: False)
+        assert prefetch.prefetch('s2', 'UCI', DRAFT) == prefetch.SKIPPED
+
+    # 上游名额占满时立即返回，不排队等待
+    busy = UpstreamScheduler(max_concurrency=1, max_queue=4, queue_timeout=5)
+    blocked = busy.submit(time.sleep, 0.2)
+    monkeypatch.setattr(prefetch, 'scheduler', busy)
+    start = time.monotonic()
+    assert prefetch.prefetch('s2', 'UCLA', DRAFT + ' for fall') == prefetch.BUSY
+    assert time.monotonic() - start < 0.1
+    blocked.result()
+
+    # 嵌入开始前该会话提交了问题：不再调用嵌入
+    deferred = DeferredScheduler()
+    monkeypatch.setattr(prefetch, 'scheduler', deferred)
+    assert prefetch.prefetch('s3', 'UCLA', DRAFT + ' for fall') == prefetch.ACCEPTED
+    assert prefetch.prefetch('s4', 'UCLA', DRAFT + ' for fall') == prefetch.IN_FLIGHT
+    prefetch.cancel('s3')
+    deferred.run()
+    assert fake_backend.embedded == [DRAFT]
+    assert prefetch.find('UCLA', DRAFT + ' for fall') is not None    # 使用的是已缓存的 DRAFT 候选集
+
+    stats = prefetch.get_prefetch_stats()
+    print(f"预取统计: {stats}")
+    assert stats[prefetch.ACCEPTED] == 2
+    assert stats[prefetch.PREFETCHED] == 1
+    assert stats[prefetch.RATE_LIMITED] == 1
+    assert stats[prefetch.BUSY] == 1
+    assert stats[prefetch.CANCELLED] == 1
+    assert stats['in_flight_now'] == 0
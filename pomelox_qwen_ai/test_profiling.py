@@ -0,0 +1,106 @@
+import os
+import pstats
+import time
+
+from flask import Flask, jsonify
+
+import profiling
+from config import Config
+from upstream import scheduler
+
+TOKEN = 'test-admin-token'
+
+
+def busy_upstream_work(seconds):
+    """模拟在上游执行线程中运行的检索逻辑"""
+    deadline = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < deadline:
+        total += sum(range(1000))
+    return total
+
+
+def make_app():
+    """独立的测试应用：接口通过调度器在执行线程中运行"""
+    app = Flask(__name__)
+    profiling.init_app(app)
+
+    @app.route('/ask')
+    def ask():
+        return jsonify({'total': scheduler.call(busy_upstream_work, 0.2)})
+
+    @app.route('/admin/status')
+    @profiling.admin_required
+    def status():
+        return jsonify(profiling.get_profiling_stats())
+
+    return app
+
+
+def setup_config(monkeypatch, tmp_path):
+    monkeypatch.setattr(Config, 'ADMIN_TOKEN', TOKEN)
+    monkeypatch.setattr(Config, 'PROFILE_OUTPUT_DIR', str(tmp_path))
+
+
+def test_admin_gate(monkeypatch, tmp_path):
+    """测试未配置或令牌错误时管理接口返回 403，且不能通过请求头触发分析"""
+    monkeypatch.setattr(Config, 'ADMIN_TOKEN', None)
+    c = make_app().test_client()
+    assert c.get('/admin/status').status_code == 403
+
+    setup_config(monkeypatch, tmp_path)
+    assert c.get('/admin/status', headers={'X-Admin-Token': 'wrong'}).status_code == 403
+    assert c.get('/admin/status', headers={'X-Admin-Token': TOKEN}).status_code == 200
+
+    response = c.get('/ask', headers={'X-Profile': 'cprofile', 'X-Admin-Token': 'wrong'})
+    assert 'X-Profile-Id' not in response.headers
+
+
+def test_armed_cprofile_covers_executor_thread(monkeypatch, tmp_path):
+    """测试预约的下 N 个请求生成 pstats，并包含执行线程中的调用"""
+    setup_config(monkeypatch, tmp_path)
+    profiling.arming.arm(1, profiling.MODE_CPROFILE, '/ask')
+    c = make_app().test_client()
+
+    first = c.get('/ask')
+    second = c.get('/ask')
+    assert 'X-Profile-Id' not in second.headers
+
+    name = first.headers['X-Profile-Id']
+    stats = pstats.Stats(os.path.join(str(tmp_path), name))
+    functions = {func[2] for func in stats.stats}
+    assert 'busy_upstream_work' in functions
+    print(f"pstats 文件: {name}, {len(functions)} 个函数")
+
+
+def test_header_triggered_sampling(monkeypatch, tmp_path):
+    """测试携带请求头的请求生成折叠栈文件"""
+    setup_config(monkeypatch, tmp_path)
+    c = make_app().test_client()
+    response = c.get('/ask', headers={'X-Profile': 'sample', 'X-Admin-Token': TOKEN})
+
+    name = response.headers['X-Profile-Id']
+    assert name.endswith('.collapsed')
+    with open(os.path.join(str(tmp_path), name), 'r', encoding='utf-8') as f:
+        lines = f.read().splitlines()
+    assert lines
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0
+    assert any('busy_upstream_work' in line for line in lines)
+
+
+def test_always_on_sampler(monkeypatch, tmp_path):
+    """测试常驻采样器只采样忙碌线程，并报告开销"""
+    setup_config(monkeypatch, tmp_path)
+    c = make_app().test_client()
+    profiling.sampler.reset()
+    profiling.sampler.set_enabled(True)
+    try:
+        c.get('/ask')
+    finally:
+        profiling.sampler.set_enabled(False)
+
+    stats = profiling.sampler.stats()
+    print(f"采样器: {stats}")
+    assert stats['samples'] > 0
+    assert 'busy_upstream_work' in profiling.sampler.collapsed()
@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+
+import app as app_module
+import prompt_cache
+from chunking import count_tokens
+from config import Config
+from rag_service import get_prompt_prefix, get_system_prompt, PROMPT_LAYOUT_CACHE_FRIENDLY, PROMPT_LAYOUT_LEGACY
+
+
+def test_prompts_share_a_stable_prefix():
+    """测试缓存友好布局下同一学校所有模式的提示词以相同前缀开头，检索内容在其后"""
+    prefix = get_prompt_prefix('UCLA')
+    prompts = [
+        get_system_prompt('UCLA', '[Reference 1]\nHousing applications close on May 1.'),
+        get_system_prompt('UCLA', '[Reference 1]\nThe Bruin Bus runs every 10 minutes.'),
+        get_system_prompt('UCLA', '', use_web_search=True),
+        get_system_prompt('UCLA', ''),
+    ]
+    for prompt in prompts:
+        assert prompt.startswith(prefix)
+    assert prompts[0].index('Housing applications') > len(prefix)
+
+    legacy = get_system_prompt('UCLA', '[Reference 1]\nHousing applications close on May 1.', layout=PROMPT_LAYOUT_LEGACY)
+    assert legacy.index('Housing applications') < legacy.index('Response requirements')
+
+
+def test_prefix_is_long_enough_to_cache():
+    """测试每个学校的固定前缀达到 DashScope 缓存的最小 token 数"""
+    for school_id in Config.SCHOOLS:
+        tokens = count_tokens(get_prompt_prefix(school_id))
+        assert tokens >= prompt_cache.PROVIDER_CACHE_MIN_TOKENS, f'{school_id}: {tokens}'
+
+
+def test_mode_instructions_follow_the_prefix():
+    """测试联网搜索与参考资料的要求只出现在前缀之后的对应模式中，原布局不变"""
+    prefix = get_prompt_prefix('UCLA')
+    assert 'web search' not in prefix.lower() and 'reference' not in prefix.lower()
+
+    rag = get_system_prompt('UCLA', '[Reference 1]\nHousing applications close on May 1.')
+    web = get_system_prompt('UCLA', '', use_web_search=True)
+    direct = get_system_prompt('UCLA', '')
+    assert 'source references' in web and 'source references' not in rag + direct
+    assert 'Prioritize using information from the reference materials' in rag
+    assert 'reference materials don\'t contain' not in web + direct
+
+    legacy = get_system_prompt('UCLA', '[Reference 1]\nx', layout=PROMPT_LAYOUT_LEGACY)
+    assert legacy.endswith('5. When searching the web, prefer English language sources and results')
+
+
+def test_ab_assignment_is_sticky_per_session(monkeypatch):
+    """测试 A/B 模式下同一会话始终使用同一布局，且按比例分流"""
+    monkeypatch.setattr(Config, 'PROMPT_LAYOUT', 'ab')
+    monkeypatch.setattr(Config, 'PROMPT_AB_SPLIT', 0.5)
+    layouts = [prompt_cache.choose_layout(f'session-{i}') for i in range(2000)]
+    assert layouts == [prompt_cache.choose_layout(f'session-{i}') for i in range(2000)]
+    share = layouts.count(PROMPT_LAYOUT_CACHE_FRIENDLY) / len(layouts)
+    print(f"缓存友好布局占比: {share:.3f}")
+    assert 0.45 < share < 0.55
+
+    monkeypatch.setattr(Config, 'PROMPT_LAYOUT', PROMPT_LAYOUT_LEGACY)
+    assert prompt_cache.choose_layout('session-1') == PROMPT_LAYOUT_LEGACY
+
+
+def test_ask_records_cached_tokens(monkeypatch):
+    """测试 /ask 记录响应中的缓存命中 token，并按布局汇总"""
+    sent_prompts = []
+
+    def fake_generation_call(model, messages, result_format, **kwargs):
+        sent_prompts.append(messages[0]['content'])
+        cached = 0 if len(sent_prompts) == 1 else 300
+        return SimpleNamespace(
+            status_code=200,
+            output=SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='Answer'))]),
+            usage={'input_tokens': 500, 'output_tokens': 50, 'prompt_tokens_details': {'cached_tokens': cached}},
+        )
+
+    monkeypatch.setattr(Config, 'PROMPT_LAYOUT', PROMPT_LAYOUT_CACHE_FRIENDLY)
+    monkeypatch.setattr(app_module, 'load_dashscope',
+                        lambda: SimpleNamespace(Generation=SimpleNamespace(call=fake_generation_call)))
+    monkeypatch.setattr(app_module, 'retrieve',
+                        lambda *args, **kwargs: ('[Reference 1]\nHousing applications close on May 1.', 0.8, True))
+    monkeypatch.setattr(app_module, 'has_faq_answers', lambda school_id: False)
+    prompt_cache.reset_prompt_cache_stats()
+
+    client = app_module.app.test_client()
+    for question in ('When is the housing deadline?', 'How do I apply for housing?'):
+        response = client.post('/ask', json={'school_id': 'UCLA', 'question': question})
+        assert response.status_code == 200
+    assert all(prompt.startswith(get_prompt_prefix('UCLA')) for prompt in sent_prompts)
+
+    stats = client.get('/prompt-cache-stats').get_json()
+    print(f"提示词缓存统计: {stats}")
+    layout_stats = stats['layouts'][PROMPT_LAYOUT_CACHE_FRIENDLY]
+    assert layout_stats['requests'] == 2
+    assert layout_stats['cache_hit_requests'] == 1
+    assert layout_stats['cached_token_ratio'] == 0.3
+    assert layout_stats['billed_input_token_ratio'] == 0.82
+    assert stats['layouts'][PROMPT_LAYOUT_LEGACY]['requests'] == 0
@@ -0,0 +1,81 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from compact_docstore import ReadOnlyStoreError
+from quantized_vectors import (
+    QuantizedVectorStore, quantize_store, check_recall, load_quantized_vector_store, remove_quantized_store,
+    LEGACY_VECTOR_FILE, QUANTIZATION_MODES,
+)
+
+
+@pytest.fixture
+def store_dir(tmp_path):
+    """写入 500 个随机向量的向量库并生成量化文件"""
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(500, 64)).astype(np.float32)
+    embedding_dict = {f'node-{i}': vector.tolist() for i, vector in enumerate(vectors)}
+    with open(tmp_path / LEGACY_VECTOR_FILE, 'w', encoding='utf-8') as f:
+        json.dump({'embedding_dict': embedding_dict}, f)
+    report = quantize_store(str(tmp_path))
+    assert report['vectors'] == 500
+    assert report['int8_bytes'] < report['float16_bytes'] < report['float32_bytes']
+    return str(tmp_path)
+
+
+def exact_search(store_dir, query, k):
+    """全精度精确检索，返回 (行号, 余弦相似度)"""
+    full = np.load(os.path.join(store_dir, 'vectors.f32.npy'))
+    scores = full @ (query / np.linalg.norm(query))
+    rows = np.argsort(-scores)[:k]
+    return rows, scores[rows]
+
+
+@pytest.mark.parametrize('mode', QUANTIZATION_MODES)
+def test_rescored_top_k_matches_exact_search(store_dir, mode):
+    """测试首轮量化检索加全精度重排后的 top-k 与精确检索一致，分数为精确余弦相似度"""
+    store = QuantizedVectorStore(store_dir, mode=mode, rescore_factor=4)
+    rng = np.random.default_rng(1)
+    for _ in range(20):
+        query = rng.normal(size=64).astype(np.float32)
+        expected_rows, expected_scores = exact_search(store_dir, query, 10)
+        rows, scores = store.search(query / np.linalg.norm(query), 10)
+        assert rows.tolist() == expected_rows.tolist()
+        assert np.allclose(scores, expected_scores, atol=1e-5)
+
+    recall = check_recall(store_dir, mode, k=10, num_queries=50)
+    print(f"{mode} 召回: {recall}")
+    assert recall['recall_rescored'] >= recall['recall_first_pass']
+    assert recall['recall_rescored'] >= 0.98
+
+
+def test_query_restricted_to_node_ids(store_dir):
+    """测试按节点 ID 限定检索范围，结果按精确分数排序"""
+    store = QuantizedVectorStore(store_dir, mode='int8')
+    query = np.random.default_rng(2).normal(size=64).astype(np.float32)
+    allowed = [f'node-{i}' for i in range(0, 500, 50)]
+    result = store.query(VectorStoreQuery(query_embedding=query.tolist(), similarity_top_k=3, node_ids=allowed))
+    assert set(result.ids) <= set(allowed)
+    assert len(result.ids) == 3
+    assert result.similarities == sorted(result.similarities, reverse=True)
+
+
+def test_quantized_store_is_read_only(store_dir):
+    """测试量化向量库添加或删除节点时抛出 ReadOnlyStoreError"""
+    store = QuantizedVectorStore(store_dir, mode='int8')
+    with pytest.raises(ReadOnlyStoreError):
+        store.add([])
+    with pytest.raises(ReadOnlyStoreError):
+        store.delete('node-0')
+    assert len(store.query(VectorStoreQuery(query_embedding=[1.0] * 64, similarity_top_k=500)).ids) == 500
+
+
+def test_removed_store_is_not_loaded(store_dir):
+    """测试重建前删除量化文件后不会加载上次构建的节点 ID"""
+    assert load_quantized_vector_store(store_dir, mode='int8') is not None
+    remove_quantized_store(store_dir)
+    assert load_quantized_vector_store(store_dir, mode='int8') is None
+    assert os.listdir(store_dir) == [LEGACY_VECTOR_FILE]
@@ -0,0 +1,55 @@
+import pytest
+
+import query_router
+from config import Config
+from query_router import classify, route_query, ROUTE_DIRECT, ROUTE_RAG, ROUTE_WEB_SEARCH
+
+
+@pytest.mark.parametrize('question, expected', [
+    ('hello!', (ROUTE_DIRECT, 'small_talk')),
+    ('Thank you so much', (ROUTE_DIRECT, 'small_talk')),
+    ('谢谢', (ROUTE_DIRECT, 'small_talk')),
+    ('When is the UCLA housing deadline?', (ROUTE_RAG, 'school_topic')),
+    ('Is the weather at UCLA nice today?', (ROUTE_RAG, 'school_topic')),   # 学校话题优先于时效性
+    ('What is the weather today?', (ROUTE_WEB_SEARCH, 'time_sensitive')),
+    ("What is the dollar's exchange rate right now?", (ROUTE_WEB_SEARCH, 'time_sensitive')),
+    ('What is the capital of France', (ROUTE_DIRECT, 'centroid')),
+    ('Who won the game last night', (ROUTE_RAG, 'default')),
+])
+def test_each_rule(question, expected):
+    """测试每条规则及其优先顺序"""
+    assert classify(question, 'UCLA') == expected
+
+
+@pytest.mark.parametrize('question', [
+    'What is the minimum TOEFL score?',
+    'What is the SAT score needed?',
+    "What's the latest date to drop a class?",
+    'Is there a news channel for international students?',
+    'Are IELTS results accepted for the fall semester?',
+    'I am currently on the waitlist, what should I do?',
+    '托福成绩要求是多少？',
+])
+def test_school_questions_are_not_sent_to_web_search(question):
+    """测试包含 score / latest / news 等词的学校问题走知识库检索"""
+    assert classify(question, 'UCLA') == (ROUTE_RAG, 'school_topic')
+
+
+def test_centroid_requires_margin(monkeypatch):
+    """测试质心分类不够确定时回到默认的知识库检索"""
+    assert classify('What is the capital of France', 'UCLA') == (ROUTE_DIRECT, 'centroid')
+    monkeypatch.setattr(Config, 'QUERY_ROUTER_MIN_MARGIN', 2.0)
+    assert classify('What is the capital of France', 'UCLA') == (ROUTE_RAG, 'default')
+
+
+def test_route_query_downgrades_web_search(monkeypatch):
+    """测试关闭联网搜索时时效性问题改走知识库，关闭路由时全部走知识库，并计入统计"""
+    before = query_router.get_router_stats()['by_reason'].get('web_search_disabled', 0)
+    assert route_query('What is the weather today?', 'UCLA') == ROUTE_WEB_SEARCH
+
+    monkeypatch.setattr(Config, 'ENABLE_WEB_SEARCH_FALLBACK', False)
+    assert route_query('What is the weather today?', 'UCLA') == ROUTE_RAG
+    assert query_router.get_router_stats()['by_reason']['web_search_disabled'] == before + 1
+
+    monkeypatch.setattr(Config, 'QUERY_ROUTER_ENABLED', False)
+    assert route_query('hello!', 'UCLA') == ROUTE_RAG
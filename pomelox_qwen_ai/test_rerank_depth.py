@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import pytest
+from llama_index.core.schema import NodeWithScore, TextNode
+
+import rag_service
+from config import Config
+from rag_service import choose_rerank_depth
+
+
+@pytest.mark.parametrize('scores, store_size, expected', [
+    ([0.9, 0.5, 0.4], 4, (4, False, 'small_store')),
+    ([0.75, 0.6, 0.5] + [0.3] * 37, 300, (0, True, 'confident')),
+    ([0.55, 0.4, 0.3] + [0.2] * 37, 300, (Config.RAG_CANDIDATE_MIN_TOP_K, False, 'clear_margin')),
+    ([0.7, 0.69, 0.6] + [0.5] * 37, 300, (Config.RAG_CANDIDATE_MAX_TOP_K, False, 'ambiguous')),
+    ([0.7, 0.65, 0.6] + [0.5] * 37, 300, (Config.RAG_CANDIDATE_TOP_K, False, 'default')),
+    ([0.7, 0.69, 0.6], 300, (3, False, 'ambiguous')),          # 深度不超过候选数
+])
+def test_choose_rerank_depth(scores, store_size, expected):
+    """测试各分支的重排序深度"""
+    assert choose_rerank_depth(scores, 5, store_size) == expected
+
+
+def test_skipped_rerank_applies_thresholds(monkeypatch):
+    """测试跳过重排序时同样按相似度阈值筛选分块，并按高质量阈值判断是否联网搜索"""
+    nodes = [NodeWithScore(node=TextNode(text=f'chunk {i}'), score=score)
+             for i, score in enumerate([0.75, 0.6, 0.3, 0.1])]
+    index = SimpleNamespace(index_struct=SimpleNamespace(nodes_dict=dict.fromkeys(range(300))))
+    monkeypatch.setattr(rag_service, 'load_index', lambda school_id: index)
+    monkeypatch.setattr(Config, 'RAG_SIMILARITY_THRESHOLD', 0.5)
+
+    content, max_score, has_high_quality = rag_service.retrieve('UCLA', 'question', candidates=nodes)
+    assert content == '[Reference 1]\nchunk 0\n\n[Reference 2]\nchunk 1'
+    assert max_score == 0.75
+    assert has_high_quality
+
+    monkeypatch.setattr(Config, 'RAG_HIGH_QUALITY_THRESHOLD', 0.8)
+    _, _, has_high_quality = rag_service.retrieve('UCLA', 'question', candidates=nodes)
+    assert not has_high_quality
+
+
+def test_draft_candidates_are_always_reranked(monkeypatch):
+    """测试预取草稿的候选集即使向量分数足够确定也全部用实际问题重排序"""
+    reranked = []
+
+    class FakeRerank:
+        def __init__(self, top_n, return_documents):
+            self.top_n = top_n
+
+        def postprocess_nodes(self, nodes, query_str):
+            reranked.append((len(nodes), query_str))
+            return [NodeWithScore(node=node.node, score=0.9 - 0.1 * i) for i, node in enumerate(reversed(nodes))][:self.top_n]
+
+    nodes = [NodeWithScore(node=TextNode(text=f'chunk {i}'), score=score)
+             for i, score in enumerate([0.75, 0.6, 0.3, 0.1])]
+    index = SimpleNamespace(index_struct=SimpleNamespace(nodes_dict=dict.fromkeys(range(300))))
+    monkeypatch.setattr(rag_service, 'load_index', lambda school_id: index)
+    monkeypatch.setattr(rag_service, '_load_dependencies', lambda: SimpleNamespace(DashScopeRerank=FakeRerank))
+
+    content, max_score, _ = rag_service.retrieve('UCLA', 'draft for fall?', candidates=nodes, rerank_all=True)
+    assert reranked == [(4, 'draft for fall?')]
+    assert content.startswith('[Reference 1]\nchunk 3')
+    assert max_score == 0.9
@@ -0,0 +1,74 @@
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+# 生产服务模式测试：以 gunicorn 预派生模式启动（仅 Linux / macOS）
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def get_json(port, path):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    conn.request('GET', path)
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def start_server(port, workers=2):
+    """启动 gunicorn，等待 /health 可用"""
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+         '-b', f'127.0.0.1:{port}', '-w', str(workers), 'wsgi:application'],
+        cwd=PROJECT_DIR, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+    )
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        try:
+            status, _ = get_json(port, '/health')
+            if status == 200:
+                return process
+        except OSError:
+            time.sleep(0.5)
+    process.kill()
+    raise RuntimeError('gunicorn 启动超时')
+
+
+def test_prefork_serving():
+    """测试预派生模式：索引只在主进程加载一次，各接口正常响应"""
+    if sys.platform == 'win32':
+        print("Windows 不支持 fork，跳过")
+        return
+    port = free_port()
+    process = start_server(port)
+    try:
+        for _ in range(20):
+            status, data = get_json(port, '/schools')
+            assert status == 200
+            assert 'schools' in data
+        status, data = get_json(port, '/health')
+        assert status == 200
+        assert data['status'] == 'healthy'
+    finally:
+        process.send_signal(signal.SIGTERM)
+        output, _ = process.communicate(timeout=60)
+
+    print(output)
+    # 知识库在 fork 之前由主进程加载，worker 不再重复加载
+    assert output.count('[Startup] Warmed up knowledge bases') == 1
+    assert output.count('Booting worker') == 2
+
+
+if __name__ == "__main__":
+    print("=== 测试生产服务模式 ===\n")
+    test_prefork_serving()
+    print("通过")
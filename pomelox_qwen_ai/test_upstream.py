@@ -0,0 +1,224 @@
+import contextvars
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from llama_index.core.schema import NodeWithScore, QueryBundle, TextNode
+
+import app as app_module
+import rag_service
+from upstream import (
+    UpstreamScheduler, UpstreamSaturated, UpstreamTimeout, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND,
+    scheduler as shared_scheduler,
+)
+
+request_tag = contextvars.ContextVar('request_tag', default=None)
+
+
+class Blocker:
+    """阻塞的上游调用替身：release() 之前不会返回"""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self._release = threading.Event()
+
+    def __call__(self, result='done'):
+        self.started.set()
+        self._release.wait(5)
+        return result
+
+    def release(self):
+        self._release.set()
+
+
+def in_thread(fn, *args, **kwargs):
+    """在后台线程中调用，返回 (线程, 结果列表)"""
+    results = []
+
+    def run():
+        try:
+            results.append(fn(*args, **kwargs))
+        except Exception as e:
+            results.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, results
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'condition not reached'
+        time.sleep(0.005)
+
+
+def test_full_queue_is_rejected_immediately():
+    """测试并发与等待队列都满时立即拒绝，并给出重试时间"""
+    scheduler = UpstreamScheduler(max_concurrency=1, max_queue=1, queue_timeout=5)
+    blocker = Blocker()
+    running, _ = in_thread(scheduler.call, blocker)
+    blocker.started.wait(2)
+    queued, queued_result = in_thread(scheduler.call, lambda: 'queued')
+    wait_until(lambda: scheduler.stats()['queued'] == 1)
+    assert scheduler.stats()['waiting_threads'] == 2
+
+    start = time.monotonic()
+    with pytest.raises(UpstreamSaturated) as error:
+        scheduler.call(lambda: 'rejected')
+    assert time.monotonic() - start < 0.5
+    assert error.value.retry_after >= 1
+
+    blocker.release()
+    running.join()
+    queued.join()
+    assert queued_result == ['queued']
+    stats = scheduler.stats()
+    assert (stats['admitted'], stats['rejected'], stats['active'], stats['waiting_threads']) == (2, 1, 0, 0)
+
+
+def test_queue_leaves_a_request_thread_free():
+    """测试并发数与队列之和不小于请求线程数时缩小队列，并发数本身占满线程时拒绝启动"""
+    assert UpstreamScheduler(max_concurrency=8, max_queue=16, queue_timeout=1, request_threads=32).max_queue == 16
+    assert UpstreamScheduler(max_concurrency=8, max_queue=16, queue_timeout=1, request_threads=12).max_queue == 3
+    with pytest.raises(ValueError):
+        UpstreamScheduler(max_concurrency=8, max_queue=16, queue_timeout=1, request_threads=8)
+
+
+def test_queue_wait_timeout():
+    """测试排队超过等待时限时放弃，不占用名额"""
+    scheduler = UpstreamScheduler(max_concurrency=1, max_queue=4, queue_timeout=0.1)
+    blocker = Blocker()
+    running, _ = in_thread(scheduler.call, blocker)
+    blocker.started.wait(2)
+
+    with pytest.raises(UpstreamSaturated, match='Timed out waiting'):
+        scheduler.call(lambda: 'late')
+    assert scheduler.stats()['queue_timeouts'] == 1
+    assert scheduler.stats()['queued'] == 0
+
+    blocker.release()
+    running.join()
+
+
+def test_timed_out_call_keeps_its_slot():
+    """测试超时的调用立即向调用方报错，但在真正返回前仍占用并发名额"""
+    scheduler = UpstreamScheduler(max_concurrency=1, max_queue=4, queue_timeout=0.1)
+    blocker = Blocker()
+
+    with pytest.raises(UpstreamTimeout):
+        scheduler.call(blocker, timeout=0.05)
+    stats = scheduler.stats()
+    assert (stats['call_timeouts'], stats['active'], stats['abandoned']) == (1, 1, 1)
+    with pytest.raises(UpstreamSaturated):
+        scheduler.call(lambda: 'blocked by the abandoned call')
+
+    blocker.release()
+    wait_until(lambda: scheduler.stats()['active'] == 0)
+    assert scheduler.stats()['abandoned'] == 0
+    assert scheduler.call(lambda: 'free again') == 'free again'
+
+
+def test_submit_never_waits():
+    """测试 submit 只使用空闲名额：名额占满或有排队时立即拒绝，不计入 rejected，完成后释放名额"""
+    scheduler = UpstreamScheduler(max_concurrency=1, max_queue=4, queue_timeout=5)
+    blocker = Blocker()
+    future = scheduler.submit(blocker, 'speculative')
+    blocker.started.wait(2)
+    with pytest.raises(UpstreamSaturated):
+        scheduler.submit(lambda: 'second')
+    assert scheduler.stats()['rejected'] == 0
+
+    blocker.release()
+    assert future.result(2) == 'speculative'
+    wait_until(lambda: scheduler.stats()['active'] == 0)
+    assert scheduler.submit(lambda: 'free again').result(2) == 'free again'
+
+
+def test_interactive_calls_are_served_first():
+    """测试名额释放后先执行交互优先级的调用，同优先级按到达顺序"""
+    scheduler = UpstreamScheduler(max_concurrency=1, max_queue=4, queue_timeout=5)
+    blocker = Blocker()
+    running, _ = in_thread(scheduler.call, blocker)
+    blocker.started.wait(2)
+
+    order = []
+    threads = []
+    for name, priority in (('background', PRIORITY_BACKGROUND), ('interactive-1', PRIORITY_INTERACTIVE),
+                           ('interactive-2', PRIORITY_INTERACTIVE)):
+        thread, _ = in_thread(scheduler.call, order.append, name, priority=priority)
+        threads.append(thread)
+        wait_until(lambda: scheduler.stats()['queued'] == len(threads))
+
+    blocker.release()
+    for thread in [running] + threads:
+        thread.join()
+    assert order == ['interactive-1', 'interactive-2', 'background']
+
+
+def test_call_runs_in_callers_context():
+    """测试调用在调用方的 contextvars 上下文中执行（请求级状态随调用传递）"""
+    scheduler = UpstreamScheduler(max_concurrency=2, max_queue=2, queue_timeout=1)
+    request_tag.set('request-42')
+    assert scheduler.call(request_tag.get) == 'request-42'
+    request_tag.set(None)
+
+
+def test_retrieve_schedules_only_upstream_calls(monkeypatch):
+    """测试检索只为问题嵌入与重排序占用上游名额，加载索引与本地检索不占用"""
+    active = {}
+
+    def load_index(school_id):
+        active['load_index'] = shared_scheduler.stats()['active']
+        return SimpleNamespace(index_struct=SimpleNamespace(nodes_dict=dict.fromkeys(range(300))),
+                               as_retriever=lambda similarity_top_k: retriever)
+
+    def embed(text):
+        active['embed'] = shared_scheduler.stats()['active']
+        return [1.0, 0.0]
+
+    class Retriever:
+        def retrieve(self, query_bundle):
+            active['dense_search'] = shared_scheduler.stats()['active']
+            return [NodeWithScore(node=TextNode(text=f'chunk {i}'), score=0.6 - 0.001 * i) for i in range(40)]
+
+    class Rerank:
+        def __init__(self, top_n, return_documents):
+            self.top_n = top_n
+
+        def postprocess_nodes(self, nodes, query_str):
+            active['rerank'] = shared_scheduler.stats()['active']
+            return nodes[:self.top_n]
+
+    retriever = Retriever()
+    monkeypatch.setattr(rag_service, 'load_index', load_index)
+    monkeypatch.setattr(rag_service, 'get_embed_model', lambda: SimpleNamespace(get_query_embedding=embed))
+    monkeypatch.setattr(rag_service, '_load_dependencies',
+                        lambda: SimpleNamespace(DashScopeRerank=Rerank, QueryBundle=QueryBundle))
+
+    content, _, _ = rag_service.retrieve('UCLA', 'When is the housing application deadline?')
+    assert content.startswith('[Reference 1]\nchunk 0')
+    assert active == {'load_index': 0, 'embed': 1, 'dense_search': 0, 'rerank': 1}
+
+
+@pytest.mark.parametrize('error, status', [
+    (UpstreamSaturated('Upstream model service is saturated', retry_after=7), 503),
+    (UpstreamTimeout('Upstream call exceeded 15s deadline'), 504),
+])
+def test_ask_maps_upstream_errors(monkeypatch, error, status):
+    """测试 /ask 将满载映射为带 Retry-After 的 503，将超时映射为 504"""
+    def failing_call(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(app_module, 'has_faq_answers', lambda school_id: False)
+    monkeypatch.setattr(rag_service, 'load_index', lambda school_id: SimpleNamespace(
+        index_struct=SimpleNamespace(nodes_dict=dict.fromkeys(range(300)))))
+    monkeypatch.setattr(app_module.scheduler, 'call', failing_call)
+    response = app_module.app.test_client().post(
+        '/ask', json={'school_id': 'UCLA', 'question': 'When is the housing application deadline?'})
+    assert response.status_code == status
+    if status == 503:
+        assert response.headers['Retry-After'] == '7'
+    else:
+        assert 'Retry-After' not in response.headers
@@ -0,0 +1,237 @@
+"""
+Upstream Scheduler Module
+Admission control and priority queueing for calls to DashScope, so a slow
+upstream cannot tie up every request thread of the service
+"""
+import contextvars
+import heapq
+import itertools
+import math
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from config import Config
+from event_log import log_event
+from profiling import profiled_thread
+
+# Call priorities (lower value is served first)
+PRIORITY_INTERACTIVE = 0   # User is waiting on the answer (/ask)
+PRIORITY_BACKGROUND = 10   # Warmup, prefetch, build-time work
+
+
+def _run_call(fn, args, kwargs):
+    """Executor-side wrapper: lets the profiler attribute the call to its request"""
+    with profiled_thread():
+        return fn(*args, **kwargs)
+
+
+class UpstreamSaturated(Exception):
+    """Raised when the wait queue is full or the queue wait deadline passed"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class UpstreamTimeout(Exception):
+    """Raised when an admitted upstream call exceeds its deadline"""
+
+
+class UpstreamScheduler:
+    """
+    Concurrency-limited scheduler with a bounded priority wait queue
+
+    At most `max_concurrency` upstream calls run at once. Up to `max_queue`
+    further calls wait in priority order; anything beyond that is rejected
+    immediately with a retry hint instead of blocking a request thread.
+    Every request thread inside call() (waiting for a slot or for its admitted
+    call) counts against that budget, so at most max_concurrency + max_queue
+    threads are ever blocked on the upstream. Given `request_threads`, the
+    queue is clamped so that at least one request thread always stays free.
+
+    A call that exceeds its deadline raises UpstreamTimeout in the caller, but
+    Python threads cannot be interrupted: the call keeps running, and keeps
+    its slot, until the underlying request returns (bounded by the HTTP read
+    timeout). Such calls are reported as `abandoned` in stats().
+    """
+
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float, request_threads: int = None):
+        if request_threads is not None:
+            spare = request_threads - max_concurrency - 1
+            if spare < 0:
+                raise ValueError(f'Upstream concurrency {max_concurrency} leaves none of the '
+                                 f'{request_threads} request threads free; lower UPSTREAM_MAX_CONCURRENCY')
+            if max_queue > spare:
+                log_event('upstream_queue_clamped', level='warning', max_queue=max_queue, clamped_to=spare,
+                          max_concurrency=max_concurrency, request_threads=request_threads)
+                max_queue = spare
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='upstream')
+        self._cond = threading.Condition()
+        self._waiters = []            # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._active = 0
+        self._callers = 0             # request threads inside call()
+        self._avg_call_seconds = None
+        self._abandoned = 0           # timed-out calls still holding a slot
+        self._counters = {'admitted': 0, 'rejected': 0, 'queue_timeouts': 0, 'call_timeouts': 0, 'failed': 0}
+
+    def _retry_after(self) -> int:
+        """Estimate seconds until a slot frees up (caller must hold the lock)"""
+        avg = self._avg_call_seconds or 1.0
+        waves = (len(self._waiters) + self._active) / self.max_concurrency
+        return max(1, math.ceil(avg * waves))
+
+    def _acquire(self, priority: int, wait_deadline: float):
+        """Wait for a free slot in priority order or raise UpstreamSaturated (caller is counted in _callers)"""
+        with self._cond:
+            if self._active < self.max_concurrency and not self._waiters:
+                self._active += 1
+                return
+
+            if len(self._waiters) >= self.max_queue or self._callers > self.max_concurrency + self.max_queue:
+                self._counters['rejected'] += 1
+                raise UpstreamSaturated('Upstream model service is saturated', self._retry_after())
+
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._waiters, entry)
+            try:
+                while not (self._waiters[0] == entry and self._active < self.max_concurrency):
+                    remaining = wait_deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._counters['queue_timeouts'] += 1
+                        raise UpstreamSaturated('Timed out waiting for upstream capacity', self._retry_after())
+                    self._cond.wait(remaining)
+                self._active += 1
+            finally:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+
+    def _release(self, elapsed: float):
+        """Free a slot once the underlying call has actually finished"""
+        with self._cond:
+            self._active -= 1
+            if self._avg_call_seconds is None:
+                self._avg_call_seconds = elapsed
+            else:
+                self._avg_call_seconds = 0.8 * self._avg_call_seconds + 0.2 * elapsed
+            self._cond.notify_all()
+
+    def _start(self, fn, args: tuple, kwargs: dict) -> Future:
+        """Run fn on the executor in an acquired slot, which is released when fn returns"""
+        with self._cond:
+            self._counters['admitted'] += 1
+        start = time.monotonic()
+        try:
+            # Run in a copy of the caller's context so request-scoped state follows the call
+            context = contextvars.copy_context()
+            future = self._executor.submit(context.run, _run_call, fn, args, kwargs)
+        except Exception:
+            self._release(0.0)
+            raise
+        future.add_done_callback(lambda _: self._release(time.monotonic() - start))
+        return future
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """
+        Start an upstream call only if a slot is free right now, without waiting for it
+
+        For speculative work (prefetch): it never queues, so it cannot delay a
+        waiting call, and no request thread is blocked on its result. It is
+        not counted as rejected when every slot is busy.
+
+        Args:
+            fn: Callable performing the upstream request
+
+        Returns:
+            Future: Result of fn
+
+        Raises:
+            UpstreamSaturated: Every slot is busy or calls are waiting for one
+        """
+        with self._cond:
+            if self._active >= self.max_concurrency or self._waiters:
+                raise UpstreamSaturated('Upstream model service is busy', self._retry_after())
+            self._active += 1
+        return self._start(fn, args, kwargs)
+
+    def call(self, fn, *args, priority: int = PRIORITY_INTERACTIVE, timeout: float = None, **kwargs):
+        """
+        Run an upstream call under admission control
+
+        Args:
+            fn: Callable performing the upstream request
+            priority: Queue priority (PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND)
+            timeout: Deadline in seconds for the call itself once admitted
+
+        Returns:
+            Whatever fn returns
+
+        Raises:
+            UpstreamSaturated: No slot could be obtained (queue full or wait deadline passed)
+            UpstreamTimeout: The call did not finish within its deadline
+        """
+        timeout = timeout or Config.UPSTREAM_CALL_TIMEOUT
+        with self._cond:
+            self._callers += 1
+        try:
+            return self._call(fn, args, kwargs, priority, timeout)
+        finally:
+            with self._cond:
+                self._callers -= 1
+
+    def _call(self, fn, args: tuple, kwargs: dict, priority: int, timeout: float):
+        self._acquire(priority, time.monotonic() + self.queue_timeout)
+
+        future = self._start(fn, args, kwargs)
+        # The slot stays taken until the call really returns, so a timed-out
+        # call still counts against the concurrency limit
+        abandoned = []
+
+        def finished(_):
+            with self._cond:
+                if abandoned:
+                    self._abandoned -= 1
+
+        future.add_done_callback(finished)
+
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            with self._cond:
+                self._counters['call_timeouts'] += 1
+                if not future.done():
+                    abandoned.append(True)
+                    self._abandoned += 1
+            raise UpstreamTimeout(f'Upstream call exceeded {timeout:g}s deadline')
+        except Exception:
+            with self._cond:
+                self._counters['failed'] += 1
+            raise
+
+    def stats(self) -> dict:
+        """Get a snapshot of slot usage and admission counters"""
+        with self._cond:
+            return {
+                'active': self._active,
+                'queued': len(self._waiters),
+                'waiting_threads': self._callers,
+                'abandoned': self._abandoned,
+                'max_concurrency': self.max_concurrency,
+                'max_queue': self.max_queue,
+                'avg_call_seconds': round(self._avg_call_seconds, 3) if self._avg_call_seconds else None,
+                **self._counters,
+            }
+
+
+# Shared scheduler for all DashScope calls made by the service
+scheduler = UpstreamScheduler(
+    max_concurrency=Config.UPSTREAM_MAX_CONCURRENCY,
+    max_queue=Config.UPSTREAM_MAX_QUEUE,
+    queue_timeout=Config.UPSTREAM_QUEUE_TIMEOUT,
+    request_threads=Config.SERVE_THREADS,
+)
@@ -0,0 +1,14 @@
+"""
+WSGI Entry Point
+Production entry point for pre-fork servers (see gunicorn.conf.py). When
+RAG_WARMUP_ON_START is enabled the school indexes are loaded here, in the
+parent process, so forked workers share them instead of loading their own
+"""
+from config import Config
+from app import app
+from rag_service import warmup
+
+if Config.RAG_WARMUP_ON_START:
+    print(f"[Startup] Warmed up knowledge bases: {warmup()}")
+
+application = app